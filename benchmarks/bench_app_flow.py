@@ -0,0 +1,103 @@
+"""Headless benchmark of the FlashMind AI user flow against the fake LLM backend.
+
+Drives src/app.py with streamlit.testing.v1.AppTest through
+paste text -> subject title -> chat -> flashcards and reports per-stage
+p50/p95 latency and overall throughput. AppTest cannot drive
+st.file_uploader, so documents enter through the paste-text path.
+
+    python benchmarks/bench_app_flow.py --iterations 20 --concurrency 4 --latency 0.2
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "src", "app.py")
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+from streamlit.testing.v1 import AppTest
+
+STAGES = ("start", "open_paste", "title", "chat", "flashcards")
+
+SAMPLE_PARAGRAPH = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose. "
+    "Chlorophyll in the chloroplasts absorbs mostly blue and red light. "
+    "The light-dependent reactions split water and release oxygen as a by-product. "
+    "The Calvin cycle fixes carbon dioxide into three-carbon sugars using ATP and NADPH. "
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_flow(iteration, args):
+    """Runs one full user flow and returns {stage: seconds}."""
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets["LLM_BACKEND"] = "fake"
+    at.secrets["FAKE_LLM_LATENCY_SECONDS"] = str(args.latency)
+    at.secrets["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second or "")
+    at.secrets["FAKE_LLM_FAILURE_RATE"] = str(args.failure_rate)
+    # Unique text per iteration so the flashcard cache does not hide generation cost
+    document = f"Lecture {iteration}. " + SAMPLE_PARAGRAPH * args.paragraphs
+
+    timings = {}
+
+    def timed(stage, action):
+        start = time.perf_counter()
+        action()
+        timings[stage] = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{stage} failed: {at.exception[0].message}")
+
+    timed("start", lambda: at.run())
+    timed("open_paste", lambda: at.button(key="hidden_paste_trigger").click().run())
+    at.text_area(key="pasted_text_input").input(document)
+    timed("title", lambda: at.button(key="submit_pasted_text").click().run())
+    timed("chat", lambda: at.chat_input(key="main_chat_input").set_value("What does chlorophyll absorb?").run())
+    timed("flashcards", lambda: at.button(key="generate_flashcards_initial_0").click().run())
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1, help="flows run in parallel")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="fake LLM output rate (0 = instant)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake LLM calls that fail")
+    parser.add_argument("--paragraphs", type=int, default=50, help="document size in sample paragraphs")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)  # the app loads images/, static/ and src/prompt.txt relative to the repo root
+    results = []
+    failures = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_flow, iteration, args) for iteration in range(args.iterations)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures += 1
+                print(f"flow failed: {e}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for stage in STAGES:
+        values = [timings[stage] * 1000 for timings in results if stage in timings]
+        if values:
+            print(f"{stage:<12}{percentile(values, 0.5):>10.1f}{percentile(values, 0.95):>10.1f}{statistics.mean(values):>10.1f}")
+    print(f"\n{len(results)} flows in {elapsed:.2f}s ({len(results) / elapsed:.2f} flows/s), {failures} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark of near-duplicate removal when merging large flashcard decks.
+
+Builds a synthetic deck where a share of cards are reworded copies of
+others (words dropped, added or reordered), then times merge_flashcards
+and reports how many planted duplicates were removed.
+
+    python benchmarks/bench_dedupe.py --cards 20000 --duplicates 0.3
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from flashcards import merge_flashcards
+
+VOCABULARY = [f"term{number}" for number in range(5000)]
+
+
+def make_card(rng):
+    question = " ".join(rng.sample(VOCABULARY, rng.randint(5, 9)))
+    answer = " ".join(rng.sample(VOCABULARY, rng.randint(6, 14)))
+    return {"question": f"What is {question}?", "answer": f"It is {answer}."}
+
+
+def reword(card, rng):
+    """A near-duplicate: one word dropped and the question reordered."""
+    question_words = card["question"].rstrip("?").split()[2:]
+    rng.shuffle(question_words)
+    answer_words = card["answer"].rstrip(".").split()[2:]
+    answer_words.pop(rng.randrange(len(answer_words)))
+    return {"question": f"Explain {' '.join(question_words)}?", "answer": f"Answer: {' '.join(answer_words)}."}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=20000)
+    parser.add_argument("--duplicates", type=float, default=0.3)
+    parser.add_argument("--sections", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    originals = [make_card(rng) for _ in range(int(args.cards * (1 - args.duplicates)))]
+    copies = [reword(rng.choice(originals), rng) for _ in range(args.cards - len(originals))]
+    deck = originals + copies
+    rng.shuffle(deck)
+    card_lists = [deck[section::args.sections] for section in range(args.sections)]
+    source_text = " ".join(card["question"] + " " + card["answer"] for card in rng.sample(originals, 500))
+
+    started = time.perf_counter()
+    merged = merge_flashcards(card_lists, None, source_text)
+    elapsed = time.perf_counter() - started
+
+    removed = len(deck) - len(merged)
+    print(f"{len(deck)} cards -> {len(merged)} kept, {removed} removed ({len(copies)} planted near-duplicates) in {elapsed * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Micro-benchmark of flashcard email rendering.
+
+Compares render_flashcard_email with the f-string `+=` builder it
+replaced (copied below) across deck sizes, with and without
+CSV/Anki attachments. The renderer also escapes card text and builds the
+plain-text part, which the baseline never did.
+
+    python benchmarks/bench_email_render.py --sizes 10 100 1000 10000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from email_templates import render_flashcard_email
+
+
+def baseline_render(flashcards_data, subject_title):
+    """The HTML builder this renderer replaced, copied from send_flashcards_email.
+
+    It did not escape card text or build a plain-text part; the renderer does both.
+    """
+    # Construct HTML email body
+    email_body_html = f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: 'Poppins', sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9; }}
+            h2 {{ color: #555; }}
+            .flashcard-section {{ margin-bottom: 20px; border: 1px dashed #ccc; padding: 15px; border-radius: 5px; background-color: #fff; }}
+            .question {{ font-weight: bold; color: #555; }}
+            .answer {{ color: #008000; margin-top: 5px; }}
+            .footer {{ margin-top: 30px; font-size: 0.9em; color: #777; text-align: center; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h2>Your Flashcards on "{subject_title}" from FlashMind AI</h2>
+            <p>Hello,</p>
+            <p>Here are the flashcards you requested:</p>
+    """
+
+    for i, card in enumerate(flashcards_data):
+        email_body_html += f"""
+            <div class="flashcard-section">
+                <p class="question"><strong>Q{i+1}:</strong> {card['question']}</p>
+                <p class="answer"><strong>A{i+1}:</strong> {card['answer']}</p>
+            </div>
+        """
+    
+    email_body_html += """
+            <p>Happy learning!</p>
+            <p>Best regards,<br>The FlashMind AI Team</p>
+            <div class="footer">
+                <p>This email was sent from FlashMind AI. <a href="https://github.com/bigm-o/Flash_mind.git">Visit our GitHub!</a></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    return email_body_html
+
+
+def make_deck(size):
+    return [{"question": f"What does <term {i}> & its neighbour mean?", "answer": f"It is \"definition\" number {i}, " * 3}
+            for i in range(size)]
+
+
+def best_ms(fn, repeat):
+    number = 1
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) * 1000 / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'cards':>7} {'baseline':>10} {'render':>10} {'+csv/anki':>10} {'us/card':>8}")
+    for size in args.sizes:
+        deck = make_deck(size)
+        baseline = best_ms(lambda: baseline_render(deck, "Biology"), args.repeat)
+        rendered = best_ms(lambda: render_flashcard_email(deck, "Biology"), args.repeat)
+        attached = best_ms(lambda: render_flashcard_email(deck, "Biology", ("csv", "anki")), args.repeat)
+        print(f"{size:>7} {baseline:>8.2f}ms {rendered:>8.2f}ms {attached:>8.2f}ms {attached * 1000 / size:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark of the spaced-repetition scheduler with a large deck.
+
+Adds N cards for one learner, simulates days of reviews, and reports the
+per-operation cost of fetching the next due card and recording an answer,
+the memory held by the card states, and the time to save and reload the
+learner's state from a DocumentStore.
+
+    python benchmarks/bench_review.py --cards 100000 --reviews 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from review import DAY_SECONDS, QUALITY_AGAIN, QUALITY_EASY, QUALITY_GOOD, QUALITY_HARD, ReviewScheduler
+from store import DocumentStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    cards = [{"question": f"What is concept {index}?", "answer": f"Concept {index} is explained here."} for index in range(args.cards)]
+    now = time.time()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    scheduler = ReviewScheduler()
+    scheduler.add_cards(cards, now=now)
+    add_seconds = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    qualities = [QUALITY_AGAIN, QUALITY_HARD, QUALITY_GOOD, QUALITY_GOOD, QUALITY_EASY]
+    next_seconds = review_seconds = 0.0
+    reviewed = 0
+    clock = now
+    while reviewed < args.reviews:
+        started = time.perf_counter()
+        card = scheduler.next_due(clock)
+        next_seconds += time.perf_counter() - started
+        if card is None:
+            clock += DAY_SECONDS  # nothing due: jump to the next day
+            continue
+        started = time.perf_counter()
+        scheduler.review(card.card_id, rng.choice(qualities), clock)
+        review_seconds += time.perf_counter() - started
+        reviewed += 1
+        clock += 5
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = DocumentStore(os.path.join(directory, "bench.sqlite3"))
+        started = time.perf_counter()
+        store.save_review_cards("learner", scheduler.take_dirty_rows())
+        save_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        reloaded = ReviewScheduler(store.load_review_cards("learner"))
+        load_seconds = time.perf_counter() - started
+
+    print(f"{args.cards} cards added in {add_seconds * 1000:.0f}ms, {memory / args.cards:.0f} bytes/card")
+    print(f"next_due {next_seconds / reviewed * 1e6:.1f}us, review {review_seconds / reviewed * 1e6:.1f}us (mean of {reviewed})")
+    print(f"due now after {(clock - now) / DAY_SECONDS:.1f} simulated days: {scheduler.due_count(clock)}")
+    print(f"save all {save_seconds * 1000:.0f}ms, reload {load_seconds * 1000:.0f}ms ({len(reloaded)} cards)")
+
+
+if __name__ == "__main__":
+    main()
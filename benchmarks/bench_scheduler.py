@@ -0,0 +1,71 @@
+"""Load test of the request scheduler against a fake backend that injects 429s.
+
+Fires a burst of background and interactive requests through one
+RequestScheduler and reports success rate, retries, coalesced requests and
+per-priority latency.
+
+    python benchmarks/bench_scheduler.py --requests 200 --failure-rate 0.3 --rpm 600
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from llm import FakeBackend
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RequestScheduler
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="fraction of requests repeating an earlier prompt")
+    parser.add_argument("--failure-rate", type=float, default=0.3, help="fraction of calls answered with a 429")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rpm", type=float, default=600)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    backend = FakeBackend(latency_seconds=args.latency, failure_rate=args.failure_rate, failure_code=429, seed=1)
+    scheduler = RequestScheduler(requests_per_minute=args.rpm, max_concurrency=args.concurrency,
+                                 max_retries=6, base_delay_seconds=0.05, max_delay_seconds=1.0)
+
+    latencies = {PRIORITY_INTERACTIVE: [], PRIORITY_BACKGROUND: []}
+    failures = 0
+
+    def one(index):
+        priority = PRIORITY_INTERACTIVE if index % 4 == 0 else PRIORITY_BACKGROUND
+        prompt_id = index if (index % 100) / 100 >= args.duplicates else 0
+        start = time.perf_counter()
+        scheduler.submit(backend, f"Question number {prompt_id} about the document.", priority).result()
+        return priority, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        for future in [executor.submit(one, index) for index in range(args.requests)]:
+            try:
+                priority, seconds = future.result()
+                latencies[priority].append(seconds * 1000)
+            except Exception as e:
+                failures += 1
+                print(f"request failed: {e}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    for priority, name in ((PRIORITY_INTERACTIVE, "interactive"), (PRIORITY_BACKGROUND, "background")):
+        values = latencies[priority]
+        if values:
+            print(f"{name:<12} n={len(values):<5} p50={percentile(values, 0.5):8.1f}ms p95={percentile(values, 0.95):8.1f}ms mean={statistics.mean(values):8.1f}ms")
+    print(f"\n{args.requests - failures}/{args.requests} succeeded in {elapsed:.2f}s, "
+          f"{scheduler.retries} retries, {scheduler.coalesced} coalesced, {backend.calls} backend calls")
+
+
+if __name__ == "__main__":
+    main()
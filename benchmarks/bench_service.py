@@ -0,0 +1,123 @@
+"""Load test of the shared service with many sessions and a fake LLM.
+
+Each simulated session runs on its own thread, as a Streamlit script does,
+and makes a few chat turns (streamed) and one background call through
+FlashMindService. The same load is run for several model worker pool
+sizes: throughput follows the pool size, not the number of session
+threads.
+
+A second run measures fairness. One "heavy" session queues a big batch of
+background calls at once while light sessions make one call at a time.
+With one queue per session the light sessions are served in turn with the
+heavy one; with everything in a single queue (the old behaviour) they
+wait behind the whole batch. Calls beyond the per-session limit are
+turned away rather than queued.
+
+    python benchmarks/bench_service.py --sessions 32 --workers 1,2,4,8,16 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from llm import FakeBackend
+from scheduler import PRIORITY_BACKGROUND, SchedulerBusy
+from service import FlashMindService
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))] if ordered else 0.0
+
+
+def run_sessions(threads):
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def throughput(workers, args):
+    backend = FakeBackend(latency_seconds=args.latency)
+    service = FlashMindService(backend, llm_workers=workers, extraction_workers=1, requests_per_minute=1e9)
+    latencies = []
+    lock = threading.Lock()
+
+    def session(index):
+        llm = service.llm_for(f"session-{index}")
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            "".join(llm.stream(f"Session {index} asks question {turn} about the document."))
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        llm.with_priority(PRIORITY_BACKGROUND).generate(f"Create flashcards for session {index}.")
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    run_sessions([threading.Thread(target=session, args=(index,)) for index in range(args.sessions)])
+    elapsed = time.perf_counter() - started
+    service.shutdown()
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.95)
+
+
+def fairness(per_session_queues, max_queued_per_session, args):
+    backend = FakeBackend(latency_seconds=args.latency)
+    service = FlashMindService(backend, llm_workers=args.fair_workers, extraction_workers=1, requests_per_minute=1e9,
+                               max_queued_per_session=max_queued_per_session, max_queued=None)
+    heavy = service.llm_for("heavy" if per_session_queues else None, PRIORITY_BACKGROUND)
+    futures, rejected = [], 0
+    for index in range(args.heavy_jobs):
+        try:
+            futures.append(heavy.submit(f"Heavy section {index}."))
+        except SchedulerBusy:
+            rejected += 1
+    light_latencies = []
+    lock = threading.Lock()
+
+    def light(index):
+        llm = service.llm_for(f"light-{index}" if per_session_queues else None, PRIORITY_BACKGROUND)
+        for call in range(3):
+            started = time.perf_counter()
+            llm.generate(f"Light session {index} call {call}.")
+            with lock:
+                light_latencies.append(time.perf_counter() - started)
+
+    run_sessions([threading.Thread(target=light, args=(index,)) for index in range(args.light_sessions)])
+    for future in futures:
+        future.result()
+    service.shutdown()
+    return percentile(light_latencies, 0.5), percentile(light_latencies, 0.95), rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--workers", default="1,2,4,8,16", help="comma-separated model worker pool sizes")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call, in seconds")
+    parser.add_argument("--heavy-jobs", type=int, default=64)
+    parser.add_argument("--light-sessions", type=int, default=4)
+    parser.add_argument("--fair-workers", type=int, default=4)
+    parser.add_argument("--max-queued-per-session", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{args.sessions} session threads, {args.turns + 1} calls each, {args.latency * 1000:.0f}ms per call")
+    for workers in (int(value) for value in args.workers.split(",")):
+        calls_per_second, p50, p95 = throughput(workers, args)
+        print(f"workers={workers:<3} {calls_per_second:7.1f} calls/s  p50={p50 * 1000:7.1f}ms  p95={p95 * 1000:7.1f}ms")
+
+    print(f"\nfairness: 1 session queues {args.heavy_jobs} calls, {args.light_sessions} sessions make 3 calls each, "
+          f"{args.fair_workers} workers")
+    for per_session_queues, limit, label in ((False, None, "single queue"), (True, None, "per-session queues"),
+                                             (True, args.max_queued_per_session, f"  + limit of {args.max_queued_per_session}")):
+        p50, p95, rejected = fairness(per_session_queues, limit, args)
+        print(f"{label:<19} light p50={p50 * 1000:7.1f}ms  p95={p95 * 1000:7.1f}ms  heavy calls turned away={rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,75 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-from PIL import Image
-import io
-import base64
+import functools
+import logging
 import random
-from docx import Document # For .docx files
-from PyPDF2 import PdfReader # For .pdf files
-import streamlit.components.v1 as components
 import json
-
-# Import SendGrid libraries
-import sendgrid
-from sendgrid.helpers.mail import Mail, Email, To, Content
+import time
 
 from streamlit_extras.stylable_container import stylable_container
 
+from context_cache import ContextCacheManager, GeminiContextCacheBackend, PrefixReplayBackend
+from extraction import BackgroundExtraction, file_hash, iter_document_pages
+from flashcard_cache import FlashcardCache, SQLiteDiskCache, flashcard_cache_key
+from resources import (
+    background_variants, encoded_image, get_gemini_model, preload_background_variants, preload_backgrounds, read_text
+)
+from titling import TITLE_SAMPLE_CHARS, heuristic_title, infer_subject_title
+from history import ConversationHistory
+from llm import GeminiBackend, count_tokens, fake_backend_from_settings, prompt_text
+from store import DocumentStore, text_hash
+from streaming import StreamRenderer
+from mailer import FileTransport, MailQueue, SMTPTransport, SendGridTransport
+from email_templates import ATTACHMENT_FORMATS, EMAIL_SUBJECT, render_flashcard_email
+from flashcard_deck import DeckView, flashcard_deck
+from ocr import ModelEngine, OCRPipeline, OCRStats, TesseractEngine, tesseract_available
+from preprocess import PageCleaner
+from workspace import Workspace
+import tracing
+from dedupe import dedupe_flashcards
+from review import QUALITY_AGAIN, QUALITY_EASY, QUALITY_GOOD, QUALITY_HARD, ReviewScheduler
+from scheduler import PRIORITY_BACKGROUND, SchedulerBusy
+from service import FlashMindService
+from flashcards import FLASHCARD_PROMPT_TEMPLATE, FLASHCARD_SCHEMA, MAP_CHUNK_SIZE, generate_flashcards_map_reduce, key_terms
+
+def get_setting(name, default=None):
+    """Looks up an optional setting in .streamlit/secrets.toml, then in the environment."""
+    try:
+        value = st.secrets.get(name)
+    except Exception: # No secrets file at all
+        value = None
+    return value or os.getenv(name) or default
+
 # --- Gemini API Configuration ---
 gemini_api_key = st.secrets.get("GEMINI_API_KEY") or os.getenv("GEMINI_API_key")
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+# "gemini" calls the real API; "fake" uses the deterministic offline backend for load tests and benchmarks
+LLM_BACKEND = get_setting("LLM_BACKEND", "gemini")
 
 st.set_page_config(page_title="🧠 FlashMind AI", layout="centered")
 
+# --- Tracing ---
+@st.cache_resource
+def get_tracer():
+    """Process-wide tracer with its exporters; TRACING=off turns every span into a no-op."""
+    tracer = tracing.configure(tracing.Tracer(enabled=get_setting("TRACING", "on") != "off",
+                                              jsonl_path=get_setting("TRACE_JSONL_PATH")))
+    metrics_path = get_setting("METRICS_PATH")
+    if tracer.enabled and (tracer.jsonl_path or metrics_path):
+        tracer.start_exporter(float(get_setting("METRICS_EXPORT_SECONDS", 10)), metrics_path)
+    metrics_port = get_setting("METRICS_PORT")
+    if tracer.enabled and metrics_port:
+        metrics_host = get_setting("METRICS_HOST", "127.0.0.1")
+        try:
+            tracer.serve_prometheus(int(metrics_port), metrics_host)
+        except OSError as e:
+            # Another process (e.g. a second replica) holds the port; the app runs without the endpoint
+            logging.getLogger(__name__).warning("Metrics endpoint not started on %s:%s: %s", metrics_host, metrics_port, e)
+    return tracer
+
+tracer = get_tracer()
+tracer.count("app.rerun")
+
 st.markdown(
     """
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
@@ -30,22 +79,11 @@ st.markdown(
 
 # --- Image Encoding Function (keep for background) ---
 def get_base64_image(image_path):
-    """Encodes a local image file to a base64 string for CSS background."""
+    """Returns the base64 data URI for a background image, encoded once per process."""
     try:
-        # Determine MIME type based on file extension
-        if image_path.lower().endswith(('.png')):
-            mime_type = "image/png"
-        elif image_path.lower().endswith(('.jpg', '.jpeg')):
-            mime_type = "image/jpeg"
-        elif image_path.lower().endswith(('.gif')):
-            mime_type = "image/gif"
-        else:
-            mime_type = "image/jpeg"
+        if not image_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
             st.warning(f"Unknown image type for {image_path}. Defaulting to image/jpeg.")
-
-        with open(image_path, "rb") as img_file:
-            encoded_string = base64.b64encode(img_file.read()).decode()
-        return f"data:{mime_type};base64,{encoded_string}"
+        return encoded_image(image_path)
     except FileNotFoundError:
         st.error(f"Background image not found at: {image_path}. Please ensure the file exists.")
         return ""
@@ -53,10 +91,36 @@ def get_base64_image(image_path):
         st.error(f"Error encoding background image: {e}")
         return ""
 
+# "static" serves resized WebP/AVIF files from src/static; "inline" embeds a base64 data URI
+BACKGROUND_MODE = get_setting("BACKGROUND_MODE", "static")
+
+def background_image_css(image_path):
+    """Returns the CSS background declarations for the app container."""
+    if BACKGROUND_MODE == "static":
+        try:
+            variants = background_variants(image_path)
+        except Exception as e:
+            st.warning(f"Could not prepare static background images ({e}). Falling back to an inline image.")
+        else:
+            def image_set(urls):
+                sources = ", ".join(f'url("{url}") type("image/{"jpeg" if fmt == "jpg" else fmt}")' for fmt, url in urls.items())
+                return f'background-image: url("{urls["jpg"]}"); background-image: image-set({sources});'
+
+            widths = sorted(variants)
+            rules = [f'[data-testid="stApp"] {{ {image_set(variants[widths[-1]])} }}']
+            for width in reversed(widths[:-1]):
+                rules.append(f'@media (max-width: {width}px) {{ [data-testid="stApp"] {{ {image_set(variants[width])} }} }}')
+            return "\n".join(rules)
+    encoded_background_image = get_base64_image(image_path)
+    return f'[data-testid="stApp"] {{ background-image: url("{encoded_background_image}"); /* Using Base64 encoded image */ }}'
+
 # --- Specify your local background image path ---
+if BACKGROUND_MODE == "static":
+    preload_background_variants()
+else:
+    preload_backgrounds()
 image_number = random.randint(1, 6)
 BACKGROUND_IMAGE_PATH = f"images/image{image_number}.jpg"
-encoded_background_image = get_base64_image(BACKGROUND_IMAGE_PATH)
 
 st.markdown(f"""
 <style>
@@ -71,13 +135,13 @@ st.markdown(f"""
 
     /* Target Streamlit's main container for background image */
     [data-testid="stApp"] {{
-        background-image: url("{encoded_background_image}"); /* Using Base64 encoded image */
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
         background-attachment: fixed;
         color: #e0e0e0;
     }}
+    {background_image_css(BACKGROUND_IMAGE_PATH)}
 </style>
 """, unsafe_allow_html=True)
 
@@ -85,8 +149,7 @@ st.markdown(f"""
 def load_css(file_path):
     """Loads custom CSS from a specified file."""
     try:
-        with open(file_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_text(file_path)}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         st.error(f"Error: CSS file not found at '{file_path}'. Please ensure the file exists.")
     except Exception as e:
@@ -128,22 +191,47 @@ st.markdown(
 )
 
 
-# Check if API key is available from secrets/environment variables
-if not gemini_api_key:
-    st.error("Gemini API Key not found. Please ensure it's set in your `.streamlit/secrets.toml` file or as an environment variable.")
-    st.stop()
+@st.cache_resource
+def get_fake_llm():
+    """Deterministic offline backend shared by all sessions, configured by the FAKE_LLM_* settings."""
+    return fake_backend_from_settings(get_setting)
 
-try:
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-except Exception as e:
-    st.error(f"Error configuring Gemini API: {e}. Please verify your API key's validity.")
-    st.stop()
+if LLM_BACKEND == "fake":
+    base_llm = get_fake_llm()
+else:
+    # Check if API key is available from secrets/environment variables
+    if not gemini_api_key:
+        st.error("Gemini API Key not found. Please ensure it's set in your `.streamlit/secrets.toml` file or as an environment variable.")
+        st.stop()
+
+    try:
+        base_llm = GeminiBackend(get_gemini_model(gemini_api_key, GEMINI_MODEL_NAME))
+    except Exception as e:
+        st.error(f"Error configuring Gemini API: {e}. Please verify your API key's validity.")
+        st.stop()
+
+@st.cache_resource
+def get_service():
+    """Pools, request queues and caches shared by every session of this server process."""
+    max_queued = int(get_setting("LLM_MAX_QUEUED", 256))
+    max_queued_per_session = int(get_setting("LLM_MAX_QUEUED_PER_SESSION", 16))
+    return FlashMindService(
+        base_llm,
+        llm_workers=int(get_setting("LLM_MAX_CONCURRENCY", 8)),
+        extraction_workers=int(get_setting("EXTRACTION_WORKERS", 0)) or None,
+        reader_workers=int(get_setting("READER_WORKERS", 4)),
+        background_workers=int(get_setting("BACKGROUND_WORKERS", 8)),
+        requests_per_minute=float(get_setting("LLM_REQUESTS_PER_MINUTE", 60)),
+        tokens_per_minute=float(get_setting("LLM_TOKENS_PER_MINUTE", 1000000)),
+        max_queued_per_session=max_queued_per_session or None,
+        max_queued=max_queued or None,
+    )
+
+service = get_service()
 
 # --- Read the prompt from prompt.txt ---
 try:
-    with open("src/prompt.txt", "r") as f:
-        system_instruction_prompt = f.read().strip()
+    system_instruction_prompt = read_text("src/prompt.txt").strip()
 except FileNotFoundError:
     st.error("Error: 'src/prompt.txt' not found. Please make sure the prompt file is in the 'src' directory.")
     st.stop()
@@ -152,48 +240,325 @@ except Exception as e:
     st.stop()
 
 # --- Functions for Document Text Extraction ---
-def extract_text_from_pdf(file_bytes):
-    """Extracts text from a PDF file."""
-    text = ""
-    try:
-        reader = PdfReader(io.BytesIO(file_bytes))
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {e}")
+# Pages extracted before the chat opens; the rest keep streaming in as a background job
+FIRST_PAGES_BEFORE_CHAT = 5
+# Longest the script waits for those pages (and the title sample) before going on with what has arrived
+FIRST_PAGES_TIMEOUT_SECONDS = float(get_setting("FIRST_PAGES_TIMEOUT_SECONDS", 20))
+
+@st.cache_resource
+def get_ocr_pipeline():
+    """OCR for scanned PDF pages: local Tesseract when installed, otherwise the model. None when OCR_ENGINE is off."""
+    engine_name = get_setting("OCR_ENGINE", "auto")
+    if engine_name == "off":
         return None
+    if engine_name == "tesseract" or (engine_name == "auto" and tesseract_available()):
+        engine = TesseractEngine(service.extraction_pool, language=get_setting("OCR_LANGUAGE", "eng"))
+    else:
+        # Pages wait in the uploading session's queue, behind its chat turns
+        engine = ModelEngine(service.llm_for(priority=PRIORITY_BACKGROUND), max_concurrency=int(get_setting("OCR_CONCURRENCY", 4)))
+    # Recognised pages are kept on disk by image hash, so the same scan is never recognised twice
+    disk_cache = SQLiteDiskCache(get_setting("OCR_CACHE_PATH", "data/ocr_cache.sqlite3"), ttl_seconds=0,
+                                 max_bytes=int(float(get_setting("OCR_CACHE_MAX_MB", 100)) * 1024 * 1024))
+    return OCRPipeline(engine, FlashcardCache(max_entries=1024, disk_cache=disk_cache),
+                       max_pending=2 * int(get_setting("OCR_CONCURRENCY", 4)))
+
+def sync_pending_extractions():
+    """Appends pages that finished extracting in the background to their documents, indexing only the new text."""
+    workspace = st.session_state.workspace
+    for doc_id, extraction in list(st.session_state.pending_extractions.items()):
+        page_count = st.session_state.extracted_page_counts.get(doc_id, 0)
+        new_pages = extraction.snapshot(page_count)
+        if new_pages:
+            page_count += len(new_pages)
+            st.session_state.extracted_page_counts[doc_id] = page_count
+            workspace.extend_document(doc_id, "".join(new_pages))
+        if extraction.done and page_count >= len(extraction.pages):
+            del st.session_state.pending_extractions[doc_id]
+            if extraction.error:
+                st.warning(f"Only part of '{workspace.documents[doc_id].name}' could be read: {extraction.error}")
+            else:
+                persist_document(doc_id)
+
+def ingest_uploads(uploaded_files, workspace, infer_title=False):
+    """Adds uploaded files to the workspace, extracting all of them concurrently.
 
-def extract_text_from_docx(file_bytes):
-    """Extracts text from a DOCX file."""
-    text = ""
+    Files already in the store are added straight away. The others are read
+    as background jobs on the shared reader pool and added as soon as their first pages
+    are in (or FIRST_PAGES_TIMEOUT_SECONDS have passed); sync_pending_extractions picks up the rest. With infer_title, returns the
+    title inference future started from the openings of the new files.
+    """
+    store = get_document_store()
+    started = []
+    for uploaded_file in uploaded_files:
+        file_bytes = uploaded_file.getvalue()
+        doc_id = file_hash(file_bytes)
+        if doc_id in workspace or any(doc_id == started_id for started_id, _, _ in started):
+            continue
+
+        # Someone already uploaded this exact file: reuse its text, chunks and title
+        stored_document = store.get_document(doc_id) if store is not None else None
+        tracing.count("cache.document_store.hit" if stored_document is not None else "cache.document_store.miss")
+        if stored_document is not None:
+            workspace.add_document(doc_id, uploaded_file.name, stored_document["text"], stored_document["chunks"],
+                                   stored_document["title"])
+            continue
+
+        ocr_stats = OCRStats()
+        try:
+            pages = iter_document_pages(uploaded_file.name, file_bytes, service.extraction_pool, service.page_cache,
+                                        get_ocr_pipeline(), ocr_stats, st.session_state.session_id)
+        except ValueError:
+            st.error(f"'{uploaded_file.name}' is not a supported file type.")
+            continue
+        # Headers and footers are only recognisable across pages, which TXT and DOCX don't have
+        cleaner = PageCleaner(warmup_pages=FIRST_PAGES_BEFORE_CHAT, detect_boilerplate=uploaded_file.name.lower().endswith(".pdf"))
+        try:
+            # Read on the shared reader pool, counted against this session's job limit
+            extraction = BackgroundExtraction(cleaner.clean_pages(pages),
+                                              functools.partial(service.submit_extraction, st.session_state.session_id))
+        except SchedulerBusy as e:
+            st.warning(f"'{uploaded_file.name}' was not added: {e}")
+            continue
+        st.session_state.ocr_stats[doc_id] = ocr_stats
+        st.session_state.preprocess_stats[doc_id] = cleaner.stats
+        started.append((doc_id, uploaded_file.name, extraction))
+
+    # One deadline for all the waits below; a slow file is added with the pages it has so far
+    deadline = time.monotonic() + FIRST_PAGES_TIMEOUT_SECONDS
+
+    # Title inference only needs the opening text, so start it before the first pages are all in
+    title_future = None
+    if infer_title and started:
+        share = TITLE_SAMPLE_CHARS // len(started)
+        for _, _, extraction in started:
+            extraction.wait_for_chars(share, max(0.0, deadline - time.monotonic()))
+        sample = "\n\n".join(extraction.text()[:share] for _, _, extraction in started)
+        title_future = start_title_inference(sample) if sample.strip() else None
+
+    # Every file is already extracting; add each one once its first pages are ready
+    for doc_id, name, extraction in started:
+        with tracing.span("extraction.first_pages"):
+            extraction.wait_for(FIRST_PAGES_BEFORE_CHAT, max(0.0, deadline - time.monotonic()))
+        first_pages = extraction.snapshot()
+        text = "".join(first_pages)
+        if not text.strip() and extraction.done:
+            if extraction.error:
+                st.error(f"Error extracting text from '{name}': {extraction.error}")
+            else:
+                st.error(f"No text could be extracted from '{name}'.")
+            continue
+        if not text.strip():
+            st.info(f"'{name}' is taking a while to read; its pages will be added as they come in.")
+        workspace.add_document(doc_id, name, text)
+        st.session_state.extracted_page_counts[doc_id] = len(first_pages)
+        st.session_state.pending_extractions[doc_id] = extraction
+    return title_future
+
+# --- Retrieval over the workspace documents ---
+RETRIEVAL_TOP_K = 6
+
+@st.cache_resource
+def get_embedding_function():
+    """Returns a local sentence embedding function if EMBEDDING_MODEL is configured, otherwise None."""
+    model_name = get_setting("EMBEDDING_MODEL")
+    if not model_name:
+        return None
     try:
-        document = Document(io.BytesIO(file_bytes))
-        for paragraph in document.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text from DOCX: {e}")
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        st.warning("EMBEDDING_MODEL is set but `sentence-transformers` is not installed. Using keyword retrieval only.")
+        return None
+    embedder = SentenceTransformer(model_name)
+    return lambda texts: embedder.encode(texts, convert_to_numpy=True)
+
+def new_workspace():
+    """An empty workspace; documents added to it are chunked and indexed once, as they arrive."""
+    return Workspace(embed_fn=get_embedding_function())
+
+def document_context_for(question):
+    """Returns the text to send with a chat turn: relevant passages, or the whole of the targeted documents."""
+    workspace = st.session_state.workspace
+    if st.session_state.full_context_mode:
+        return workspace.text(st.session_state.target_documents)
+    passages = workspace.retrieve(question, top_k=RETRIEVAL_TOP_K, doc_ids=st.session_state.target_documents)
+    return "\n\n[...]\n\n".join(passages)
+
+# --- Persistent Store ---
+@st.cache_resource
+def get_document_store():
+    """SQLite store of documents, chunks, titles, decks and sessions; None when STORE_PATH is "off"."""
+    path = get_setting("STORE_PATH", "data/flashmind.sqlite3")
+    if path == "off":
         return None
+    return DocumentStore(path, max_bytes=int(float(get_setting("STORE_MAX_MB", 500)) * 1024 * 1024))
 
-def extract_text_from_txt(file_bytes):
-    """Extracts text from a TXT file."""
+def persist_document(doc_id):
+    """Saves a fully loaded document with its chunks and title so repeat uploads skip all the work."""
+    store = get_document_store()
+    workspace = st.session_state.workspace
+    if store is None or workspace is None or doc_id not in workspace:
+        return
+    document = workspace.documents[doc_id]
+    title = document.title
+    # The session title only describes the document when it is the only one; a provisional keyword title is not worth keeping
+    if len(workspace) == 1 and st.session_state.title_inferred:
+        title = st.session_state.subject_title
+    store.put_document(doc_id, document.text, name=document.name, chunks=workspace.document_chunks(doc_id), title=title)
+
+def save_session():
+    """Saves the conversation so it can be resumed from the ?session= link."""
+    store = get_document_store()
+    workspace = st.session_state.workspace
+    if store is None or not workspace:
+        return
+    text_messages = [
+        {"role": message["role"], "parts": [part for part in message["parts"] if "text" in part]}
+        for message in st.session_state.messages
+    ]
+    doc_ids = list(workspace.documents)
+    store.save_session(st.session_state.session_id, doc_ids[0], {
+        "documents": doc_ids,
+        "messages": text_messages,
+        "subject_title": st.session_state.subject_title,
+        "title_inferred": st.session_state.title_inferred,
+        "generated_flashcards_data": st.session_state.generated_flashcards_data,
+        "initial_flashcards_generated": st.session_state.initial_flashcards_generated,
+    })
+
+def resume_session(session_id):
+    """Restores a saved conversation and its documents. Returns True on success."""
+    store = get_document_store()
+    saved = store.load_session(session_id) if store is not None else None
+    if saved is None:
+        return False
+    doc_hash, state = saved
+    workspace = new_workspace()
+    for doc_id in state.get("documents", [doc_hash]):
+        document = store.get_document(doc_id)
+        # Documents evicted from the store since are left out
+        if document is not None:
+            workspace.add_document(doc_id, document["name"] or "Pasted text", document["text"], document["chunks"],
+                                   document["title"])
+    if not workspace:
+        return False
+    st.session_state.workspace = workspace
+    st.session_state.subject_title = state["subject_title"]
+    st.session_state.title_inferred = state.get("title_inferred", False)
+    st.session_state.messages = state["messages"]
+    st.session_state.generated_flashcards_data = state["generated_flashcards_data"]
+    st.session_state.initial_flashcards_generated = state["initial_flashcards_generated"]
+    st.session_state.history = new_conversation_history()
+    for message in st.session_state.messages[1:]:
+        st.session_state.history.append("user" if message["role"] == "user" else "model", message["parts"])
+    st.session_state.app_state = "chatting"
+    return True
+
+# --- Subject Titling ---
+def start_title_inference(text):
+    """Starts inferring the subject title in the background and returns the future, or None when the server is busy."""
     try:
-        # Decode as UTF-8, with error handling for common issues
-        return file_bytes.decode('utf-8', errors='replace')
+        return service.submit(st.session_state.session_id, infer_subject_title, background_llm, text[:TITLE_SAMPLE_CHARS])
+    except SchedulerBusy:
+        return None # the keyword title stays
+
+def new_conversation_history():
+    """History sent to the model each turn, compacted into a summary in the background as it grows."""
+    return ConversationHistory(
+        summarize_fn=background_llm.generate,
+        submit=functools.partial(service.submit, st.session_state.session_id),
+        token_budget=int(get_setting("CHAT_HISTORY_TOKEN_BUDGET", 4000)),
+    )
+
+def greeting_for(subject_title):
+    return f"Oh, I see you want to learn about **{subject_title}**. What would you like to know about this subject matter?"
+
+def start_chat_session(workspace, fallback_title, title_future, known_title=None, new_doc_ids=()):
+    """Opens the chat over a workspace of documents.
+
+    A single document already in the store comes with its title; otherwise
+    the chat opens with a provisional keyword title while title_future runs.
+    new_doc_ids are documents loaded in full that are not in the store yet.
+    """
+    st.session_state.workspace = workspace
+    st.session_state.target_documents = []
+    st.session_state.subject_title = known_title or heuristic_title(workspace.text(), fallback=fallback_title)
+    st.session_state.title_future = None if known_title else title_future
+    st.session_state.title_inferred = bool(known_title)
+
+    st.session_state.messages = []
+    st.session_state.history = new_conversation_history()
+    st.session_state.flashcards_for_message_idx = -1
+    st.session_state.initial_flashcards_generated = False # Reset for new document
+    st.session_state.generated_flashcards_data = []
+    st.session_state.session_decks = {}
+    st.session_state.messages.append({"role": "assistant", "parts": [{"text": greeting_for(st.session_state.subject_title)}]})
+    st.session_state.app_state = "chatting"
+    for doc_id in new_doc_ids:
+        if doc_id not in st.session_state.pending_extractions:
+            persist_document(doc_id)
+    save_session()
+    st.rerun()
+
+def apply_inferred_title():
+    """Swaps the provisional title for the model's once it is ready. Returns True if anything changed."""
+    future = st.session_state.title_future
+    if future is None or not future.done():
+        return False
+    st.session_state.title_future = None
+    try:
+        inferred_title = future.result()
     except Exception as e:
-        st.error(f"Error extracting text from TXT: {e}")
-        return None
+        st.warning(f"Could not infer subject title: {e}. Proceeding without a specific title.")
+        return False
+    if not inferred_title:
+        return False
+    st.session_state.title_inferred = True
+    store = get_document_store()
+    workspace = st.session_state.workspace
+    # A title inferred from several documents describes the workspace, not any one of them
+    if store is not None and workspace is not None and len(workspace) == 1:
+        store.set_title(next(iter(workspace.documents)), inferred_title)
+    if inferred_title == st.session_state.subject_title:
+        save_session()
+        return False
+    old_greeting = greeting_for(st.session_state.subject_title)
+    st.session_state.subject_title = inferred_title
+    messages = st.session_state.messages
+    if messages and messages[0]["role"] == "assistant" and messages[0]["parts"][0]["text"] == old_greeting:
+        messages[0]["parts"][0]["text"] = greeting_for(inferred_title)
+    save_session()
+    return True
+
+@st.fragment(run_every=0.5)
+def watch_title_inference():
+    """Polls the background title inference and reruns the app once the title arrives."""
+    if st.session_state.title_future is not None and apply_inferred_title():
+        st.rerun()
 
 # --- Session State Initialization ---
+# Every session gets an id in the URL; opening a ?session= link restores that conversation
+new_session = "session_id" not in st.session_state
+if new_session:
+    requested_session = st.query_params.get("session")
+    st.session_state.session_id = requested_session or DocumentStore.new_session_id()
+
+# Every model call waits in this session's own queue, so the shared workers serve sessions in turn.
+# Chat turns are served ahead of background work such as titles and flashcards.
+llm = service.llm_for(st.session_state.session_id)
+background_llm = llm.with_priority(PRIORITY_BACKGROUND)
+
 if "app_state" not in st.session_state:
     st.session_state.app_state = "initial_input"
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "document_text" not in st.session_state:
-    st.session_state.document_text = None
+if "workspace" not in st.session_state:
+    st.session_state.workspace = None # Workspace with the documents being studied and their combined chunk index
+if "target_documents" not in st.session_state:
+    st.session_state.target_documents = [] # Ids of the documents chat and flashcards are limited to; empty means all
 if "subject_title" not in st.session_state:
     st.session_state.subject_title = None
+if "title_inferred" not in st.session_state:
+    st.session_state.title_inferred = False # True once subject_title came from the model (or the store), not just keywords
 
 if "first_chat_used" not in st.session_state:
     st.session_state.first_chat_used = False
@@ -205,85 +570,290 @@ if "show_email_form" not in st.session_state:
     st.session_state.show_email_form = False
 if "generated_flashcards_data" not in st.session_state:
     st.session_state.generated_flashcards_data = [] # Store the generated flashcards
-
-# --- Email Sending Utility (SendGrid Integration) ---
-def send_flashcards_email(recipient_email, flashcards_data, subject_title="FlashMind AI Flashcards"):
+if "history" not in st.session_state:
+    st.session_state.history = new_conversation_history()
+if "title_future" not in st.session_state:
+    st.session_state.title_future = None # Background subject title inference for the loaded document
+if "pending_extractions" not in st.session_state:
+    st.session_state.pending_extractions = {} # doc id -> BackgroundExtraction still reading the rest of an uploaded file
+if "extracted_page_counts" not in st.session_state:
+    st.session_state.extracted_page_counts = {} # doc id -> pages of it already added to the workspace
+if "ocr_stats" not in st.session_state:
+    st.session_state.ocr_stats = {} # doc id -> OCRStats: scanned pages recognised, cached, blank or unreadable
+if "preprocess_stats" not in st.session_state:
+    st.session_state.preprocess_stats = {} # doc id -> PreprocessStats: tokens before and after cleanup
+if "ingested_upload_ids" not in st.session_state:
+    st.session_state.ingested_upload_ids = set() # file_id of files already added from the workspace uploader
+if "review_scheduler" not in st.session_state:
+    st.session_state.review_scheduler = None # ReviewScheduler with this learner's spaced-repetition state, loaded on first use
+if "review_answer_shown" not in st.session_state:
+    st.session_state.review_answer_shown = None # card_id whose answer is revealed in the review dialog
+if "session_decks" not in st.session_state:
+    st.session_state.session_decks = {} # message index -> (deck shown for it, cards dropped as repeats of earlier decks)
+if "flashcard_view" not in st.session_state:
+    st.session_state.flashcard_view = None # DeckView with the page and known/unknown answers of the shown deck
+if "email_jobs" not in st.session_state:
+    st.session_state.email_jobs = [] # (outbox id, recipient) of emails queued from this session
+if "full_context_mode" not in st.session_state:
+    st.session_state.full_context_mode = get_setting("CHAT_CONTEXT_MODE", "retrieval") == "full"
+
+if new_session:
+    if requested_session and st.session_state.app_state == "initial_input" and not resume_session(requested_session):
+        # Nothing saved under that id: start afresh under a new one, queueing model calls as it
+        st.session_state.session_id = DocumentStore.new_session_id()
+        llm = service.llm_for(st.session_state.session_id)
+        background_llm = llm.with_priority(PRIORITY_BACKGROUND)
+        st.session_state.history = new_conversation_history()
+    st.query_params["session"] = st.session_state.session_id
+
+# --- Performance panel (admins only) ---
+CACHE_COUNTERS = ("document_store", "flashcards", "context", "ocr")
+
+def admin_panel_enabled():
+    """ADMIN_PANEL=on shows the panel to everyone; otherwise ?admin=<ADMIN_TOKEN> does."""
+    if get_setting("ADMIN_PANEL", "off") == "on":
+        return True
+    admin_token = get_setting("ADMIN_TOKEN")
+    return bool(admin_token) and st.query_params.get("admin") == admin_token
+
+@st.fragment(run_every=5)
+def show_performance_panel():
+    """Recent per-stage percentiles, token totals and cache hit rates of this server process."""
+    if not tracer.enabled:
+        st.caption("Tracing is off (TRACING=off).")
+        return
+    rows = tracer.summary()
+    if rows:
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("No stages recorded yet.")
+    counters = tracer.counters()
+    st.caption(f"Script reruns: {counters.get('app.rerun', 0)}")
+    queues = service.stats()
+    st.caption(f"Model queue: {queues['running']}/{queues['workers']} workers busy, {queues['queued']} waiting "
+               f"from {queues['waiting_sessions']} session(s), {queues['rejected']} turned away; "
+               f"{queues['background_jobs']} background job(s)")
+    for name in CACHE_COUNTERS:
+        hits, misses = counters.get(f"cache.{name}.hit", 0), counters.get(f"cache.{name}.miss", 0)
+        if hits or misses:
+            st.caption(f"{name.replace('_', ' ').capitalize()} cache: {hits / (hits + misses):.0%} hits ({hits}/{hits + misses})")
+    st.download_button("Download spans (JSONL)", tracer.recent_jsonl(), file_name="flashmind_spans.jsonl",
+                       key="download_spans")
+    st.download_button("Download metrics (Prometheus)", tracer.prometheus_text(), file_name="flashmind_metrics.prom",
+                       key="download_metrics")
+
+if admin_panel_enabled():
+    with st.sidebar:
+        st.subheader("⏱️ Performance")
+        show_performance_panel()
+
+# --- Email Delivery (background queue) ---
+@st.cache_resource
+def get_mail_queue():
+    """Persistent outbox and its worker thread, shared by all sessions; None when email is not configured."""
+    transport_name = get_setting("MAIL_TRANSPORT", "sendgrid")
+    sender_email = get_setting("SENDER_EMAIL")
+    if transport_name == "file":
+        transport = FileTransport(get_setting("MAIL_OUTBOX_DIR", "data/outbox"))
+    elif transport_name == "smtp":
+        transport = SMTPTransport(get_setting("MAIL_SMTP_HOST", "localhost"), int(get_setting("MAIL_SMTP_PORT", 8025)),
+                                  sender_email or "flashmind@localhost")
+    else:
+        sendgrid_api_key = get_setting("SENDGRID_API_KEY")
+        if not sendgrid_api_key or not sender_email:
+            return None
+        transport = SendGridTransport(sendgrid_api_key, sender_email)
+    return MailQueue(get_setting("MAIL_QUEUE_PATH", "data/outbox.sqlite3"), transport,
+                     max_attempts=int(get_setting("MAIL_MAX_ATTEMPTS", 5)))
+
+def send_flashcards_email(recipient_email, flashcards_data, subject_title="FlashMind AI Flashcards", attachments=()):
     """
-    Sends flashcards via email using SendGrid.
-    Requires SENDGRID_API_KEY and SENDER_EMAIL to be set in .streamlit/secrets.toml
+    Queues the flashcards email for background delivery and returns immediately.
+    Requires SENDGRID_API_KEY and SENDER_EMAIL to be set in .streamlit/secrets.toml (or MAIL_TRANSPORT=smtp/file)
     """
-    sendgrid_api_key = st.secrets.get("SENDGRID_API_KEY")
-    sender_email = st.secrets.get("SENDER_EMAIL")
-
-    if not sendgrid_api_key or not sender_email:
+    mail_queue = get_mail_queue()
+    if mail_queue is None:
         st.error("Email sending is not configured. Please set SENDGRID_API_KEY and SENDER_EMAIL in your `.streamlit/secrets.toml` file.")
         return
 
-    # Construct HTML email body
-    email_body_html = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: 'Poppins', sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9; }}
-            h2 {{ color: #555; }}
-            .flashcard-section {{ margin-bottom: 20px; border: 1px dashed #ccc; padding: 15px; border-radius: 5px; background-color: #fff; }}
-            .question {{ font-weight: bold; color: #555; }}
-            .answer {{ color: #008000; margin-top: 5px; }}
-            .footer {{ margin-top: 30px; font-size: 0.9em; color: #777; text-align: center; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>Your Flashcards on "{subject_title}" from FlashMind AI</h2>
-            <p>Hello,</p>
-            <p>Here are the flashcards you requested:</p>
-    """
+    with tracing.span("email.render", cards=len(flashcards_data), attachments=len(attachments)):
+        email_body_html, email_body_text, files = render_flashcard_email(flashcards_data, subject_title, attachments)
+    job_id = mail_queue.enqueue(recipient_email, EMAIL_SUBJECT, email_body_html, email_body_text, files)
+    st.session_state.email_jobs.append((job_id, recipient_email))
+
+def show_email_status():
+    """Shows the delivery state of the latest emails queued in this session; returns True while any is still queued."""
+    mail_queue = get_mail_queue()
+    if mail_queue is None:
+        return False
+    pending = False
+    for job_id, recipient_email in st.session_state.email_jobs[-3:]:
+        status = mail_queue.status(job_id)
+        if status is None:
+            continue
+        state, last_error = status
+        if state == "sent":
+            st.success(f"Flashcards sent successfully to **{recipient_email}**!")
+        elif state == "failed":
+            st.error(f"Could not send the flashcards to **{recipient_email}**: {last_error}")
+        else:
+            pending = True
+            st.info(f"Flashcards to **{recipient_email}** are queued for delivery.")
+    return pending
 
-    for i, card in enumerate(flashcards_data):
-        email_body_html += f"""
-            <div class="flashcard-section">
-                <p class="question"><strong>Q{i+1}:</strong> {card['question']}</p>
-                <p class="answer"><strong>A{i+1}:</strong> {card['answer']}</p>
-            </div>
-        """
-    
-    email_body_html += f"""
-            <p>Happy learning!</p>
-            <p>Best regards,<br>The FlashMind AI Team</p>
-            <div class="footer">
-                <p>This email was sent from FlashMind AI. <a href="https://github.com/bigm-o/Flash_mind.git">Visit our GitHub!</a></p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
 
-    try:
-        sg = sendgrid.SendGridAPIClient(sendgrid_api_key)
-        from_email = Email(sender_email)
-        to_email = To(recipient_email)
-        subject = f"Your Flashcards from FlashMind AI have arrived!!!"
-        content = Content("text/html", email_body_html)
-        
-        message = Mail(from_email, to_email, subject, content)
-        
-        response = sg.client.mail.send.post(request_body=message.get())
+@st.fragment(run_every=1)
+def poll_email_status():
+    """Refreshes the email status every second until nothing is queued, then reruns the page once to stop polling."""
+    if not show_email_status():
+        st.rerun()
 
-        if response.status_code == 202:
-            st.success(f"Flashcards sent successfully to **{recipient_email}**!")
+
+def email_delivery_pending():
+    """Whether any of the latest emails queued in this session is still waiting to be delivered."""
+    mail_queue = get_mail_queue()
+    if mail_queue is None:
+        return False
+    statuses = (mail_queue.status(job_id) for job_id, _ in st.session_state.email_jobs[-3:])
+    return any(status is not None and status[0] == "pending" for status in statuses)
+
+
+# --- Context Caching ---
+@st.cache_resource
+def get_context_cache_manager():
+    """Process-wide manager of cached (system prompt + document) prefixes, shared across sessions."""
+    if get_setting("CONTEXT_CACHING", "on") == "off":
+        return None
+    if LLM_BACKEND == "fake":
+        return ContextCacheManager(PrefixReplayBackend(base_llm))
+    backend = GeminiContextCacheBackend(get_setting("CONTEXT_CACHE_MODEL", "models/gemini-1.5-flash-002"))
+    ttl_minutes = float(get_setting("CONTEXT_CACHE_TTL_MINUTES", 60))
+    return ContextCacheManager(backend, ttl_seconds=ttl_minutes * 60)
+
+# --- Flashcard Cache ---
+@st.cache_resource
+def get_flashcard_cache():
+    """Returns the process-wide flashcard cache, with a disk tier if FLASHCARD_CACHE_PATH is set."""
+    disk_path = get_setting("FLASHCARD_CACHE_PATH")
+    disk_cache = None
+    if disk_path:
+        ttl_hours = float(get_setting("FLASHCARD_CACHE_TTL_HOURS", 168))
+        max_mb = float(get_setting("FLASHCARD_CACHE_MAX_MB", 50))
+        disk_cache = SQLiteDiskCache(disk_path, ttl_seconds=ttl_hours * 3600, max_bytes=int(max_mb * 1024 * 1024))
+    else:
+        # Decks then persist in the document store alongside their documents
+        disk_cache = get_document_store()
+    return FlashcardCache(max_entries=256, disk_cache=disk_cache)
+
+FLASHCARD_CONCURRENCY = int(get_setting("FLASHCARD_CONCURRENCY", 4))
+
+def request_flashcards(source_text, max_flashcards=None):
+    """Returns parsed flashcards for the text, calling Gemini only on a cache miss."""
+    cache = get_flashcard_cache()
+    cache_key = flashcard_cache_key(source_text, max_flashcards, FLASHCARD_PROMPT_TEMPLATE, f"{llm.name}:{GEMINI_MODEL_NAME}")
+    flashcards_data = cache.get(cache_key)
+    tracing.count("cache.flashcards.hit" if flashcards_data is not None else "cache.flashcards.miss")
+    if flashcards_data is not None:
+        return flashcards_data
+
+    # Long texts are split into sections that are turned into cards concurrently
+    progress_bar = st.progress(0.0, text="Generating flashcards...") if len(source_text) > MAP_CHUNK_SIZE else None
+
+    def show_progress(done, total, cards_so_far):
+        if progress_bar is not None:
+            progress_bar.progress(done / total, text=f"Generating flashcards... {done}/{total} sections, {len(cards_so_far)} cards so far")
+
+    # Short texts are streamed, and each card is previewed as soon as its JSON object completes
+    preview = st.empty()
+    preview_cards = preview.container()
+
+    def show_card(card):
+        preview_cards.markdown(f"**Q:** {card['question']}")
+
+    with st.spinner("Generating flashcards..."), tracing.span("flashcards", source_tokens=count_tokens(source_text)) as span:
+        flashcards_data, malformed_pairs = generate_flashcards_map_reduce(
+            lambda prompt: background_llm.generate(prompt, json_schema=FLASHCARD_SCHEMA),
+            source_text,
+            max_flashcards=max_flashcards,
+            max_workers=FLASHCARD_CONCURRENCY,
+            on_progress=show_progress,
+            stream_fn=lambda prompt: background_llm.stream(prompt, json_schema=FLASHCARD_SCHEMA),
+            on_card=show_card,
+        )
+        span.set(cards=len(flashcards_data), malformed=len(malformed_pairs))
+    preview.empty()
+    if progress_bar is not None:
+        progress_bar.empty()
+
+    for qa in malformed_pairs:
+        st.warning(f"Could not parse flashcard: {qa}. The AI's output should be a JSON list of questions and answers.")
+
+    # Only cache usable decks so an empty response is retried on the next request
+    if flashcards_data:
+        cache.set(cache_key, flashcards_data)
+    return flashcards_data
+
+
+# --- Spaced Repetition Review ---
+REVIEW_ANSWERS = (("Again", QUALITY_AGAIN), ("Hard", QUALITY_HARD), ("Good", QUALITY_GOOD), ("Easy", QUALITY_EASY))
+
+def get_review_scheduler():
+    """The learner's review state, loaded from the store once per session (the session id is the learner id)."""
+    if st.session_state.review_scheduler is None:
+        store = get_document_store()
+        rows = store.load_review_cards(st.session_state.session_id) if store is not None else ()
+        st.session_state.review_scheduler = ReviewScheduler(rows)
+    return st.session_state.review_scheduler
+
+def save_review_state():
+    """Writes only the cards changed since the last save."""
+    store = get_document_store()
+    if store is not None:
+        store.save_review_cards(st.session_state.session_id, get_review_scheduler().take_dirty_rows())
+
+@st.dialog("Review due cards")
+def review_due_cards():
+    """Shows the most overdue card; answering reschedules it and reruns only the dialog."""
+    scheduler = get_review_scheduler()
+    card = scheduler.next_due()
+    if card is None:
+        next_time = scheduler.next_due_time()
+        if next_time is None:
+            st.info("Generate some flashcards first, then come back here to review them.")
         else:
-            st.error(f"Failed to send email. Status Code: {response.status_code}")
-            st.error(f"Response Body: {response.body}")
-            st.error(f"Response Headers: {response.headers}")
+            st.success(f"You're all caught up! The next card is due in {max(1, round((next_time - time.time()) / 3600))} hour(s).")
+        return
 
-    except Exception as e:
-        st.error(f"An error occurred while sending the email: {e}")
-        st.warning("Please ensure your SendGrid API Key and Sender Email are correctly configured and verified.")
+    st.markdown(f"**Q:** {card.question}")
+    if st.session_state.review_answer_shown != card.card_id:
+        if st.button("Show answer", key="review_show_answer", use_container_width=True):
+            st.session_state.review_answer_shown = card.card_id
+            st.rerun(scope="fragment")
+        return
 
+    st.markdown(f"**A:** {card.answer}")
+    for column, (label, quality) in zip(st.columns(len(REVIEW_ANSWERS)), REVIEW_ANSWERS):
+        if column.button(label, key=f"review_answer_{quality}", use_container_width=True):
+            scheduler.review(card.card_id, quality)
+            save_review_state()
+            st.session_state.review_answer_shown = None
+            st.rerun(scope="fragment")
 
 # --- Flashcard Generation Function ---
-def generate_flashcards(source_text, max_flashcards=15):
+@st.fragment
+def show_flashcard_deck(flashcards_data):
+    """Renders one page of the deck; page turns and known/unknown answers rerun only this fragment."""
+    deck_id = text_hash(json.dumps(flashcards_data))
+    view = st.session_state.flashcard_view
+    if view is None or view.deck_id != deck_id:
+        view = st.session_state.flashcard_view = DeckView(deck_id)
+    key = f"flashcard_deck_{deck_id[:16]}"
+    # The component's latest event is in session state before it renders, so apply it first
+    view.apply(st.session_state.get(key), len(flashcards_data))
+    flashcard_deck(flashcards_data, view, key)
+
+def generate_flashcards(source_text, max_flashcards=15, deck_key=0):
+    """Shows the deck for a message index (or, for the notes, the targeted documents), generating it once."""
     st.markdown(
         """
             <p style="font-size:1.5rem; color: white; display: flex; align-items: center; justify-content: center; text-align: center;">Flashcards</p>
@@ -291,174 +861,34 @@ def generate_flashcards(source_text, max_flashcards=15):
         """,
         unsafe_allow_html=True
     )
-    # Prompt the AI to generate Q&A pairs from the given text
-    qa_prompt = f"""
-    Generate question and answer flashcards based on the following text.
-    Format each flashcard strictly as "Q: Your question here A: Your answer here".
-    Ensure the questions cover key concepts and facts from the text.
-    Do not include any introductory or concluding remarks, just the Q&A pairs.
-    Each Q&A pair should be on a new line.
-    {f"Generate a maximum of {max_flashcards} flashcards." if max_flashcards else ""}
-
-    Text:
-    ---
-    {source_text}
-    ---
-    Flashcards:
-    """
-    
-    try:
-        with st.spinner("Generating flashcards..."):
-            flashcard_response = model.generate_content(qa_prompt).text.strip()
-
-        raw_qa_pairs = [pair.split("A:") for pair in flashcard_response.split("Q:") if "A:" in pair]
-        
-        if not raw_qa_pairs:
-            st.info("No Q&A pairs could be generated from this text. Please ensure the text contains sufficient information.")
-            return
 
-        # Prepare flashcards in a structured format for JSON
-        flashcards_data = []
-        for j, qa in enumerate(raw_qa_pairs):
-            if len(qa) == 2:
-                question = qa[0].strip()
-                answer = qa[1].strip()
-                flashcards_data.append({"question": question, "answer": answer})
-            else:
-                st.warning(f"Could not parse Q&A pair: {qa}. Ensure the AI's output is correctly formatted as 'Q: Question A: Answer'.")
+    try:
+        if deck_key in st.session_state.session_decks:
+            flashcards_data, repeated = st.session_state.session_decks[deck_key]
+        else:
+            generated = request_flashcards(source_text, max_flashcards)
+            # Drop cards that repeat facts from the decks already made in this session
+            earlier_cards = [card for key, (deck, _) in st.session_state.session_decks.items() if key != deck_key for card in deck]
+            flashcards_data = dedupe_flashcards(generated, existing=earlier_cards, terms=key_terms(source_text)) or generated
+            repeated = len(generated) - len(flashcards_data)
+            if flashcards_data:
+                st.session_state.session_decks[deck_key] = (flashcards_data, repeated)
+                # New cards join the learner's spaced-repetition deck
+                if get_review_scheduler().add_cards(flashcards_data):
+                    save_review_state()
 
         if not flashcards_data:
-            st.info("No valid flashcards could be parsed from the AI's response.")
+            st.info("No valid flashcards could be parsed from the AI's response. Please ensure the text contains sufficient information.")
             return
+        if repeated:
+            st.caption(f"Skipped {repeated} flashcard{'s' if repeated != 1 else ''} already covered by your earlier decks.")
 
         # Store generated flashcards in session state
-        st.session_state.generated_flashcards_data = flashcards_data
+        if st.session_state.generated_flashcards_data != flashcards_data:
+            st.session_state.generated_flashcards_data = flashcards_data
+            save_session()
 
-        # The CSS for the flipping effect
-        css = """
-        <style>
-            .flashcard-container{
-                padding-bottom: 2rem;
-                align-items: center;
-            }
-
-            .flashcard {
-                background-color: transparent;
-                width: 350px;
-                height: 200px;
-                perspective: 1000px;
-                margin: 20px auto;
-                
-            }
-
-            .flashcard .front{
-                width: 85%;
-                height: 100%;
-                border: 1px dashed white;
-                border-radius: 15px;
-                position: absolute;
-                backface-visibility: hidden;
-                padding: 20px;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                font-size: 1.4rem;
-                background: rgba(0, 0, 0, 0.1);
-                color: white;
-            }
-
-            .flashcard .back {
-                transform: rotateY(180deg);
-                color: #67f88e;
-                width: 85%;
-                height: 100%;
-                border: 1px dashed #67f88e;
-                border-radius: 15px;
-                position: absolute;
-                backface-visibility: hidden;
-                padding: 20px;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                font-size: 1.1rem;
-                background: rgba(0, 0, 0, 0.1);
-                color: #67f88e; /* Changed to match border color */
-            }
-
-            .flashcard {
-                position: relative;
-                transition: transform 0.6s;
-                transform-style: preserve-3d;
-                cursor: pointer;
-            }
-
-            .flashcard.flipped {
-                transform: rotateY(180deg);
-            }
-            
-            p {
-                margin: 0;
-                line-height: 1.4;
-            }
-        </style>
-        """
-
-        # The JavaScript for creating and flipping cards
-        # inject flashcards_data directly as a JSON string
-        js_script = f"""
-        <script>
-            const flashcardsData = {json.dumps(flashcards_data)}; // Inject Python list as JSON
-            const container = document.getElementById('flashcards-container');
-
-            flashcardsData.forEach(card => {{
-                const cardContainer = document.createElement('div');
-                cardContainer.className = 'flashcard-container';
-
-                const flashcard = document.createElement('div');
-                flashcard.className = 'flashcard';
-                flashcard.onclick = function() {{
-                    this.classList.toggle('flipped');
-                }};
-
-                const front = document.createElement('div');
-                front.className = 'front';
-                front.innerHTML = `<p>${{card.question}}</p>`;
-
-                const back = document.createElement('div');
-                back.className = 'back';
-                back.innerHTML = `<p>${{card.answer}}</p>`;
-
-                flashcard.appendChild(front);
-                flashcard.appendChild(back);
-                cardContainer.appendChild(flashcard);
-                container.appendChild(cardContainer);
-            }});
-        </script>
-        """
-
-        # Combine HTML structure, CSS, and JavaScript
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Flashcards</title>
-            {css}
-        </head>
-        <body>
-            <div id="flashcards-container">
-                </div>
-            {js_script}
-        </body>
-        </html>
-        """
-
-        # Render the custom HTML component
-        estimated_height = len(flashcards_data) * 200 
-        components.html(html_content, height=estimated_height, scrolling=False)
+        show_flashcard_deck(flashcards_data)
 
         st.markdown(
             """
@@ -472,13 +902,38 @@ def generate_flashcards(source_text, max_flashcards=15):
             st.session_state.show_email_form = not st.session_state.show_email_form # Toggle form visibility
             st.rerun()
 
+    except SchedulerBusy as e:
+        st.warning(str(e))
     except Exception as e:
         st.error(f"An error occurred while generating flashcards: {e}")
         st.warning("Please try again. If the issue persists, the provided text might be too complex or short for flashcard generation, or there's an API issue.")
 
 
+def show_flashcards_button(i, message):
+    """The "Generate Flashcards" button under AI message i; a click shows that message's deck."""
+    if message["role"] != "assistant":
+        return
+    # For the very first AI response after document/text input
+    if i == 0 and not st.session_state.initial_flashcards_generated:
+        if st.button("Generate flashcards for the notes", key=f"generate_flashcards_initial_{i}"):
+            st.session_state.flashcards_for_message_idx = i # Store index to show flashcards later
+            st.session_state.initial_flashcards_generated = True # Mark as generated
+            st.rerun()
+    # For all subsequent AI responses
+    elif i > 0: # This means it's not the first AI message
+        if st.button("Generate Flashcards for this response", key=f"generate_flashcards_{i}"):
+            st.session_state.flashcards_for_message_idx = i
+            st.rerun()
+
+
 # --- Main Application Logic ---
 
+# Pick up any pages extracted in the background since the last rerun
+if st.session_state.pending_extractions:
+    sync_pending_extractions()
+if st.session_state.title_future is not None:
+    apply_inferred_title()
+
 # Display chat messages
 if st.session_state.app_state == "chatting" or len(st.session_state.messages) > 0:
     for i, message in enumerate(st.session_state.messages):
@@ -489,19 +944,7 @@ if st.session_state.app_state == "chatting" or len(st.session_state.messages) >
                 elif "image" in part:
                     st.image(part["image"], caption="Uploaded Image", use_container_width=True)
 
-            # Add "Generate Flashcards" button
-            if message["role"] == "assistant":
-                # For the very first AI response after document/text input
-                if i == 0 and not st.session_state.initial_flashcards_generated:
-                    if st.button("Generate flashcards for the notes", key=f"generate_flashcards_initial_{i}"):
-                        st.session_state.flashcards_for_message_idx = i # Store index to show flashcards later
-                        st.session_state.initial_flashcards_generated = True # Mark as generated
-                        st.rerun()
-                # For all subsequent AI responses
-                elif i > 0: # This means it's not the first AI message
-                    if st.button(f"Generate Flashcards for this response", key=f"generate_flashcards_{i}"):
-                        st.session_state.flashcards_for_message_idx = i
-                        st.rerun()
+            show_flashcards_button(i, message)
 
     # Display flashcards if a button has been clicked
     if st.session_state.flashcards_for_message_idx != -1:
@@ -509,16 +952,18 @@ if st.session_state.app_state == "chatting" or len(st.session_state.messages) >
         
         # Logic for initial notes flashcards
         if target_message_idx == 0 and st.session_state.initial_flashcards_generated:
-            # Generate flashcards from the full document text for the initial request
-            if st.session_state.document_text:
-                generate_flashcards(st.session_state.document_text, max_flashcards=15)
+            # Generate flashcards from the full text of the targeted documents for the initial request
+            workspace = st.session_state.workspace
+            if workspace:
+                targets = workspace.selection(st.session_state.target_documents)
+                generate_flashcards(workspace.text(targets), max_flashcards=15, deck_key=(0,) + tuple(targets))
             else:
                 st.error("Document text not available for initial flashcard generation.")
         # Logic for subsequent response-specific flashcards
         elif target_message_idx > 0 and target_message_idx < len(st.session_state.messages):
             target_message = st.session_state.messages[target_message_idx]
             if target_message["role"] == "assistant" and "text" in target_message["parts"][0]:
-                generate_flashcards(target_message["parts"][0]["text"])
+                generate_flashcards(target_message["parts"][0]["text"], deck_key=target_message_idx)
             else:
                 st.warning("Selected message is not an AI response or contains no text for flashcard generation.")
         else:
@@ -526,17 +971,26 @@ if st.session_state.app_state == "chatting" or len(st.session_state.messages) >
             st.session_state.flashcards_for_message_idx = -1
             st.warning("Could not find the associated AI response for flashcards.")
 
+    if st.session_state.email_jobs:
+        if email_delivery_pending():
+            poll_email_status()
+        else:
+            show_email_status()
+
     # Email input form (appears when show_email_form is True)
     if st.session_state.show_email_form and st.session_state.generated_flashcards_data:
         st.markdown("---") # Separator
         st.subheader("Send Flashcards via Email")
         with st.form("email_flashcards_form"):
             user_email = st.text_input("Enter your email address:", key="email_input")
+            attachment_labels = {"csv": "CSV", "anki": "Anki deck"}
+            email_attachments = st.multiselect("Attach the deck as:", ATTACHMENT_FORMATS, default=["csv"],
+                                               format_func=attachment_labels.get, key="email_attachments")
             submit_email = st.form_submit_button("Send Email")
 
             if submit_email:
                 if user_email and "@" in user_email and "." in user_email: # Simple email validation
-                    send_flashcards_email(user_email, st.session_state.generated_flashcards_data, st.session_state.subject_title)
+                    send_flashcards_email(user_email, st.session_state.generated_flashcards_data, st.session_state.subject_title, email_attachments)
                     st.session_state.show_email_form = False # Hide form after submission
                     st.rerun()
                 else:
@@ -620,17 +1074,17 @@ if st.session_state.app_state == "initial_input":
 
 # Display file uploader if "Upload Document" was clicked
 elif st.session_state.app_state == "uploading_document":
-    st.subheader("Upload your document:")
-    uploaded_document = st.file_uploader(
-        "Choose a file",
+    st.subheader("Upload your documents:")
+    uploaded_documents = st.file_uploader(
+        "Choose one or more files",
         type=["pdf", "docx", "txt"],
-        accept_multiple_files=False,
+        accept_multiple_files=True,
         key="document_uploader_actual",
         label_visibility="visible"
     )
-    if uploaded_document:
+    if uploaded_documents:
         st.session_state.app_state = "processing"
-        st.session_state.uploaded_file_obj = uploaded_document
+        st.session_state.uploaded_files = uploaded_documents
         st.rerun()
     else:
         st.info("Please upload a document to proceed.")
@@ -639,52 +1093,33 @@ elif st.session_state.app_state == "uploading_document":
             st.rerun()
 
 
-# Processing uploaded document
-elif st.session_state.app_state == "processing" and st.session_state.uploaded_file_obj:
-    uploaded_document = st.session_state.uploaded_file_obj
-    file_extension = uploaded_document.name.split('.')[-1].lower()
-    extracted_text = None
-
-    with st.spinner(f"Processing {uploaded_document.name}..."):
-        file_bytes = uploaded_document.getvalue()
-
-        if file_extension == "pdf":
-            extracted_text = extract_text_from_pdf(file_bytes)
-        elif file_extension == "docx":
-            extracted_text = extract_text_from_docx(file_bytes)
-        elif file_extension == "txt":
-            extracted_text = extract_text_from_txt(file_bytes)
-        else:
-            st.error("Unsupported file type.")
-            st.session_state.app_state = "initial_input"
+# Processing uploaded documents
+elif st.session_state.app_state == "processing" and st.session_state.uploaded_files:
+    uploaded_documents = st.session_state.uploaded_files
+    names = ", ".join(uploaded_document.name for uploaded_document in uploaded_documents)
+
+    with st.spinner(f"Processing {names}..."):
+        st.session_state.pending_extractions = {}
+        st.session_state.extracted_page_counts = {}
+        st.session_state.ocr_stats = {}
+        st.session_state.preprocess_stats = {}
+        st.session_state.ingested_upload_ids = set()
+        workspace = new_workspace()
+        # Open the chat as soon as every file has its first pages; the rest are picked up on later reruns
+        title_future = ingest_uploads(uploaded_documents, workspace, infer_title=True)
+
+    if not workspace:
+        if st.button("Go Back", key="go_back_from_processing"):
+            st.session_state.app_state = "uploading_document"
             st.rerun()
-
-    if extracted_text:
-        st.session_state.document_text = extracted_text
-        st.success(f"Successfully processed '{uploaded_document.name}'.")
-
-        subject_prompt = f"""
-        Analyze the following document text and provide a concise, general subject title (e.g., "Photosynthesis", "World War II", "Python Programming Basics").
-        Document:
-        ---
-        {extracted_text[:2000]}
-        ---
-        Subject Title:
-        """
-        try:
-            subject_response = model.generate_content(subject_prompt).text.strip()
-            st.session_state.subject_title = subject_response
-        except Exception as e:
-            st.warning(f"Could not infer subject title: {e}. Proceeding without a specific title.")
-            st.session_state.subject_title = "your document"
-
-        st.session_state.messages = []
-        st.session_state.flashcards_for_message_idx = -1
-        st.session_state.initial_flashcards_generated = False # Reset for new document
-        initial_ai_response = f"Oh, I see you want to learn about **{st.session_state.subject_title}**. What would you like to know about this subject matter?"
-        st.session_state.messages.append({"role": "assistant", "parts": [{"text": initial_ai_response}]})
-        st.session_state.app_state = "chatting"
-        st.rerun()
+    else:
+        st.success(f"Successfully processed {len(workspace)} document{'s' if len(workspace) != 1 else ''}.")
+        known_title = None
+        if len(workspace) == 1:
+            known_title = next(iter(workspace.documents.values())).title
+        if title_future is None and not known_title:
+            title_future = start_title_inference(workspace.title_sample(TITLE_SAMPLE_CHARS))
+        start_chat_session(workspace, "your documents" if len(workspace) > 1 else "your document", title_future, known_title)
 
 # Input for pasting text
 elif st.session_state.app_state == "pasting_text":
@@ -704,31 +1139,21 @@ elif st.session_state.app_state == "pasting_text":
         submit_pasted_text = st.button("Submit Text", key="submit_pasted_text")
 
     if submit_pasted_text and pasted_text:
-        st.session_state.document_text = pasted_text
+        st.session_state.pending_extractions = {}
+        st.session_state.ocr_stats = {}
         st.success("Text successfully pasted and loaded.")
-
-        subject_prompt = f"""
-        Analyze the following text and provide a concise, general subject title (e.g., "Photosynthesis", "World War II", "Python Programming Basics").
-        Text:
-        ---
-        {pasted_text[:2000]}
-        ---
-        Subject Title:
-        """
-        try:
-            subject_response = model.generate_content(subject_prompt).text.strip()
-            st.session_state.subject_title = subject_response
-        except Exception as e:
-            st.warning(f"Could not infer subject title: {e}. Proceeding without a specific title.")
-            st.session_state.subject_title = "your text"
-
-        st.session_state.messages = []
-        st.session_state.flashcards_for_message_idx = -1
-        st.session_state.initial_flashcards_generated = False # Reset for new text
-        initial_ai_response = f"Oh, I see you want to learn about **{st.session_state.subject_title}**. What would you like to know about this subject matter?"
-        st.session_state.messages.append({"role": "assistant", "parts": [{"text": initial_ai_response}]})
-        st.session_state.app_state = "chatting"
-        st.rerun()
+        cleaner = PageCleaner(detect_boilerplate=False)
+        pasted_text = cleaner.clean_text(pasted_text)
+        doc_hash = text_hash(pasted_text)
+        st.session_state.preprocess_stats = {doc_hash: cleaner.stats}
+        store = get_document_store()
+        stored_document = store.get_document(doc_hash) if store is not None else None
+        workspace = new_workspace()
+        if stored_document is not None and stored_document["title"]:
+            workspace.add_document(doc_hash, "Pasted text", pasted_text, stored_document["chunks"], stored_document["title"])
+            start_chat_session(workspace, "your text", None, stored_document["title"])
+        workspace.add_document(doc_hash, "Pasted text", pasted_text)
+        start_chat_session(workspace, "your text", start_title_inference(pasted_text), new_doc_ids=[doc_hash])
     elif submit_pasted_text and not pasted_text:
         st.warning("Please paste some text before submitting.")
     
@@ -746,6 +1171,72 @@ elif st.session_state.app_state == "chatting":
         </style>
     """, unsafe_allow_html=True)
 
+    if st.session_state.title_future is not None:
+        watch_title_inference()
+
+    workspace = st.session_state.workspace
+    pending = st.session_state.pending_extractions
+    if pending:
+        pages_so_far = sum(st.session_state.extracted_page_counts.get(doc_id, 0) for doc_id in pending)
+        st.caption(f"Still reading {len(pending)} document{'s' if len(pending) != 1 else ''}... {pages_so_far} pages so far.")
+
+    ocr_stats = list(st.session_state.ocr_stats.values())
+    recognised = sum(stats.recognised for stats in ocr_stats)
+    cached = sum(stats.cached for stats in ocr_stats)
+    unreadable = sum(stats.failed + stats.no_images for stats in ocr_stats)
+    blank = sum(stats.empty for stats in ocr_stats)
+    if recognised:
+        st.caption(f"Read {recognised} scanned page{'s' if recognised != 1 else ''} with OCR"
+                   f"{f' ({cached} from cache)' if cached else ''}.")
+    if unreadable:
+        st.caption(f"{unreadable} page(s) had no text and could not be read with OCR.")
+    if blank:
+        st.caption(f"OCR found no text on {blank} scanned page(s).")
+
+    preprocess_stats = list(st.session_state.preprocess_stats.values())
+    raw_tokens = sum(stats.raw_tokens for stats in preprocess_stats)
+    clean_tokens = sum(stats.clean_tokens for stats in preprocess_stats)
+    if raw_tokens > clean_tokens:
+        removed_lines = sum(stats.removed_lines for stats in preprocess_stats)
+        st.caption(f"Cleanup trimmed your documents from {raw_tokens:,} to {clean_tokens:,} tokens "
+                   f"({1 - clean_tokens / raw_tokens:.0%} fewer), removing {removed_lines} header, footer and page-number lines.")
+
+    with st.expander(f"📁 Workspace: {len(workspace)} document{'s' if len(workspace) != 1 else ''}"):
+        added_documents = st.file_uploader(
+            "Add documents to this workspace",
+            type=["pdf", "docx", "txt"],
+            accept_multiple_files=True,
+            key="workspace_uploader",
+        )
+        # The uploader keeps returning its files on every rerun; only new ones are ingested
+        new_uploads = [uploaded for uploaded in added_documents or () if uploaded.file_id not in st.session_state.ingested_upload_ids]
+        if new_uploads:
+            with st.spinner("Adding documents..."):
+                ingest_uploads(new_uploads, workspace)
+                st.session_state.ingested_upload_ids.update(uploaded.file_id for uploaded in new_uploads)
+            # Documents reused from the store are complete already; the others are saved once fully read
+            save_session()
+            st.rerun()
+
+    if len(workspace) > 1:
+        st.multiselect(
+            "Study these documents",
+            options=list(workspace.documents),
+            format_func=workspace.names().get,
+            key="target_documents",
+            placeholder="All documents",
+            help="Chat answers and the notes' flashcards only use the documents picked here. Leave empty to use all of them.",
+        )
+
+    if st.button("📚 Review due cards", key="review_due_cards_button"):
+        review_due_cards()
+
+    st.checkbox(
+        "Send the full document with every question",
+        key="full_context_mode",
+        help="When off, only the passages most relevant to your question are sent, which keeps answers fast on long documents."
+    )
+
     prompt_input = st.chat_input(
         f"What would you like to know about {st.session_state.subject_title}?...",
         key="main_chat_input"
@@ -763,52 +1254,64 @@ elif st.session_state.app_state == "chatting":
         with st.chat_message("user"):
             st.markdown(user_text)
 
-        gemini_messages_for_api = []
-
-        gemini_messages_for_api.append({"role": "user", "parts": [{"text": system_instruction_prompt}]})
-        gemini_messages_for_api.append({"role": "model", "parts": [{"text": "Hello! I'm FlashMind AI. How can I help you learn from your document?"}]})
-
-        gemini_messages_for_api.append({"role": "user", "parts": [{"text": f"Here is the document for analysis:\n\n---\n{st.session_state.document_text}\n---"}]})
-        gemini_messages_for_api.append({"role": "model", "parts": [{"text": f"I have processed the document about **{st.session_state.subject_title}**. What would you like to do?"}]})
-
-        for msg in st.session_state.messages:
-            is_initial_system_prompt = (msg["role"] == "user" and msg["parts"][0]["text"] == system_instruction_prompt)
-            is_initial_ai_greeting = (msg["role"] == "assistant" and msg["parts"][0]["text"].startswith("Hello! I'm FlashMind AI."))
-            is_document_context = (msg["role"] == "user" and msg["parts"][0]["text"].startswith("Here is the document for analysis:"))
-            is_document_processed_ai_response = (msg["role"] == "model" and msg["parts"][0]["text"].startswith("I have processed the document about"))
-
-            if not (is_initial_system_prompt or is_initial_ai_greeting or is_document_context or is_document_processed_ai_response):
-                role_for_gemini = "user" if msg["role"] == "user" else "model"
-                parts_for_gemini = []
-                for part in msg["parts"]:
-                    if "text" in part:
-                        parts_for_gemini.append({"text": str(part["text"])})
-                    elif "image" in part:
-                        parts_for_gemini.append(part["image"])
-                gemini_messages_for_api.append({"role": role_for_gemini, "parts": parts_for_gemini})
+        document_context = document_context_for(user_text)
+        document_label = "document" if len(workspace.selection(st.session_state.target_documents)) == 1 else "documents"
+        document_prefix = [
+            {"role": "user", "parts": [{"text": f"Here is the {document_label} for analysis:\n\n---\n{document_context}\n---"}]},
+            # Nothing that changes between turns (such as the inferred title) goes in the prefix, so it can be cached
+            {"role": "model", "parts": [{"text": f"I have processed the {document_label}. What would you like to do?"}]},
+        ]
+
+        # In full-document mode the (system prompt + document) prefix is cached server-side and shared across turns,
+        # once the documents are fully extracted: until then the text grows and every turn would create a new cache
+        chat_model = None
+        context_cache_manager = get_context_cache_manager()
+        still_extracting = any(doc_id in st.session_state.pending_extractions
+                               for doc_id in workspace.selection(st.session_state.target_documents))
+        if st.session_state.full_context_mode and context_cache_manager is not None and not still_extracting:
+            cached_model = context_cache_manager.get_model(system_instruction_prompt, document_prefix)
+            tracing.count("cache.context.hit" if cached_model is not None else "cache.context.miss")
+            chat_model = llm.wrap(cached_model) if cached_model is not None else None
 
+        gemini_messages_for_api = []
+        if chat_model is None:
+            chat_model = llm
+            gemini_messages_for_api.append({"role": "user", "parts": [{"text": system_instruction_prompt}]})
+            gemini_messages_for_api.append({"role": "model", "parts": [{"text": "Hello! I'm FlashMind AI. How can I help you learn from your document?"}]})
+            gemini_messages_for_api.extend(document_prefix)
+
+        # Recent turns within the token budget, older ones as a rolling summary, then this question.
+        # The question joins the history together with the answer, so a failed turn leaves no unanswered user turn behind.
+        gemini_messages_for_api.extend(st.session_state.history.contents())
+        gemini_messages_for_api.append({"role": "user", "parts": user_message_parts})
+
+        response = None
         try:
-            stream = model.generate_content(
+            response = chat_model.stream(
                 gemini_messages_for_api,
-                stream=True,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.4,
-                    max_output_tokens=2048
-                )
+                temperature=0.4,
+                max_output_tokens=2048
             )
+            # Time to first chunk and total time as the user sees them, including scheduler queueing
+            stream = tracing.stream("chat", response, prompt_tokens=count_tokens(prompt_text(gemini_messages_for_api)))
 
             with st.chat_message("assistant"):
-                message_placeholder = st.empty()
-                full_response_content = ""
-                for chunk in stream:
-                    if chunk.text:
-                        full_response_content += chunk.text
-                        message_placeholder.markdown(full_response_content + "▌")
-                message_placeholder.markdown(full_response_content)
-
-            st.session_state.messages.append({"role": "assistant", "parts": [{"text": full_response_content}]})
-            st.rerun()
-
+                # Coalesce chunk updates instead of re-rendering the whole answer on every chunk
+                full_response_content = StreamRenderer(st.empty()).consume(stream)
+                st.session_state.messages.append({"role": "assistant", "parts": [{"text": full_response_content}]})
+                st.session_state.history.append("user", user_message_parts)
+                st.session_state.history.append("model", [{"text": full_response_content}])
+                save_session()
+
+                # Rendered in place instead of forcing a full rerun; from the next rerun on the message loop shows it
+                show_flashcards_button(len(st.session_state.messages) - 1, st.session_state.messages[-1])
+
+        except SchedulerBusy as e:
+            st.warning(str(e))
         except Exception as e:
             st.error(f"An error occurred while generating response: {e}")
             st.warning("Please try again. If the issue persists, verify your API key or the model's availability.")
+        finally:
+            # A rerun or Stop interrupts the script mid-answer; stop the model call instead of reading it to the end
+            if response is not None:
+                response.close()
@@ -0,0 +1,254 @@
+"""Headless bulk deck building for a folder of documents.
+
+Walks a directory for PDF, DOCX and TXT files, extracts them in parallel on
+a process pool, generates a deck per document with the same map-reduce
+flashcard pipeline as the app (model calls bounded and retried by the
+shared RequestScheduler), and writes the decks as JSONL, CSV and Anki.
+
+decks.jsonl doubles as the checkpoint: a document is skipped on the next
+run once its deck line is written, so an interrupted run resumes where it
+stopped. The CSV export is rebuilt from decks.jsonl at the end.
+Scanned PDF pages are read with Tesseract when it is installed (--ocr).
+
+    python src/batch.py course/ --out decks/ --formats jsonl,csv,anki
+    python src/batch.py course/ --backend fake --fake-latency 0.2   # offline
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from email_templates import anki_deck_file, escape_card_text, safe_file_name
+from extraction import iter_document_pages
+from flashcard_cache import FlashcardCache, SQLiteDiskCache
+from flashcards import FLASHCARD_SCHEMA, generate_flashcards_map_reduce
+from llm import FakeBackend, GeminiBackend, count_tokens
+from ocr import OCRPipeline, TesseractEngine, tesseract_available
+from preprocess import PageCleaner
+from scheduler import PRIORITY_BACKGROUND, RequestScheduler, ScheduledBackend
+from titling import heuristic_title
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+DECKS_FILE = "decks.jsonl"
+CSV_FILE = "decks.csv"
+ANKI_DIR = "anki"
+OCR_CACHE_FILE = "ocr_cache.sqlite3"
+
+
+def find_documents(input_dir):
+    """Supported files under input_dir, as sorted relative paths."""
+    found = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith("~$"):
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(found)
+
+
+def document_signature(path):
+    """Changes when the file does, so edited documents are rebuilt on the next run."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def extract_document(path, ocr_cache_path=None):
+    """Runs in a worker process: returns the cleaned-up text of one document.
+
+    With ocr_cache_path, scanned PDF pages are read with Tesseract and cached there.
+    """
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    ocr = None
+    if ocr_cache_path:
+        ocr = OCRPipeline(TesseractEngine(max_workers=2), FlashcardCache(disk_cache=SQLiteDiskCache(ocr_cache_path, ttl_seconds=0)))
+    cleaner = PageCleaner(detect_boilerplate=path.lower().endswith(".pdf"))
+    return "".join(cleaner.clean_pages(iter_document_pages(os.path.basename(path), file_bytes, ocr=ocr)))
+
+
+def load_checkpoint(out_dir):
+    """Returns {source: signature} of the decks already written."""
+    done = {}
+    path = os.path.join(out_dir, DECKS_FILE)
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut off by an interrupted run
+            done[record["source"]] = record["signature"]
+    return done
+
+
+def read_decks(out_dir):
+    """The latest deck of every source in decks.jsonl."""
+    decks = {}
+    with open(os.path.join(out_dir, DECKS_FILE), encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            decks[record["source"]] = record
+    return [decks[source] for source in sorted(decks)]
+
+
+def write_csv(out_dir, decks):
+    with open(os.path.join(out_dir, CSV_FILE), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "title", "question", "answer"])
+        for deck in decks:
+            for card in deck["cards"]:
+                writer.writerow([deck["source"], deck["title"], card["question"], card["answer"]])
+
+
+def write_anki(out_dir, deck):
+    rows = [(escape_card_text(card["question"]), escape_card_text(card["answer"])) for card in deck["cards"]]
+    suffix, _, data = anki_deck_file(rows, deck["title"])
+    stem = safe_file_name(os.path.splitext(deck["source"])[0].replace(os.sep, "_"))
+    with open(os.path.join(out_dir, ANKI_DIR, f"{stem}{suffix}"), "wb") as f:
+        f.write(data)
+
+
+class Throughput:
+    """Counts documents and model tokens for the progress report."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.documents = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def count_call(self, prompt, response):
+        with self._lock:
+            self.prompt_tokens += count_tokens(prompt)
+            self.output_tokens += count_tokens(response)
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        tokens = self.prompt_tokens + self.output_tokens
+        return (f"{self.documents} docs in {elapsed:.1f}s ({self.documents * 60 / elapsed:.1f} docs/min), "
+                f"{tokens} tokens ({tokens / elapsed:.0f} tokens/s, {self.output_tokens / elapsed:.0f} output tokens/s)")
+
+
+def build_backend(args):
+    if args.backend == "fake":
+        return FakeBackend(latency_seconds=args.fake_latency, tokens_per_second=args.fake_tokens_per_second or None,
+                           failure_rate=args.fake_failure_rate, failure_code=429)
+    import google.generativeai as genai
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        sys.exit("Set GEMINI_API_KEY (or use --backend fake).")
+    genai.configure(api_key=api_key)
+    return GeminiBackend(genai.GenerativeModel(args.model))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir")
+    parser.add_argument("--out", default="decks", help="output directory (default: decks)")
+    parser.add_argument("--formats", default="jsonl,csv,anki", help="comma-separated: jsonl (always written), csv, anki")
+    parser.add_argument("--max-flashcards", type=int, default=15)
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 2, help="extraction processes")
+    parser.add_argument("--documents", type=int, default=4, help="documents generated concurrently")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="maximum concurrent model calls")
+    parser.add_argument("--rpm", type=float, default=60, help="model requests per minute")
+    parser.add_argument("--ocr", choices=("auto", "tesseract", "off"), default="auto",
+                        help="read scanned PDF pages with Tesseract (auto: when it is installed)")
+    parser.add_argument("--backend", choices=("gemini", "fake"), default="gemini")
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    parser.add_argument("--fake-latency", type=float, default=0.05)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=0)
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    formats = {name.strip() for name in args.formats.split(",") if name.strip()}
+    os.makedirs(args.out, exist_ok=True)
+    if "anki" in formats:
+        os.makedirs(os.path.join(args.out, ANKI_DIR), exist_ok=True)
+
+    done = load_checkpoint(args.out)
+    sources = find_documents(args.input_dir)
+    pending = [source for source in sources
+               if done.get(source) != document_signature(os.path.join(args.input_dir, source))]
+    print(f"{len(sources)} documents found, {len(sources) - len(pending)} already built, {len(pending)} to go")
+
+    use_ocr = args.ocr == "tesseract" or (args.ocr == "auto" and tesseract_available())
+    ocr_cache_path = os.path.join(args.out, OCR_CACHE_FILE) if use_ocr else None
+
+    scheduler = RequestScheduler(requests_per_minute=args.rpm, max_concurrency=args.llm_concurrency)
+    llm = ScheduledBackend(scheduler, build_backend(args), PRIORITY_BACKGROUND)
+    throughput = Throughput()
+    write_lock = threading.Lock()
+    failures = 0
+
+    def generate(prompt):
+        response = llm.generate(prompt, json_schema=FLASHCARD_SCHEMA)
+        throughput.count_call(prompt, response)
+        return response
+
+    def build_deck(source, text):
+        cards, _ = generate_flashcards_map_reduce(generate, text, max_flashcards=args.max_flashcards,
+                                                  max_workers=args.llm_concurrency)
+        title = heuristic_title(text, fallback=os.path.splitext(os.path.basename(source))[0])
+        deck = {
+            "source": source,
+            "signature": document_signature(os.path.join(args.input_dir, source)),
+            "title": title,
+            "cards": cards,
+        }
+        if "anki" in formats and cards:
+            write_anki(args.out, deck)
+        # The JSONL line is written last: it is what marks the document as done
+        with write_lock:
+            with open(os.path.join(args.out, DECKS_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(deck) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return deck
+
+    with ProcessPoolExecutor(max_workers=max(1, args.extract_workers)) as extract_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.documents)) as generate_pool:
+        extracting = {extract_pool.submit(extract_document, os.path.join(args.input_dir, source), ocr_cache_path): source
+                      for source in pending}
+        generating = {}
+        for future in as_completed(extracting):
+            source = extracting[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"  ! {source}: extraction failed: {e}", file=sys.stderr)
+                continue
+            if not text.strip():
+                failures += 1
+                print(f"  ! {source}: no text found", file=sys.stderr)
+                continue
+            generating[generate_pool.submit(build_deck, source, text)] = source
+
+        for future in as_completed(generating):
+            source = generating[future]
+            try:
+                deck = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"  ! {source}: generation failed: {e}", file=sys.stderr)
+                continue
+            throughput.documents += 1
+            print(f"  {source}: {len(deck['cards'])} cards | {throughput.report()}")
+
+    if "csv" in formats and os.path.exists(os.path.join(args.out, DECKS_FILE)):
+        write_csv(args.out, read_decks(args.out))
+    print(f"\nDone: {throughput.report()}, {failures} failed, {scheduler.retries} retried calls")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
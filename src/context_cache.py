@@ -0,0 +1,233 @@
+"""Reuse of the (system prompt + document) prefix across chat turns.
+
+Every chat turn starts with the same leading content: the system prompt and
+the document. ContextCacheManager registers that prefix once per document
+with a caching backend (Gemini context caching by default) and hands back a
+backend (see llm.py) bound to the cached prefix, so later turns only send
+the conversation.
+Entries are shared across sessions, refreshed before they expire, and
+backends that cannot cache simply return None so callers fall back to
+sending the full prompt. Backend calls (network round trips with Gemini)
+are made outside the manager's lock: sessions needing a prefix that is
+being created wait for that creation only, and every other session goes on.
+Entries the manager stops tracking are never deleted server-side, since
+another session may still have a request in flight with them; they
+expire through their TTL.
+"""
+import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+
+from llm import LLMBackend
+
+
+class ContextCachingUnavailable(Exception):
+    """Raised by a backend when it cannot cache this prefix (unsupported model, prefix too small, ...)."""
+
+
+class ContextCacheBackend:
+    """Interface for services that can hold a prompt prefix server-side."""
+
+    def create(self, system_instruction, contents, ttl_seconds):
+        """Registers the prefix and returns an opaque handle."""
+        raise NotImplementedError
+
+    def refresh(self, handle, ttl_seconds):
+        """Extends the lifetime of a cached prefix."""
+        raise NotImplementedError
+
+    def delete(self, handle):
+        """Releases a cached prefix."""
+        raise NotImplementedError
+
+    def model_for(self, handle):
+        """Returns an LLMBackend whose requests are prefixed by the cached content."""
+        raise NotImplementedError
+
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """Gemini explicit context caching (google.generativeai.caching)."""
+
+    # Gemini rejects cached contents below this many tokens; ~4 characters per token
+    MIN_PREFIX_CHARS = 32768 * 4
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def create(self, system_instruction, contents, ttl_seconds):
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        from llm import GeminiBackend
+
+        if sum(len(part["text"]) for content in contents for part in content["parts"]) < self.MIN_PREFIX_CHARS:
+            raise ContextCachingUnavailable("document is below the minimum size for context caching")
+        try:
+            cached_content = caching.CachedContent.create(
+                model=self.model_name,
+                system_instruction=system_instruction,
+                contents=contents,
+                ttl=datetime.timedelta(seconds=ttl_seconds),
+            )
+        except Exception as e:
+            raise ContextCachingUnavailable(str(e)) from e
+        return cached_content, GeminiBackend(genai.GenerativeModel.from_cached_content(cached_content=cached_content))
+
+    def refresh(self, handle, ttl_seconds):
+        handle[0].update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete(self, handle):
+        handle[0].delete()
+
+    def model_for(self, handle):
+        return handle[1]
+
+
+class PrefixReplayBackend(ContextCacheBackend):
+    """Emulates caching by replaying the prefix in front of every request.
+
+    Useful with local fake backends and in tests: callers exercise the same
+    code path as with a real cache while the backend sees the full prompt.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.created = 0
+
+    def create(self, system_instruction, contents, ttl_seconds):
+        self.created += 1
+        prefix = [
+            {"role": "user", "parts": [{"text": system_instruction}]},
+            {"role": "model", "parts": [{"text": "Understood."}]},
+        ] + list(contents)
+        return _PrefixedBackend(self.llm, prefix)
+
+    def refresh(self, handle, ttl_seconds):
+        pass
+
+    def delete(self, handle):
+        pass
+
+    def model_for(self, handle):
+        return handle
+
+
+class _PrefixedBackend(LLMBackend):
+    def __init__(self, llm, prefix):
+        self.llm = llm
+        self.prefix = prefix
+        self.name = llm.name
+
+    def _with_prefix(self, prompt):
+        if isinstance(prompt, str):
+            prompt = [{"role": "user", "parts": [{"text": prompt}]}]
+        return self.prefix + list(prompt)
+
+    def generate(self, prompt, **options):
+        return self.llm.generate(self._with_prefix(prompt), **options)
+
+    def stream(self, prompt, **options):
+        return self.llm.stream(self._with_prefix(prompt), **options)
+
+
+class _Entry:
+    __slots__ = ("handle", "expires_at", "failed")
+
+    def __init__(self, handle, expires_at, failed=False):
+        self.handle = handle
+        self.expires_at = expires_at
+        self.failed = failed
+
+
+class ContextCacheManager:
+    """Tracks cached prefixes by content hash and keeps them alive while in use."""
+
+    def __init__(self, backend, ttl_seconds=3600, refresh_margin_seconds=300, retry_after_seconds=900, max_entries=32):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._pending = {}  # key -> Future of the entry being created or refreshed
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prefix_key(system_instruction, contents):
+        digest = hashlib.sha256(system_instruction.encode("utf-8"))
+        for content in contents:
+            digest.update(content["role"].encode("utf-8"))
+            for part in content["parts"]:
+                digest.update(b"\0" + part["text"].encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_model(self, system_instruction, contents):
+        """Returns a model bound to the cached prefix, or None if the prefix cannot be cached."""
+        key = self.prefix_key(system_instruction, contents)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.failed:
+                # Do not ask the backend again on every turn for a prefix it just refused
+                if now < entry.expires_at:
+                    return None
+                entry = None
+            if entry is not None and now >= entry.expires_at:
+                entry = None
+            pending = self._pending.get(key)
+            if entry is not None and (pending is not None or entry.expires_at - now >= self.refresh_margin_seconds):
+                # Fresh, or already being refreshed by another session
+                return self.backend.model_for(entry.handle)
+            if pending is None:
+                pending = self._pending[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            entry = pending.result()
+            return None if entry.failed else self.backend.model_for(entry.handle)
+
+        try:
+            entry = self._refresh(entry, now) if entry is not None else None
+            if entry is None:
+                entry = self._create(system_instruction, contents, now)
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if entry is not None:
+                    self._entries[key] = entry
+                self._evict(now)
+            if entry is not None:
+                pending.set_result(entry)
+            else:
+                pending.set_result(_Entry(None, now, failed=True))
+        return None if entry.failed else self.backend.model_for(entry.handle)
+
+    def _refresh(self, entry, now):
+        """Extends entry's lifetime; None if the backend no longer has it."""
+        try:
+            self.backend.refresh(entry.handle, self.ttl_seconds)
+        except Exception:
+            return None
+        entry.expires_at = now + self.ttl_seconds
+        return entry
+
+    def _create(self, system_instruction, contents, now):
+        try:
+            handle = self.backend.create(system_instruction, contents, self.ttl_seconds)
+            return _Entry(handle, now + self.ttl_seconds)
+        except Exception:
+            return _Entry(None, now + self.retry_after_seconds, failed=True)
+
+    def _evict(self, now):
+        """Forgets expired entries, then the ones closest to expiry, to stay within max_entries.
+
+        Called with the lock held. The handles are not deleted: sessions that
+        got a model for them may still be using it, and they expire on their own.
+        """
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            del self._entries[min(self._entries, key=lambda k: self._entries[k].expires_at)]
@@ -0,0 +1,307 @@
+"""Near-duplicate detection for flashcards with MinHash and LSH.
+
+Each card is reduced to the set of content words of its question and
+answer. MinHash signatures estimate the Jaccard similarity of these sets,
+and locality-sensitive hashing (banding the signatures) finds candidate
+duplicates without comparing every pair of cards. Candidates are confirmed
+with the exact Jaccard similarity.
+
+Signatures use one-permutation hashing: every word is hashed once (and
+cached), the hash picks one of the signature's bins and each bin keeps its
+minimum. Empty bins are filled from the next non-empty bin (densification).
+
+A deck is processed as a whole with NumPy: the words of all cards are kept
+in flat arrays (CardWords), and signatures, band keys, candidate pairs and
+their Jaccard similarities are computed for every card at once. Python
+only walks the confirmed duplicate pairs to decide which card survives.
+"""
+import zlib
+from itertools import count
+from operator import itemgetter
+
+import numpy as np
+
+from retrieval import STOPWORDS
+
+_HASH_MASK = 0xFFFFFFFF
+_EMPTY = _HASH_MASK + 1
+# Added per bin of distance when an empty bin borrows a neighbour's value
+_DENSIFY_OFFSET = 0x9E3779B1
+# Odd 64-bit multiplier that folds the rows of a band into one key
+_BAND_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# Maps every byte that retrieval.TOKEN_PATTERN ([a-z0-9]+) does not match to a space, except the card separator
+_CARD_SEPARATOR = b"\x01"
+_WORD_BYTES = frozenset(b"abcdefghijklmnopqrstuvwxyz0123456789" + _CARD_SEPARATOR)
+_TOKEN_TABLE = bytes(byte if byte in _WORD_BYTES else ord(" ") for byte in range(256))
+_STOPWORD_BYTES = frozenset(word.encode("ascii") for word in STOPWORDS)
+
+
+def _sorted_unique(values):
+    # np.unique hashes integer arrays in NumPy 2, which is several times slower than sorting them here
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+
+class CardWords:
+    """The distinct content words of a list of cards, as flat arrays.
+
+    owners[i] is the card that vocabulary[ids[i]] belongs to; each card's
+    words are contiguous, in card order. The words are the ones
+    retrieval.tokenize finds (as UTF-8 bytes); a card made only of stopwords
+    is represented by its whole question.
+    """
+
+    def __init__(self, cards):
+        cards = list(cards)
+        self.count = len(cards)
+        # One pass over the whole deck: after lowercasing, the UTF-8 bytes of
+        # [a-z0-9] are the only ones TOKEN_PATTERN matches, and multi-byte
+        # characters never contain them, so translate and split find the same words.
+        texts = list(map(" ".join, map(itemgetter("question", "answer"), cards)))
+        text = " \x01 ".join(texts).lower().encode("utf-8")
+        if text.count(_CARD_SEPARATOR) != max(self.count - 1, 0):
+            # A card contains the separator itself
+            text = " \x01 ".join(text.replace("\x01", " ") for text in texts).lower().encode("utf-8")
+        tokens = text.translate(_TOKEN_TABLE).split()
+        # Each token gets the position of its word's first occurrence, then those are numbered 0, 1, 2, ...
+        vocabulary = {}
+        ids = np.fromiter(map(vocabulary.setdefault, tokens, count()), np.int64, len(tokens))
+        dense = np.empty(len(tokens), dtype=np.int64)
+        dense[np.fromiter(vocabulary.values(), np.int64, len(vocabulary))] = np.arange(len(vocabulary))
+        ids = dense[ids]
+        self.vocabulary = list(vocabulary)
+        separator = dense[vocabulary[_CARD_SEPARATOR]] if _CARD_SEPARATOR in vocabulary else -1
+        owners = np.cumsum(ids == separator)
+        is_stopword = np.fromiter(map(_STOPWORD_BYTES.__contains__, self.vocabulary), bool, len(self.vocabulary))
+        content = ~is_stopword[ids] & (ids != separator)
+        # One entry per distinct word of a card, in card order
+        keys = _sorted_unique(owners[content] * max(len(self.vocabulary), 1) + ids[content])
+        owners, ids = np.divmod(keys, max(len(self.vocabulary), 1))
+        sizes = np.bincount(owners, minlength=self.count)
+        blank = np.flatnonzero(sizes == 0)
+        if len(blank):
+            questions = [cards[card]["question"].strip().lower().encode("utf-8") for card in blank.tolist()]
+            vocabulary = dict(zip(self.vocabulary, count()))
+            question_ids = np.fromiter(map(lambda question: vocabulary.setdefault(question, len(vocabulary)), questions),
+                                       np.int64, len(questions))
+            self.vocabulary = list(vocabulary)
+            order = np.argsort(np.concatenate((owners, blank)), kind="stable")
+            owners = np.concatenate((owners, blank))[order]
+            ids = np.concatenate((ids, question_ids))[order]
+            sizes[blank] = 1
+        self.owners = owners
+        self.ids = ids
+        self.sizes = sizes
+
+    def reordered(self, order):
+        """The same words with the cards in the given order (a permutation of card positions)."""
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        regrouped = np.argsort(rank[self.owners], kind="stable")
+        reordered = object.__new__(CardWords)
+        reordered.count = self.count
+        reordered.vocabulary = self.vocabulary
+        reordered.owners = rank[self.owners][regrouped]
+        reordered.ids = self.ids[regrouped]
+        reordered.sizes = self.sizes[order]
+        return reordered
+
+    def coverage(self, terms):
+        """How many of the document's key terms each card mentions."""
+        if not terms:
+            return np.zeros(self.count, dtype=np.int64)
+        encoded = {term.encode("utf-8") for term in terms}
+        is_term = np.fromiter(map(encoded.__contains__, self.vocabulary), bool, len(self.vocabulary))
+        return np.bincount(self.owners[is_term[self.ids]], minlength=self.count)
+
+
+class NearDuplicateIndex:
+    """LSH index over the cards kept so far; add() keeps the cards that are not near-duplicates.
+
+    With the default 16 bins in 8 bands of 2, cards with a Jaccard similarity
+    of 0.6 share a band (and get compared) over 90% of the time, and cards
+    at 0.7 about 98% of the time, while unrelated cards rarely do. Words are
+    compared by their 32-bit hashes.
+    """
+
+    def __init__(self, threshold=0.6, num_bins=16, bands=8, seed=1):
+        if num_bins & (num_bins - 1) or num_bins % bands:
+            raise ValueError("num_bins must be a power of two and a multiple of bands")
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.bands = bands
+        self.rows = num_bins // bands
+        self.seed = seed
+        self._token_hashes = {}
+        # The kept cards: bin minimums, band keys, word hashes (card by card) and number of words
+        self._minimums = np.empty((0, num_bins), dtype=np.uint64)
+        self._keys = np.empty((0, bands), dtype=np.uint64)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._sizes = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _hash(self, token):
+        # Multiplicative mixing spreads crc32's bits before they choose a bin
+        value = (zlib.crc32(token, self.seed) * 0x9E3779B1) & _HASH_MASK
+        self._token_hashes[token] = value
+        return value
+
+    def word_hashes(self, words):
+        """The hash of every word of a CardWords, in its order."""
+        cached = self._token_hashes
+        for token in set(words.vocabulary).difference(cached):
+            self._hash(token)
+        return np.fromiter(map(cached.__getitem__, words.vocabulary), np.uint64, len(words.vocabulary))[words.ids]
+
+    def bin_minimums(self, owners, hashes, card_count):
+        """Each card's smallest word hash per bin (_EMPTY where none falls), from each word's card and hash."""
+        num_bins = self.num_bins
+        minimums = np.full(card_count * num_bins, _EMPTY, dtype=np.uint64)
+        np.minimum.at(minimums, owners * num_bins + (hashes & np.uint64(num_bins - 1)).astype(np.int64), hashes)
+        return minimums.reshape(card_count, num_bins)
+
+    def signatures(self, minimums):
+        """MinHash signatures, one row of num_bins values per card, with the empty bins filled in."""
+        num_bins = self.num_bins
+        signatures = minimums
+        empty = signatures == _EMPTY
+        if empty.any():
+            # Each empty bin takes the next non-empty bin to its right, wrapping around (a doubled ring)
+            ring = np.concatenate((signatures, signatures), axis=1)
+            positions = np.arange(2 * num_bins)
+            filled_at = np.where(np.concatenate((empty, empty), axis=1), 2 * num_bins, positions)
+            next_filled = np.minimum.accumulate(filled_at[:, ::-1], axis=1)[:, ::-1][:, :num_bins]
+            borrowed = np.take_along_axis(ring, next_filled, axis=1)
+            distance = (next_filled - positions[:num_bins]).astype(np.uint64)
+            signatures = np.where(empty, (borrowed + distance * np.uint64(_DENSIFY_OFFSET)) & np.uint64(_HASH_MASK),
+                                  signatures)
+        return signatures
+
+    def _band_keys(self, signatures):
+        # Strided bands: densification copies values into neighbouring bins, so
+        # adjacent bins are correlated and would make common words collide.
+        # A band's rows are folded into one 64-bit key; keys that collide by
+        # chance only cost an exact comparison.
+        bands = self.bands
+        keys = signatures[:, :bands].copy()
+        for row in range(1, self.rows):
+            keys = keys * _BAND_MULTIPLIER ^ signatures[:, row * bands:(row + 1) * bands]
+        return keys
+
+    @staticmethod
+    def _candidate_pairs(keys, first_new):
+        """(earlier, later) row pairs sharing the key of at least one band, where later >= first_new."""
+        pairs = []
+        for column in keys.T:
+            order = np.argsort(column, kind="stable")
+            ordered = column[order]
+            positions = np.arange(len(ordered))
+            # Each row pairs with the rows before it in its run of equal keys
+            run_start = np.maximum.accumulate(np.where(np.r_[True, ordered[1:] != ordered[:-1]], positions, 0))
+            earlier_count = positions - run_start
+            total = int(earlier_count.sum())
+            if not total:
+                continue
+            later = np.repeat(positions, earlier_count)
+            earlier = np.repeat(run_start, earlier_count) + np.arange(total) - np.repeat(
+                np.cumsum(earlier_count) - earlier_count, earlier_count)
+            first, second = order[earlier], order[later]
+            first, second = np.minimum(first, second), np.maximum(first, second)
+            new = second >= first_new
+            pairs.append(first[new] * len(ordered) + second[new])
+        if not pairs:
+            return np.empty((0, 2), dtype=np.int64)
+        return np.stack(np.divmod(_sorted_unique(np.concatenate(pairs)), len(keys)), axis=1)
+
+    def _may_be_similar(self, pairs, minimums, sizes):
+        """Drops pairs that provably miss the threshold, before their words are compared.
+
+        A bin where the two cards' minimums differ holds a word only one of
+        them has, and a Jaccard similarity of t allows at most
+        (|A| + |B|)(1 - t) / (1 + t) such words.
+        """
+        first, second = pairs[:, 0], pairs[:, 1]
+        differing = (minimums[first] != minimums[second]).sum(axis=1)
+        return pairs[differing * (1 + self.threshold) <= (sizes[first] + sizes[second]) * (1 - self.threshold)]
+
+    def _similar(self, pairs, hashes, sizes, starts, chunk_size=4096):
+        """Marks the pairs of cards whose word sets reach the Jaccard threshold."""
+        first, second = pairs[:, 0], pairs[:, 1]
+        shared = np.zeros(len(pairs), dtype=np.int64)
+        # Pairs of similar sizes go together, so a few long cards do not widen every block
+        order = np.argsort(np.maximum(sizes[first], sizes[second]), kind="stable")
+        for start in range(0, len(pairs), chunk_size):
+            chunk = order[start:start + chunk_size]
+            width = int(max(sizes[first[chunk]].max(), sizes[second[chunk]].max()))
+            columns = np.arange(width)
+
+            def block(cards, padding):
+                # Each card's word hashes in a row, padded with a value no word hash takes
+                present = columns < sizes[cards][:, None]
+                word = np.where(present, starts[cards][:, None] + columns, 0)
+                return np.where(present, hashes[word], np.uint64(padding))
+
+            left, right = block(first[chunk], _EMPTY), block(second[chunk], _EMPTY + 1)
+            shared[chunk] = (left[:, :, None] == right[:, None, :]).sum(axis=(1, 2))
+        return shared >= self.threshold * (sizes[first] + sizes[second] - shared)
+
+    def add(self, words, limit=None):
+        """Adds the cards of a CardWords in order, skipping near-duplicates of cards kept before them.
+
+        Returns the positions of the cards added; stops once limit cards have been added.
+        """
+        if not words.count:
+            return []
+        kept_count = len(self._keys)
+        hashes = self.word_hashes(words)
+        minimums = self.bin_minimums(words.owners, hashes, words.count)
+        keys = self._band_keys(self.signatures(minimums))
+        # Cards already kept come first, so they are never the ones dropped
+        all_minimums = np.concatenate((self._minimums, minimums))
+        all_keys = np.concatenate((self._keys, keys))
+        all_hashes = np.concatenate((self._hashes, hashes))
+        all_sizes = np.concatenate((self._sizes, words.sizes))
+        starts = np.cumsum(all_sizes) - all_sizes
+        pairs = self._may_be_similar(self._candidate_pairs(all_keys, kept_count), all_minimums, all_sizes)
+        duplicates = pairs[self._similar(pairs, all_hashes, all_sizes, starts)]
+        dropped = [False] * len(all_keys)
+        # Sorted by the later card, so whether the earlier one was dropped is already settled
+        for earlier, later in duplicates[np.lexsort((duplicates[:, 0], duplicates[:, 1]))].tolist():
+            if not dropped[earlier]:
+                dropped[later] = True
+        added = np.flatnonzero(~np.array(dropped[kept_count:], dtype=bool))
+        if limit:
+            added = added[:limit]
+        chosen = np.zeros(words.count, dtype=bool)
+        chosen[added] = True
+        self._minimums = np.concatenate((self._minimums, minimums[chosen]))
+        self._keys = np.concatenate((self._keys, keys[chosen]))
+        self._hashes = np.concatenate((self._hashes, hashes[chosen[words.owners]]))
+        self._sizes = np.concatenate((self._sizes, words.sizes[chosen]))
+        return added.tolist()
+
+
+def dedupe_flashcards(cards, max_flashcards=None, existing=(), index=None, terms=None, words=None):
+    """Keeps cards in order, dropping near-duplicates of other cards and of the existing ones.
+
+    With terms (the document's key terms), the card mentioning more of them
+    survives among near-duplicates; otherwise the earlier card does. Existing
+    cards always survive. Pass an index to keep deduplicating against it
+    across calls, and words (CardWords of cards) when already computed.
+    """
+    if index is None:
+        index = NearDuplicateIndex()
+    if existing:
+        index.add(CardWords(existing))
+    words = words if words is not None else CardWords(cards)
+    if not terms:
+        return [cards[position] for position in index.add(words, max_flashcards)]
+    # Offer the cards best covered first, so they are the ones kept
+    order = np.argsort(-words.coverage(terms), kind="stable")
+    keep = set(order[index.add(words.reordered(order))].tolist())
+    kept = [card for position, card in enumerate(cards) if position in keep]
+    return kept[:max_flashcards] if max_flashcards else kept
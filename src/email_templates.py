@@ -0,0 +1,176 @@
+"""Rendering of the flashcard email and its deck attachments.
+
+The email is built from templates parsed once at import: rendering a
+deck only fills in the fields and joins all the pieces in one go, so its
+cost grows linearly with the number of cards. Card text is HTML-escaped
+in the HTML part, and a plain-text part is rendered alongside it.
+
+Attachments: CSV, and an Anki deck (`.apkg` when the optional `genanki`
+package is installed, otherwise a tab-separated file Anki can import).
+"""
+import base64
+import csv
+import html
+import io
+import zlib
+from string import Formatter
+
+EMAIL_SUBJECT = "Your Flashcards from FlashMind AI have arrived!!!"
+
+
+class Template:
+    """A str.format-style template with plain {name} fields.
+
+    The field names are resolved to positions once, when the template is
+    created, so rendering is a single str.format call.
+    """
+
+    def __init__(self, source):
+        self.fields = []
+        pieces = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if format_spec or conversion:
+                raise ValueError(f"Template fields take no format spec or conversion: {field}")
+            if field not in self.fields:
+                self.fields.append(field)
+            pieces.append(f"{{{self.fields.index(field)}}}")
+        self._format = "".join(pieces).format
+
+    def render(self, **values):
+        return self._format(*(values[field] for field in self.fields))
+
+    def render_all(self, separator="", **columns):
+        """Renders the template once per row of columns (one iterable per field) and joins the results."""
+        return separator.join(map(self._format, *(columns[field] for field in self.fields)))
+
+
+EMAIL_PAGE_HTML = Template("""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: 'Poppins', sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9; }}
+            h2 {{ color: #555; }}
+            .flashcard-section {{ margin-bottom: 20px; border: 1px dashed #ccc; padding: 15px; border-radius: 5px; background-color: #fff; }}
+            .question {{ font-weight: bold; color: #555; }}
+            .answer {{ color: #008000; margin-top: 5px; }}
+            .footer {{ margin-top: 30px; font-size: 0.9em; color: #777; text-align: center; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h2>Your Flashcards on "{subject_title}" from FlashMind AI</h2>
+            <p>Hello,</p>
+            <p>Here are the flashcards you requested:</p>
+{cards}
+            <p>Happy learning!</p>
+            <p>Best regards,<br>The FlashMind AI Team</p>
+            <div class="footer">
+                <p>This email was sent from FlashMind AI. <a href="https://github.com/bigm-o/Flash_mind.git">Visit our GitHub!</a></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+EMAIL_CARD_HTML = Template("""
+            <div class="flashcard-section">
+                <p class="question"><strong>Q{number}:</strong> {question}</p>
+                <p class="answer"><strong>A{number}:</strong> {answer}</p>
+            </div>""")
+
+EMAIL_TEXT = Template("""Your Flashcards on "{subject_title}" from FlashMind AI
+
+Here are the flashcards you requested:
+
+{cards}
+Happy learning!
+The FlashMind AI Team
+""")
+
+EMAIL_CARD_TEXT = Template("Q{number}: {question}\nA{number}: {answer}\n")
+
+
+ATTACHMENT_FORMATS = ("csv", "anki")
+
+# Stable ids so re-imported decks update the same Anki note type
+ANKI_MODEL_ID = 1607392319
+ANKI_CARD_CSS = ".card { font-family: 'Poppins', sans-serif; font-size: 20px; text-align: center; }"
+
+
+def escape_card_text(text):
+    """HTML-escapes card text, keeping line breaks."""
+    return html.escape(text).replace("\n", "<br>")
+
+
+def _attachment(filename, mime_type, data):
+    return {"filename": filename, "mime_type": mime_type, "content_base64": base64.b64encode(data).decode("ascii")}
+
+
+def _anki_package(cards, deck_name):
+    """Builds an .apkg deck with genanki; returns None when genanki is not installed."""
+    try:
+        import genanki
+    except ImportError:
+        return None
+    model = genanki.Model(
+        ANKI_MODEL_ID,
+        "FlashMind AI",
+        fields=[{"name": "Question"}, {"name": "Answer"}],
+        templates=[{"name": "Card 1", "qfmt": "{{Question}}", "afmt": "{{FrontSide}}<hr id=answer>{{Answer}}"}],
+        css=ANKI_CARD_CSS,
+    )
+    deck = genanki.Deck(zlib.crc32(deck_name.encode("utf-8")), deck_name)
+    for question, answer in cards:
+        deck.add_note(genanki.Note(model=model, fields=[question, answer]))
+    buffer = io.BytesIO()
+    genanki.Package(deck).write_to_file(buffer)
+    return buffer.getvalue()
+
+
+def anki_deck_file(rows, deck_name):
+    """Returns (file name suffix, mime type, bytes) of an Anki deck of (question, answer) HTML rows."""
+    package = _anki_package(rows, deck_name)
+    if package is not None:
+        return ".apkg", "application/octet-stream", package
+    # Anki imports tab-separated notes with HTML fields (File > Import)
+    lines = ["#separator:tab", "#html:true"]
+    lines.extend(f"{question.replace(chr(9), ' ')}\t{answer.replace(chr(9), ' ')}" for question, answer in rows)
+    return "_anki.txt", "text/plain", ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def safe_file_name(title):
+    """Turns a subject title into a file name stem."""
+    stem = "".join(ch if ch.isalnum() or ch in " -_" else "" for ch in title).strip().replace(" ", "_")
+    return stem[:60] or "flashcards"
+
+
+def render_flashcard_email(flashcards_data, subject_title="FlashMind AI Flashcards", attachments=()):
+    """Returns (html, text, attachment dicts) for a deck."""
+    subject_title = subject_title or "FlashMind AI Flashcards"
+    questions = [card["question"] for card in flashcards_data]
+    answers = [card["answer"] for card in flashcards_data]
+    escaped_questions = [escape_card_text(question) for question in questions]
+    escaped_answers = [escape_card_text(answer) for answer in answers]
+
+    numbers = range(1, len(questions) + 1)
+    cards_html = EMAIL_CARD_HTML.render_all(number=numbers, question=escaped_questions, answer=escaped_answers)
+    html_body = EMAIL_PAGE_HTML.render(subject_title=html.escape(subject_title), cards=cards_html)
+    cards_text = EMAIL_CARD_TEXT.render_all("\n", number=numbers, question=questions, answer=answers)
+    text_body = EMAIL_TEXT.render(subject_title=subject_title, cards=cards_text)
+
+    files = []
+    stem = safe_file_name(subject_title)
+    if "csv" in attachments:
+        csv_buffer = io.StringIO()
+        csv_writer = csv.writer(csv_buffer)
+        csv_writer.writerow(["question", "answer"])
+        csv_writer.writerows(zip(questions, answers))
+        files.append(_attachment(f"{stem}.csv", "text/csv", csv_buffer.getvalue().encode("utf-8")))
+    if "anki" in attachments:
+        suffix, mime_type, data = anki_deck_file(list(zip(escaped_questions, escaped_answers)), subject_title)
+        files.append(_attachment(f"{stem}{suffix}", mime_type, data))
+    return html_body, text_body, files
@@ -0,0 +1,210 @@
+"""Streaming text extraction for uploaded PDF, DOCX and TXT files.
+
+Pages are produced by generators so callers can start working on the first
+pages while the rest are still being extracted. Large PDFs can be split
+across a process pool, and extracted pages are cached by file hash so a
+re-upload of the same file skips the work entirely. Scanned pages can be
+passed through an OCRPipeline (see ocr.py).
+"""
+import hashlib
+import io
+import threading
+
+from docx import Document
+from PyPDF2 import PdfReader
+
+import tracing
+from flashcard_cache import LRUCache
+
+# PDFs with more pages than this are split across the process pool when one is given
+PARALLEL_PAGE_THRESHOLD = 40
+PAGES_PER_TASK = 16
+
+
+def file_hash(file_bytes):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+class PageCache:
+    """Remembers extracted pages per file hash, shared across sessions."""
+
+    def __init__(self, max_files=64):
+        self._files = LRUCache(max_files)
+
+    def get(self, digest, page_number):
+        pages = self._files.get(digest)
+        return None if pages is None else pages.get(page_number)
+
+    def set(self, digest, page_number, text):
+        pages = self._files.get(digest)
+        if pages is None:
+            pages = {}
+            self._files.set(digest, pages)
+        pages[page_number] = text
+
+
+# --- PDF ---
+def _extract_pdf_page_range(file_bytes, start, stop):
+    """Worker entry point: extracts pages [start, stop) of a PDF."""
+    reader = PdfReader(io.BytesIO(file_bytes))
+    return [_page_text(reader.pages[number]) for number in range(start, stop)]
+
+
+def _page_text(page):
+    return (page.extract_text() or "") + "\n"
+
+
+def iter_pdf_pages(file_bytes, executor=None, page_cache=None):
+    """Yields the text of each PDF page in order.
+
+    With an executor (ideally a ProcessPoolExecutor), large PDFs are split
+    into page ranges extracted in parallel; pages are still yielded in order
+    as soon as their range is ready.
+    """
+    digest = file_hash(file_bytes) if page_cache is not None else None
+    reader = PdfReader(io.BytesIO(file_bytes))
+    page_count = len(reader.pages)
+
+    def cached(number):
+        return page_cache.get(digest, number) if page_cache is not None else None
+
+    def remember(number, text):
+        if page_cache is not None:
+            page_cache.set(digest, number, text)
+
+    missing = [number for number in range(page_count) if cached(number) is None]
+    if executor is None or len(missing) <= PARALLEL_PAGE_THRESHOLD:
+        for number in range(page_count):
+            text = cached(number)
+            if text is None:
+                text = _page_text(reader.pages[number])
+                remember(number, text)
+            yield text
+        return
+
+    futures = {}
+    for start in range(0, page_count, PAGES_PER_TASK):
+        stop = min(start + PAGES_PER_TASK, page_count)
+        if any(cached(number) is None for number in range(start, stop)):
+            futures[start] = executor.submit(_extract_pdf_page_range, file_bytes, start, stop)
+    for start in range(0, page_count, PAGES_PER_TASK):
+        stop = min(start + PAGES_PER_TASK, page_count)
+        if start in futures:
+            for number, text in enumerate(futures[start].result(), start=start):
+                remember(number, text)
+                yield text
+        else:
+            for number in range(start, stop):
+                yield cached(number)
+
+
+# --- DOCX ---
+def _table_text(table):
+    rows = []
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            # Merged cells repeat the same cell object across the row
+            if not cells or cell.text != cells[-1]:
+                cells.append(cell.text)
+        rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+def iter_docx_blocks(file_bytes):
+    """Yields headers, body paragraphs and tables (in document order), then footers."""
+    document = Document(io.BytesIO(file_bytes))
+    seen_headers = set()
+    for section in document.sections:
+        text = "\n".join(paragraph.text for paragraph in section.header.paragraphs if paragraph.text)
+        if text and text not in seen_headers:
+            seen_headers.add(text)
+            yield text + "\n"
+
+    paragraphs = {paragraph._p: paragraph for paragraph in document.paragraphs}
+    tables = {table._tbl: table for table in document.tables}
+    for element in document.element.body.iterchildren():
+        if element in paragraphs:
+            yield paragraphs[element].text + "\n"
+        elif element in tables:
+            yield _table_text(tables[element]) + "\n"
+
+    seen_footers = set()
+    for section in document.sections:
+        text = "\n".join(paragraph.text for paragraph in section.footer.paragraphs if paragraph.text)
+        if text and text not in seen_footers:
+            seen_footers.add(text)
+            yield text + "\n"
+
+
+# --- Dispatch ---
+def iter_document_pages(file_name, file_bytes, executor=None, page_cache=None, ocr=None, ocr_stats=None, tenant=None):
+    """Yields text pieces for any supported file type; raises ValueError for others.
+
+    With an OCRPipeline, scanned PDF pages are recognised (as tenant's requests)
+    instead of coming through empty.
+    """
+    file_extension = file_name.rsplit(".", 1)[-1].lower()
+    if file_extension == "pdf":
+        pages = iter_pdf_pages(file_bytes, executor, page_cache)
+        return ocr.page_texts(file_bytes, pages, ocr_stats, tenant) if ocr is not None else pages
+    if file_extension == "docx":
+        return iter_docx_blocks(file_bytes)
+    if file_extension == "txt":
+        return iter([file_bytes.decode("utf-8", errors="replace")])
+    raise ValueError(f"Unsupported file type: .{file_extension}")
+
+
+class BackgroundExtraction:
+    """Runs a page generator as a background job and exposes pages as they arrive.
+
+    submit schedules the job, like an executor's submit (e.g. FlashMindService.submit
+    bound to a session), so extractions share a bounded pool instead of a thread each.
+    """
+
+    def __init__(self, pages_iterator, submit):
+        self.pages = []
+        self.char_count = 0
+        self.error = None
+        self.done = False
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._future = submit(self._run, pages_iterator)
+
+    def _run(self, pages_iterator):
+        span = tracing.span("extraction")
+        try:
+            with span:
+                for page in pages_iterator:
+                    with self._lock:
+                        self.pages.append(page)
+                        self.char_count += len(page)
+                        self._ready.notify_all()
+                span.set(pages=len(self.pages), chars=self.char_count)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._lock:
+                self.done = True
+                self._ready.notify_all()
+
+    def wait_for(self, page_count, timeout=None):
+        """Blocks until page_count pages are available or extraction ends."""
+        with self._lock:
+            self._ready.wait_for(lambda: self.done or len(self.pages) >= page_count, timeout)
+            return len(self.pages)
+
+    def wait_for_chars(self, char_count, timeout=None):
+        """Blocks until at least char_count characters are available or extraction ends."""
+        with self._lock:
+            self._ready.wait_for(lambda: self.done or self.char_count >= char_count, timeout)
+            return self.char_count
+
+    def snapshot(self, start=0):
+        """Returns a copy of the pages extracted so far, starting at index start."""
+        with self._lock:
+            return self.pages[start:]
+
+    def text(self):
+        return "".join(self.snapshot())
@@ -0,0 +1,153 @@
+"""Content-addressed cache for generated flashcard decks.
+
+Decks are keyed by a hash of everything that influences the model output
+(source text, card limit, prompt template and model name), so a Streamlit
+rerun with the same inputs returns the same cards without calling Gemini.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def flashcard_cache_key(source_text, max_flashcards, prompt_template, model_name):
+    """Returns a stable hex digest for a flashcard generation request."""
+    digest = hashlib.sha256()
+    for part in (source_text, max_flashcards, prompt_template, model_name):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# --- In-process LRU tier ---
+class LRUCache:
+    """A small thread-safe LRU cache shared by every session in the process."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# --- Optional on-disk tier ---
+class SQLiteDiskCache:
+    """Persists decks in SQLite with a TTL and a total size budget.
+
+    The file may be shared by several processes (batch workers, server
+    replicas): WAL lets readers run alongside a writer, and a writer waits
+    up to timeout_seconds for the lock instead of failing at once.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_bytes=50 * 1024 * 1024, timeout_seconds=30.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=timeout_seconds, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flashcards (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM flashcards WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM flashcards WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE flashcards SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO flashcards (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """Drops expired rows, then least recently used rows until under budget."""
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM flashcards WHERE created < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM flashcards").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM flashcards ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM flashcards WHERE key = ?", (key,))
+            total -= size
+
+
+class FlashcardCache:
+    """Two-tier cache: an LRU in memory backed by an optional disk cache."""
+
+    def __init__(self, max_entries=256, disk_cache=None):
+        self.memory = LRUCache(max_entries)
+        self.disk = disk_cache
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
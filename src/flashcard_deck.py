@@ -0,0 +1,75 @@
+"""Paginated, bidirectional flashcard deck component.
+
+The component's HTML/JS (flashcard_component/index.html) is loaded once per
+deck and kept mounted across reruns. Each render sends only the cards of
+the current page, so the payload and frame height stay the same whatever
+the deck size. Page changes, flips and known/unknown answers come back as
+events, which are applied before the next render.
+"""
+import os
+
+import streamlit.components.v1 as components
+
+FLASHCARD_PAGE_SIZE = 6
+
+_COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flashcard_component")
+_flashcard_deck = components.declare_component("flashcard_deck", path=_COMPONENT_DIR)
+
+
+class DeckView:
+    """Page, feedback and last handled event for one deck in one session."""
+
+    def __init__(self, deck_id, page_size=FLASHCARD_PAGE_SIZE):
+        self.deck_id = deck_id
+        self.page_size = page_size
+        self.page = 0
+        self.feedback = {}  # card index -> {"known": bool or None, "flips": int}
+        self.last_event_id = None
+
+    def page_count(self, total):
+        return max(1, -(-total // self.page_size))
+
+    @property
+    def known_count(self):
+        return sum(1 for entry in self.feedback.values() if entry.get("known"))
+
+    def apply(self, event, total):
+        """Applies an event from the browser once; returns True if it was new."""
+        if not event or event.get("id") == self.last_event_id:
+            return False
+        self.last_event_id = event.get("id")
+        for index, count in (event.get("flips") or {}).items():
+            entry = self.feedback.setdefault(int(index), {"known": None, "flips": 0})
+            entry["flips"] += count
+        action = event.get("action")
+        if action == "page":
+            self.page = min(max(0, int(event.get("page", 0))), self.page_count(total) - 1)
+        elif action in ("known", "unknown"):
+            entry = self.feedback.setdefault(int(event["index"]), {"known": None, "flips": 0})
+            entry["known"] = action == "known"
+        return True
+
+
+def flashcard_deck(cards, view, key):
+    """Renders the current page of the deck and returns the latest browser event."""
+    total = len(cards)
+    view.page = min(view.page, view.page_count(total) - 1)
+    start = view.page * view.page_size
+    window = [
+        {
+            "index": index,
+            "question": card["question"],
+            "answer": card["answer"],
+            "known": view.feedback.get(index, {}).get("known"),
+        }
+        for index, card in enumerate(cards[start:start + view.page_size], start)
+    ]
+    return _flashcard_deck(
+        cards=window,
+        page=view.page,
+        page_count=view.page_count(total),
+        total=total,
+        known_count=view.known_count,
+        key=key,
+        default=None,
+    )
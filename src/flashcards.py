@@ -0,0 +1,296 @@
+"""Flashcard prompt building, parsing and map-reduce generation.
+
+Cards are requested as structured JSON (FLASHCARD_SCHEMA) and parsed
+incrementally while the response streams in, so each card is available as
+soon as its object is complete. Responses that are not JSON fall back to
+the "Q: ... A: ..." text parser.
+
+Long documents are split into sections, cards are generated for each
+section concurrently on a bounded thread pool, and the results are merged,
+deduplicated and ranked down to the requested number of cards.
+"""
+import itertools
+import json
+import math
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import tracing
+from dedupe import CardWords, dedupe_flashcards
+from retrieval import chunk_text, tokenize
+
+FLASHCARD_PROMPT_TEMPLATE = """
+    Generate question and answer flashcards based on the following text.
+    Return a JSON array of objects, each with a "question" and an "answer" string.
+    Ensure the questions cover key concepts and facts from the text.
+    Do not include any introductory or concluding remarks, just the flashcards.
+    {limit_instruction}
+
+    Text:
+    ---
+    {source_text}
+    ---
+    Flashcards:
+    """
+
+# Response schema passed to the model as json_schema
+FLASHCARD_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"question": {"type": "STRING"}, "answer": {"type": "STRING"}},
+        "required": ["question", "answer"],
+    },
+}
+
+# Documents up to this many characters are sent in a single prompt
+MAP_CHUNK_SIZE = 12000
+
+
+def build_flashcard_prompt(source_text, max_flashcards=None):
+    """Fills the flashcard prompt template for the given text."""
+    return FLASHCARD_PROMPT_TEMPLATE.format(
+        limit_instruction=f"Generate a maximum of {max_flashcards} flashcards." if max_flashcards else "",
+        source_text=source_text,
+    )
+
+
+def parse_flashcards(flashcard_response):
+    """Parses "Q: ... A: ..." model output into (flashcards, malformed_pairs).
+
+    Only the first "A:" of a pair separates question from answer, so answers
+    that themselves contain "A:" are kept whole.
+    """
+    flashcards_data = []
+    malformed = []
+    for pair in flashcard_response.split("Q:"):
+        if "A:" not in pair:
+            continue
+        question, _, answer = pair.partition("A:")
+        if question.strip() and answer.strip():
+            flashcards_data.append({"question": question.strip(), "answer": answer.strip()})
+        else:
+            malformed.append([question, answer])
+    return flashcards_data, malformed
+
+
+# --- Structured (JSON) output ---
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'["\\]')
+
+
+class FlashcardStreamParser:
+    """Incremental parser for a streamed JSON array of {"question", "answer"} objects.
+
+    feed() scans only the new text and returns the cards completed by it.
+    Text before the opening bracket may only be whitespace or a ```json fence;
+    anything else marks the response as not JSON (failed).
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.failed = False
+        self.malformed = []
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._object_start = None
+
+    def feed(self, chunk):
+        if self.finished or self.failed:
+            return []
+        self._buffer += chunk
+        buffer = self._buffer
+        position = self._position
+        if not self.started:
+            bracket = buffer.find("[")
+            prefix = buffer if bracket == -1 else buffer[:bracket]
+            if not "json".startswith(prefix.strip().strip("`").strip().lower()):
+                self.failed = True
+                return []
+            if bracket == -1:
+                return []
+            self.started = True
+            self._depth = 1
+            position = bracket + 1
+
+        cards = []
+        while not self.finished:
+            if self._in_string:
+                match = _STRING_END.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        position = match.start()  # wait for the escaped character
+                        break
+                    position = match.end() + 1
+                    continue
+                self._in_string = False
+                position = match.end()
+                continue
+            match = _STRUCTURE.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            char = match.group()
+            position = match.end()
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "{" and self._depth == 2:
+                    self._object_start = match.start()
+            else:
+                self._depth -= 1
+                if char == "}" and self._depth == 1 and self._object_start is not None:
+                    card = self._card(buffer[self._object_start:position])
+                    if card is not None:
+                        cards.append(card)
+                    self._object_start = None
+                elif self._depth == 0:
+                    self.finished = True
+
+        # Drop text that has been fully consumed
+        keep_from = self._object_start if self._object_start is not None else position
+        self._buffer = buffer[keep_from:]
+        self._position = position - keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return cards
+
+    def _card(self, text):
+        try:
+            value = json.loads(text)
+        except ValueError:
+            self.malformed.append(text)
+            return None
+        question, answer = value.get("question"), value.get("answer")
+        if not isinstance(question, str) or not isinstance(answer, str) or not question.strip() or not answer.strip():
+            self.malformed.append(value)
+            return None
+        return {"question": question.strip(), "answer": answer.strip()}
+
+
+def parse_flashcard_response(flashcard_response):
+    """Parses a complete response: JSON cards when possible, otherwise the Q:/A: text format."""
+    with tracing.span("flashcards.parse", response_chars=len(flashcard_response)):
+        return _parse_flashcard_response(flashcard_response)
+
+
+def _parse_flashcard_response(flashcard_response):
+    parser = FlashcardStreamParser()
+    cards = parser.feed(flashcard_response)
+    if not parser.started:
+        return parse_flashcards(flashcard_response)
+    return cards, parser.malformed
+
+
+def stream_flashcards(stream_fn, source_text, max_flashcards=None, on_card=None):
+    """Streams one generation and calls on_card(card) as soon as each card is complete.
+
+    stream_fn takes a prompt and yields text chunks. Returns (flashcards, malformed_pairs).
+    """
+    parser = FlashcardStreamParser()
+    chunks = []
+    cards = []
+    for chunk in stream_fn(build_flashcard_prompt(source_text, max_flashcards)):
+        chunks.append(chunk)
+        for card in parser.feed(chunk):
+            cards.append(card)
+            if on_card:
+                on_card(card)
+    if not parser.started:
+        # The model ignored JSON mode; parse the text format instead
+        cards, malformed = parse_flashcards("".join(chunks))
+        if on_card:
+            for card in cards:
+                on_card(card)
+        return cards, malformed
+    return cards, parser.malformed
+
+
+# --- Map-reduce generation ---
+def key_terms(text, limit=200):
+    """Returns the most frequent content words of a text."""
+    counts = Counter(token for token in tokenize(text) if len(token) > 2 and not token.isdigit())
+    return {term for term, _ in counts.most_common(limit)}
+
+
+def merge_flashcards(card_lists, max_flashcards, source_text=""):
+    """Drops near-duplicate cards across sections and picks the best ones round-robin.
+
+    Cards are ranked by how many of the document's key terms they mention,
+    and sections take turns contributing their best remaining card so the
+    final deck covers the whole document rather than just its beginning.
+    Of cards saying nearly the same thing, only the one mentioning the most
+    key terms is kept.
+    """
+    terms = key_terms(source_text) if source_text else set()
+    cards = [card for section_cards in card_lists for card in section_cards]
+    # Tokenize every card once, for both ranking and deduplication
+    words = CardWords(cards)
+    scores = words.coverage(terms)
+    ranked_lists = []
+    start = 0
+    for section_cards in card_lists:
+        section = np.arange(start, start + len(section_cards))
+        ranked_lists.append(section[np.argsort(-scores[section], kind="stable")].tolist())
+        start += len(section_cards)
+    # Sections take turns: every section's best card, then every section's second best, ...
+    interleaved = np.array([position for turn in itertools.zip_longest(*ranked_lists) for position in turn
+                            if position is not None], dtype=np.int64)
+    return dedupe_flashcards([cards[position] for position in interleaved.tolist()], max_flashcards, terms=terms,
+                             words=words.reordered(interleaved))
+
+
+def generate_flashcards_map_reduce(generate_fn, source_text, max_flashcards=None, max_workers=4,
+                                   chunk_size=MAP_CHUNK_SIZE, on_progress=None, stream_fn=None, on_card=None):
+    """Generates flashcards for a document of any length.
+
+    generate_fn takes a prompt and returns the model's text. on_progress, if
+    given, is called as on_progress(done, total, cards_so_far) from the
+    calling thread whenever a section finishes. A single-section document is
+    streamed through stream_fn when given, calling on_card(card) as each card
+    completes. Returns (flashcards, malformed_pairs).
+    """
+    sections = chunk_text(source_text, chunk_size=chunk_size, overlap=0) if len(source_text) > chunk_size else [source_text]
+    if len(sections) == 1:
+        if stream_fn is not None:
+            flashcards_data, malformed = stream_flashcards(stream_fn, source_text, max_flashcards, on_card)
+        else:
+            flashcards_data, malformed = parse_flashcard_response(generate_fn(build_flashcard_prompt(source_text, max_flashcards)).strip())
+        flashcards_data = dedupe_flashcards(flashcards_data, terms=key_terms(source_text))
+        if on_progress:
+            on_progress(1, 1, flashcards_data)
+        return flashcards_data, malformed
+
+    per_section = max(3, math.ceil((max_flashcards or 5 * len(sections)) * 1.5 / len(sections)))
+    card_lists = [[] for _ in sections]
+    malformed = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(generate_fn, build_flashcard_prompt(section, per_section)): index
+            for index, section in enumerate(sections)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                cards, bad_pairs = parse_flashcard_response(future.result().strip())
+            except Exception as e:
+                # One failed section should not cost the cards from all the others
+                errors.append(e)
+                cards, bad_pairs = [], []
+            card_lists[futures[future]] = cards
+            malformed.extend(bad_pairs)
+            if on_progress:
+                on_progress(done, len(sections), [card for cards in card_lists for card in cards])
+    if len(errors) == len(sections):
+        raise errors[0]
+    return merge_flashcards(card_lists, max_flashcards, source_text), malformed
@@ -0,0 +1,130 @@
+"""Token-budgeted conversation history with a rolling summary.
+
+Recent turns are kept verbatim while they fit in the token budget. Older
+turns are folded into a running summary by a background model call, so the
+history sent with each chat turn stays roughly constant in size however
+long the session gets. Token counts are tracked as turns are added and
+evicted rather than recomputed every turn.
+"""
+import threading
+from collections import deque
+
+from llm import count_tokens
+
+SUMMARY_PROMPT_TEMPLATE = """
+    You are maintaining a running summary of a study conversation between a student and a tutor.
+    Update the summary with the new exchanges below. Keep the facts, questions and conclusions that
+    later questions might refer back to. Use at most {max_words} words and write plain prose.
+
+    Current summary:
+    {summary}
+
+    New exchanges:
+    {exchanges}
+
+    Updated summary:
+    """
+
+
+class _Turn:
+    __slots__ = ("role", "parts", "tokens")
+
+    def __init__(self, role, parts, tokens):
+        self.role = role
+        self.parts = parts
+        self.tokens = tokens
+
+    def text(self):
+        return " ".join(part["text"] for part in self.parts if "text" in part)
+
+
+class ConversationHistory:
+    """Recent turns within a token budget plus a summary of everything older.
+
+    submit schedules the summary call, like an executor's submit (e.g.
+    FlashMindService.submit bound to a session); without it summaries are
+    written inline.
+    """
+
+    def __init__(self, summarize_fn=None, submit=None, token_budget=4000, summary_words=250):
+        self.summarize_fn = summarize_fn
+        self.submit = submit
+        self.token_budget = token_budget
+        self.summary_words = summary_words
+        self.summary = ""
+        self.window_tokens = 0
+        self._window = deque()
+        self._evicted = []  # turns dropped from the window but not yet in the summary
+        self._pending = None  # (future, turns being summarized)
+        self._lock = threading.Lock()
+
+    def append(self, role, parts):
+        """Adds a turn ("user" or "model") and evicts the oldest turns beyond the budget."""
+        turn = _Turn(role, parts, sum(count_tokens(part["text"]) for part in parts if "text" in part))
+        self._window.append(turn)
+        self.window_tokens += turn.tokens
+        # Keep at least the latest exchange, and always start the window on a user turn
+        while self.window_tokens > self.token_budget and len(self._window) > 2:
+            self._evict_oldest()
+        while self._window and self._window[0].role != "user":
+            self._evict_oldest()
+        self._start_summary()
+
+    def _evict_oldest(self):
+        turn = self._window.popleft()
+        self.window_tokens -= turn.tokens
+        self._evicted.append(turn)
+
+    def _start_summary(self):
+        """Folds evicted turns into the summary in the background, one batch at a time."""
+        with self._lock:
+            if self._pending is not None and self._pending[0].done():
+                self._finish_summary()
+            if self._pending is not None or not self._evicted or self.summarize_fn is None:
+                return
+            turns, self._evicted = self._evicted, []
+            exchanges = "\n".join(f"{'Student' if turn.role == 'user' else 'Tutor'}: {turn.text()}" for turn in turns)
+            prompt = SUMMARY_PROMPT_TEMPLATE.format(max_words=self.summary_words, summary=self.summary or "(none yet)", exchanges=exchanges)
+            if self.submit is None:
+                self.summary = self.summarize_fn(prompt).strip()
+                return
+            try:
+                self._pending = (self.submit(self.summarize_fn, prompt), turns)
+            except Exception:
+                # Turned away (e.g. the session has too many jobs queued); retried on the next turn
+                self._evicted = turns + self._evicted
+
+    def _finish_summary(self):
+        future, turns = self._pending
+        self._pending = None
+        try:
+            self.summary = future.result().strip()
+        except Exception:
+            # Keep the turns so the next attempt can summarize them
+            self._evicted = turns + self._evicted
+
+    def contents(self):
+        """Returns the history as Gemini contents: summary first, then unsummarized and recent turns."""
+        self._start_summary()
+        with self._lock:
+            unsummarized = list(self._evicted)
+            if self._pending is not None:
+                unsummarized = self._pending[1] + unsummarized
+            summary = self.summary
+        contents = []
+        if summary:
+            contents.append({"role": "user", "parts": [{"text": f"Summary of our conversation so far:\n{summary}"}]})
+            contents.append({"role": "model", "parts": [{"text": "Thanks, I'll keep that in mind."}]})
+        # Turns still being summarized are sent verbatim so nothing is lost in the meantime
+        for turn in unsummarized + list(self._window):
+            contents.append({"role": turn.role, "parts": turn.parts})
+        return contents
+
+    @property
+    def prompt_tokens(self):
+        """Approximate tokens the history adds to a request."""
+        with self._lock:
+            unsummarized = sum(turn.tokens for turn in self._evicted)
+            if self._pending is not None:
+                unsummarized += sum(turn.tokens for turn in self._pending[1])
+        return count_tokens(self.summary) + unsummarized + self.window_tokens
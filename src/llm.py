@@ -0,0 +1,233 @@
+"""Language model backends.
+
+Every model call in the app goes through an LLMBackend, so the Gemini
+client can be swapped for the deterministic FakeBackend when load testing,
+benchmarking or developing without an API key.
+
+Prompts are either a string or a list of Gemini-style contents
+({"role": ..., "parts": [{"text": ...}]}). Passing json_schema asks for
+structured output: the response is JSON matching the schema (Gemini's
+response schema, written with Gemini's uppercase type names).
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+
+def count_tokens(text):
+    """Cheap token estimate (about four characters per token) used for budgeting and metrics."""
+    return (len(text) + 3) // 4
+
+
+def prompt_text(prompt):
+    """Flattens a string or a list of contents into plain text."""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(
+        part["text"] for content in prompt for part in content.get("parts", []) if isinstance(part, dict) and "text" in part
+    )
+
+
+class LLMBackend:
+    """Interface for text generation backends.
+
+    Subclasses implement generate() and stream(); the async variants default
+    to running the sync ones on a worker thread.
+    """
+
+    name = "base"
+
+    def generate(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        """Returns the complete response text."""
+        raise NotImplementedError
+
+    def stream(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        """Yields the response text in chunks as it is produced."""
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, **options):
+        return await asyncio.to_thread(self.generate, prompt, **options)
+
+    async def astream(self, prompt, **options):
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        done = object()
+
+        def pump():
+            try:
+                for chunk in self.stream(prompt, **options):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        threading.Thread(target=pump, daemon=True).start()
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+# --- Gemini ---
+class GeminiBackend(LLMBackend):
+    """Backend for a google.generativeai GenerativeModel."""
+
+    name = "gemini"
+
+    def __init__(self, model):
+        self.model = model
+
+    @staticmethod
+    def _generation_config(temperature, max_output_tokens, json_schema=None):
+        import google.generativeai as genai
+
+        options = {}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if max_output_tokens is not None:
+            options["max_output_tokens"] = max_output_tokens
+        if json_schema is not None:
+            options["response_mime_type"] = "application/json"
+            options["response_schema"] = json_schema
+        return genai.types.GenerationConfig(**options) if options else None
+
+    def generate(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        config = self._generation_config(temperature, max_output_tokens, json_schema)
+        return self.model.generate_content(prompt, generation_config=config).text
+
+    def stream(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        config = self._generation_config(temperature, max_output_tokens, json_schema)
+        for chunk in self.model.generate_content(prompt, stream=True, generation_config=config):
+            if chunk.text:
+                yield chunk.text
+
+    async def agenerate(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        config = self._generation_config(temperature, max_output_tokens, json_schema)
+        response = await self.model.generate_content_async(prompt, generation_config=config)
+        return response.text
+
+
+# --- Local fake ---
+class FakeLLMError(Exception):
+    """Injected failure; code mirrors the HTTP status a real API would return."""
+
+    def __init__(self, message, code=503):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline backend with configurable latency, token rate and failures.
+
+    Responses are derived from the prompt: flashcard prompts get "Q: ... A: ..."
+    pairs (or a JSON array of cards when a json_schema is passed) built from
+    the source text, title prompts get a title from its most
+    frequent words, and anything else gets an answer quoting the prompt.
+    The same prompt always produces the same text.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_seconds=0.0, tokens_per_second=None, failure_rate=0.0,
+                 failure_code=503, seed=0, chunk_tokens=8):
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.chunk_tokens = chunk_tokens
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+        if failed:
+            message = "429 Resource has been exhausted" if self.failure_code == 429 else f"{self.failure_code} Service unavailable"
+            raise FakeLLMError(message, code=self.failure_code)
+
+    def _respond(self, prompt, max_output_tokens, json_schema=None):
+        text = prompt_text(prompt)
+        source = text.split("---")[-2] if text.count("---") >= 2 else text
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", source) if len(s.split()) >= 4]
+        if "Subject Title" in text:
+            words = re.findall(r"[A-Za-z]{5,}", source)
+            counts = {}
+            for word in words:
+                counts[word.lower()] = counts.get(word.lower(), 0) + 1
+            top = sorted(counts, key=lambda w: (-counts[w], w))[:3]
+            response = " ".join(word.capitalize() for word in top) or "General Notes"
+        elif text.startswith("Transcribe all the text"):
+            images = [] if isinstance(prompt, str) else [
+                part["inline_data"]["data"] for content in prompt for part in content["parts"] if "inline_data" in part
+            ]
+            digest = hashlib.sha1(b"".join(images)).hexdigest()[:8]
+            response = f"Transcribed text of scanned page {digest}. The page covers the material shown in the scan."
+        elif "flashcards" in text.lower() and ("Q:" in text or '"question"' in text or json_schema is not None):
+            limit = re.search(r"maximum of (\d+) flashcards", text)
+            count = int(limit.group(1)) if limit else 10
+            cards = []
+            for index, sentence in enumerate(sentences[:count]):
+                words = sentence.split()
+                cards.append((f"What does point {index + 1} say about {' '.join(words[:3])}?", sentence))
+            if json_schema is not None or "Q:" not in text:
+                response = json.dumps([{"question": q, "answer": a} for q, a in cards], indent=1)
+            else:
+                response = "\n".join(f"Q: {q} A: {a}" for q, a in cards)
+        else:
+            # Chat turns: answer the latest message
+            question = text if isinstance(prompt, str) else prompt_text(prompt[-1:])
+            digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+            quoted = question[:200]
+            response = f"Here is what the document says ({digest}): {quoted}"
+        if max_output_tokens:
+            response = response[: max_output_tokens * 4]
+        return response
+
+    def _pace(self, token_count):
+        if self.tokens_per_second:
+            time.sleep(token_count / self.tokens_per_second)
+
+    def generate(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        response = self._respond(prompt, max_output_tokens, json_schema)
+        self._pace(count_tokens(response))
+        return response
+
+    def stream(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        response = self._respond(prompt, max_output_tokens, json_schema)
+        step = self.chunk_tokens * 4
+        for start in range(0, len(response), step):
+            chunk = response[start:start + step]
+            self._pace(count_tokens(chunk))
+            yield chunk
+
+    async def agenerate(self, prompt, temperature=None, max_output_tokens=None, json_schema=None):
+        await asyncio.sleep(self.latency_seconds)
+        self._maybe_fail()
+        response = self._respond(prompt, max_output_tokens, json_schema)
+        if self.tokens_per_second:
+            await asyncio.sleep(count_tokens(response) / self.tokens_per_second)
+        return response
+
+
+def fake_backend_from_settings(get_setting):
+    """Builds a FakeBackend from FAKE_LLM_* settings looked up with get_setting(name)."""
+    return FakeBackend(
+        latency_seconds=float(get_setting("FAKE_LLM_LATENCY_SECONDS") or 0.05),
+        tokens_per_second=float(get_setting("FAKE_LLM_TOKENS_PER_SECOND") or 0) or None,
+        failure_rate=float(get_setting("FAKE_LLM_FAILURE_RATE") or 0),
+        failure_code=int(get_setting("FAKE_LLM_FAILURE_CODE") or 503),
+    )
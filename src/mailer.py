@@ -0,0 +1,271 @@
+"""Background delivery of flashcard emails.
+
+Submitting the email form only inserts a row into a persistent SQLite
+outbox. A worker thread drains the outbox, batches queued messages that
+share the same content into one request with a personalization per
+recipient, and retries failures with exponential backoff. Messages
+survive restarts and failures are recorded instead of lost.
+
+Transports: SendGridTransport (one kept-alive HTTPS connection), SMTPTransport (e.g. a
+local debugging SMTP server) and FileTransport (writes each request to a
+directory), the last two being stand-ins for development and tests.
+"""
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from email.message import EmailMessage
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class MailError(Exception):
+    """Raised by a transport when a send is rejected."""
+
+
+# --- Transports ---
+class SendGridTransport:
+    """Sends batches to the SendGrid v3 API over one HTTPS connection kept alive between sends.
+
+    SendGridAPIClient opens a new connection (and TLS handshake) per request,
+    so only its message helpers are used. The outbox worker is the only
+    caller, so the connection is never shared between threads.
+    """
+
+    API_HOST = "api.sendgrid.com"
+    SEND_PATH = "/v3/mail/send"
+
+    def __init__(self, api_key, sender_email, timeout=30):
+        self.api_key = api_key
+        self.sender_email = sender_email
+        self.timeout = timeout
+        self._connection = None
+
+    def _post(self, body):
+        """POSTs a JSON body and returns (status, response body), reconnecting once if the idle connection was closed."""
+        payload = json.dumps(body).encode("utf-8")
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPSConnection(self.API_HOST, timeout=self.timeout)
+            try:
+                self._connection.request("POST", self.SEND_PATH, payload, headers)
+                response = self._connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError):
+                # The server dropped the kept-alive connection before reading the request
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise
+            except Exception:
+                self._connection.close()
+                self._connection = None
+                raise
+
+    def send(self, recipients, subject, html, text, attachments=()):
+        from sendgrid.helpers.mail import Attachment, Content, Email, Mail, Personalization, To
+
+        message = Mail()
+        message.from_email = Email(self.sender_email)
+        message.subject = subject
+        # One personalization per recipient so nobody sees the other addresses
+        for recipient in recipients:
+            personalization = Personalization()
+            personalization.add_to(To(recipient))
+            message.add_personalization(personalization)
+        if text:
+            message.add_content(Content("text/plain", text))
+        message.add_content(Content("text/html", html))
+        for attachment in attachments:
+            message.add_attachment(Attachment(
+                file_content=attachment["content_base64"],
+                file_name=attachment["filename"],
+                file_type=attachment["mime_type"],
+                disposition="attachment",
+            ))
+        status, body = self._post(message.get())
+        if status != 202:
+            raise MailError(f"SendGrid returned {status}: {body.decode('utf-8', 'replace')}")
+
+
+class SMTPTransport:
+    """Sends through an SMTP server, e.g. `python -m aiosmtpd -n -l localhost:8025` for local testing."""
+
+    def __init__(self, host="localhost", port=8025, sender_email="flashmind@localhost"):
+        self.host = host
+        self.port = port
+        self.sender_email = sender_email
+
+    def send(self, recipients, subject, html, text, attachments=()):
+        import base64
+
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            for recipient in recipients:
+                message = EmailMessage()
+                message["From"] = self.sender_email
+                message["To"] = recipient
+                message["Subject"] = subject
+                message.set_content(text or "")
+                message.add_alternative(html, subtype="html")
+                for attachment in attachments:
+                    maintype, subtype = attachment["mime_type"].split("/", 1)
+                    message.add_attachment(base64.b64decode(attachment["content_base64"]), maintype=maintype,
+                                           subtype=subtype, filename=attachment["filename"])
+                smtp.send_message(message)
+
+
+class FileTransport:
+    """Writes every request as a JSON file into a directory instead of sending it."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, recipients, subject, html, text, attachments=()):
+        request = {"recipients": recipients, "subject": subject, "html": html, "text": text,
+                   "attachments": [attachment["filename"] for attachment in attachments]}
+        file_name = f"{time.time():.6f}-{hashlib.sha1(html.encode('utf-8')).hexdigest()[:8]}.json"
+        with open(os.path.join(self.directory, file_name), "w") as f:
+            json.dump(request, f)
+
+
+# --- Outbox ---
+class MailQueue:
+    """Persistent outbox drained by a background worker thread."""
+
+    def __init__(self, path, transport, batch_size=50, max_attempts=5, base_delay_seconds=5.0, poll_seconds=5.0,
+                 max_error_delay_seconds=300.0):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.poll_seconds = poll_seconds
+        self.max_error_delay_seconds = max_error_delay_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                content_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)")
+        self._conn.commit()
+        self._worker = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+        self._worker.start()
+
+    def enqueue(self, recipient, subject, html, text="", attachments=()):
+        """Queues one email and returns its id immediately."""
+        payload = json.dumps({"subject": subject, "html": html, "text": text, "attachments": list(attachments)})
+        content_key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (recipient, content_key, payload, status, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                (recipient, content_key, payload, PENDING, time.time()),
+            )
+            self._conn.commit()
+        self._wake.set()
+        return cursor.lastrowid
+
+    def status(self, job_id):
+        """Returns (status, last_error) for a queued email, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT status, last_error FROM outbox WHERE id = ?", (job_id,)).fetchone()
+        return row
+
+    def _due_batches(self):
+        """Groups due emails by identical content, so each group is one request."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, recipient, content_key, payload, attempts FROM outbox WHERE status = ? AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (PENDING, time.time(), self.batch_size * 10),
+            ).fetchall()
+        batches = {}
+        for job_id, recipient, content_key, payload, attempts in rows:
+            batch = batches.setdefault(content_key, {"payload": payload, "jobs": []})
+            if len(batch["jobs"]) < self.batch_size:
+                batch["jobs"].append((job_id, recipient, attempts))
+        return batches.values()
+
+    def _run(self):
+        errors = 0
+        while True:
+            try:
+                sent_any = False
+                for batch in self._due_batches():
+                    sent_any = True
+                    self._deliver(batch)
+                errors = 0
+            except Exception:
+                # A database error must not stop delivery for the rest of the process
+                errors += 1
+                delay = min(self.max_error_delay_seconds, self.base_delay_seconds * 2 ** errors)
+                logger.exception("Mail outbox worker failed; retrying in %.0fs", delay)
+                time.sleep(delay)
+                continue
+            if not sent_any:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _deliver(self, batch):
+        try:
+            message = json.loads(batch["payload"])
+            message["subject"], message["html"], message["text"], message["attachments"]
+        except (ValueError, KeyError, TypeError) as e:
+            # A payload that cannot be read never will be; fail it instead of retrying forever
+            logger.error("Dropping malformed outbox payload for jobs %s: %s", [job[0] for job in batch["jobs"]], e)
+            with self._lock:
+                self._conn.executemany(
+                    "UPDATE outbox SET status = ?, last_error = ? WHERE id = ?",
+                    [(FAILED, f"malformed payload: {e}", job_id) for job_id, _, _ in batch["jobs"]],
+                )
+                self._conn.commit()
+            return
+        recipients = sorted({recipient for _, recipient, _ in batch["jobs"]})
+        try:
+            with tracing.span("email.send", transport=type(self.transport).__name__, recipients=len(recipients)):
+                self.transport.send(recipients, message["subject"], message["html"], message["text"], message["attachments"])
+        except Exception as e:
+            with self._lock:
+                for job_id, _, attempts in batch["jobs"]:
+                    attempts += 1
+                    delay = random.uniform(0.5, 1.0) * self.base_delay_seconds * 2 ** attempts
+                    status = FAILED if attempts >= self.max_attempts else PENDING
+                    self._conn.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                        (status, attempts, time.time() + delay, str(e), job_id),
+                    )
+                self._conn.commit()
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = NULL WHERE id = ?",
+                [(SENT, job_id) for job_id, _, _ in batch["jobs"]],
+            )
+            self._conn.commit()
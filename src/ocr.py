@@ -0,0 +1,233 @@
+"""Text recognition for scanned PDF pages.
+
+PyPDF2 finds no text on a scanned page, so those pages used to come
+through empty. OCRPipeline sits after iter_pdf_pages: pages with (almost)
+no text are handed to an engine along with the page's images, and the
+recognised text takes their place. Pages are still yielded in order, with
+a bounded number of pages being recognised at once.
+
+Two engines are available. TesseractEngine runs local OCR (pytesseract
+and the tesseract binary) on a process pool. ModelEngine sends the page
+images to the model as multimodal parts and asks for a transcription,
+with its own limit on concurrent calls on top of the shared scheduler.
+
+Scans usually store each page as one embedded image, which is used as is.
+Pages without one are rendered with pypdfium2 when it is installed.
+Results are cached by a hash of the page images, so uploading the same
+scan again, even inside a different PDF, never recognises a page twice.
+Pages that come back without text are not cached, so a transient bad
+result (or a model that replied with nothing) is retried on the next upload.
+"""
+import hashlib
+import io
+import mimetypes
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PyPDF2 import PdfReader
+
+import tracing
+
+# Pages with fewer extracted characters than this are treated as scanned
+MIN_TEXT_CHARS = 16
+RENDER_SCALE = 2.0
+MODEL_IMAGE_TYPES = ("image/png", "image/jpeg", "image/webp")
+OCR_PROMPT = (
+    "Transcribe all the text on this scanned document page exactly as written, in reading order. "
+    "Keep headings and list items on their own lines. Reply with the text only, without commentary; "
+    "reply with nothing if the page has no text."
+)
+
+
+def tesseract_available():
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def images_hash(images):
+    digest = hashlib.sha256()
+    for _, data in images:
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+# --- Page images ---
+def page_images(page):
+    """Returns [(name, bytes)] of the images embedded in a PDF page."""
+    try:
+        return [(image.name, image.data) for image in page.images]
+    except Exception:
+        # Unsupported image filters or a missing Pillow: fall back to rendering
+        return []
+
+
+def _render_page(file_bytes, number):
+    """Renders a page to PNG with pypdfium2, or returns [] when it is not installed."""
+    try:
+        import pypdfium2
+    except ImportError:
+        return []
+    document = pypdfium2.PdfDocument(file_bytes)
+    try:
+        image = document[number].render(scale=RENDER_SCALE).to_pil()
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return [(f"page{number + 1}.png", buffer.getvalue())]
+    finally:
+        document.close()
+
+
+# --- Engines ---
+def _tesseract_images(images, language):
+    """Worker entry point: OCRs the images of one page."""
+    import pytesseract
+    from PIL import Image
+
+    return "\n".join(pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang=language) for _, data in images)
+
+
+class TesseractEngine:
+    """Local OCR; pages run on the given executor (ideally a ProcessPoolExecutor)."""
+
+    name = "tesseract"
+
+    def __init__(self, executor=None, language="eng", max_workers=4):
+        self.language = language
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr")
+
+    def submit(self, images, tenant=None):
+        return self._executor.submit(_tesseract_images, images, self.language)
+
+
+def _model_part(name, data):
+    """An inline image part in a type the model accepts, converting other formats to PNG."""
+    mime_type = mimetypes.guess_type(name)[0]
+    if mime_type not in MODEL_IMAGE_TYPES:
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.open(io.BytesIO(data)).save(buffer, format="PNG")
+        mime_type, data = "image/png", buffer.getvalue()
+    return {"inline_data": {"mime_type": mime_type, "data": data}}
+
+
+def ocr_prompt(images):
+    return [{"role": "user", "parts": [{"text": OCR_PROMPT}] + [_model_part(name, data) for name, data in images]}]
+
+
+class ModelEngine:
+    """Transcribes page images with a multimodal model, at most max_concurrency pages at a time.
+
+    With a scheduled backend, pages submitted for a tenant wait in that tenant's queue.
+    """
+
+    name = "model"
+
+    def __init__(self, backend, max_concurrency=4):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ocr")
+
+    def submit(self, images, tenant=None):
+        backend = self.backend.for_tenant(tenant) if tenant is not None else self.backend
+        return self._executor.submit(lambda: backend.generate(ocr_prompt(images), temperature=0))
+
+
+# --- Pipeline ---
+class OCRStats:
+    __slots__ = ("recognised", "cached", "empty", "failed", "no_images")
+
+    def __init__(self):
+        self.recognised = 0  # pages OCR found text on, including those from the cache
+        self.cached = 0
+        self.empty = 0  # pages OCR found no text on
+        self.failed = 0
+        self.no_images = 0
+
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class OCRPipeline:
+    """Fills in the text of scanned pages in a stream of PDF pages."""
+
+    def __init__(self, engine, cache=None, max_pending=8, min_text_chars=MIN_TEXT_CHARS):
+        self.engine = engine
+        self.cache = cache
+        self.max_pending = max_pending
+        self.min_text_chars = min_text_chars
+
+    def _cache_key(self, images):
+        return f"ocr:{self.engine.name}:{images_hash(images)}"
+
+    def _recognise(self, images, stats, tenant):
+        key = self._cache_key(images)
+        cached = self.cache.get(key) if self.cache is not None else None
+        # Blank results were cached by earlier versions; recognise those pages again
+        if cached is not None and cached.strip():
+            stats.cached += 1
+            tracing.count("cache.ocr.hit")
+            return _resolved(cached)
+        tracing.count("cache.ocr.miss")
+        started = time.perf_counter()
+        future = self.engine.submit(images, tenant)
+        future.add_done_callback(lambda done: tracing.record(f"ocr.{self.engine.name}", time.perf_counter() - started,
+                                                             images=len(images)))
+
+        def remember(done):
+            if done.exception() is None and self.cache is not None:
+                text = done.result().strip()
+                if text:
+                    self.cache.set(key, text + "\n")
+
+        future.add_done_callback(remember)
+        return future
+
+    def page_texts(self, file_bytes, pages, stats=None, tenant=None):
+        """Yields pages in order, with recognised text in place of pages that had none.
+
+        A page whose recognition fails keeps its (empty) extracted text. tenant
+        is the session whose queue model OCR calls wait in.
+        """
+        stats = stats if stats is not None else OCRStats()
+        reader = None
+        pending = deque()
+        for number, text in enumerate(pages):
+            if len(text.strip()) >= self.min_text_chars:
+                pending.append((text, None))
+            else:
+                if reader is None:
+                    reader = PdfReader(io.BytesIO(file_bytes))
+                images = page_images(reader.pages[number]) or _render_page(file_bytes, number)
+                if images:
+                    pending.append((text, self._recognise(images, stats, tenant)))
+                else:
+                    stats.no_images += 1
+                    pending.append((text, None))
+            # Yield what is ready; block on the oldest page only once max_pending are in flight
+            while pending and (pending[0][1] is None or pending[0][1].done() or len(pending) > self.max_pending):
+                yield self._result(*pending.popleft(), stats)
+        while pending:
+            yield self._result(*pending.popleft(), stats)
+
+    def _result(self, text, future, stats):
+        if future is None:
+            return text
+        try:
+            recognised = future.result().strip()
+        except Exception:
+            stats.failed += 1
+            return text
+        if not recognised:
+            stats.empty += 1
+            return text
+        stats.recognised += 1
+        return recognised + "\n"
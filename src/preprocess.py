@@ -0,0 +1,155 @@
+"""Cleanup of extracted text before it is chunked and sent to the model.
+
+PDF text arrives with running headers and footers, page numbers, words
+hyphenated across line breaks and runs of whitespace, all of which cost
+prompt tokens on every turn. PageCleaner removes lines that repeat at the
+top or bottom of many pages, drops page-number lines, rejoins hyphenated
+words and collapses whitespace. It works page by page in a single pass:
+line statistics are gathered from the first few pages (which are held
+back until then) and keep updating as later pages stream in.
+
+A number on the first or last lines of a page is only taken for a page
+number when another page has one of the same form that continues the
+same sequence, so a lone number that belongs to the text stays. A
+hyphen at a line break is only removed when the joined word occurs
+elsewhere in the document ("regu-/lation"); otherwise it is kept
+("well-/known" becomes "well-known").
+"""
+import re
+from collections import Counter
+
+from llm import count_tokens
+
+PAGE_NUMBER = re.compile(r"^(?:page\s*)?[-–(\[]?\s*\d{1,4}\s*[-–)\]]?(?:\s*(?:of|/)\s*\d{1,4})?$", re.IGNORECASE)
+HYPHENATED_BREAK = re.compile(r"\b(\w+)-\n[ \t]*([a-z]\w*)")
+SPACE_RUNS = re.compile(r"[ \t \f\v]+")
+LINE_EDGE_SPACES = re.compile(r" ?\n ?")
+BLANK_LINE_RUNS = re.compile(r"\n{3,}")
+DIGIT_RUNS = re.compile(r"\d+")
+WORDS = re.compile(r"\w+")
+
+
+def normalize_text(text, vocabulary=None):
+    """Rejoins hyphenated line breaks and collapses whitespace.
+
+    With a vocabulary (a set of lowercase words), a hyphenated break is only
+    joined into one word when that word is in it; otherwise the hyphen stays.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if vocabulary is None:
+        text = HYPHENATED_BREAK.sub(r"\1\2", text)
+    else:
+        text = HYPHENATED_BREAK.sub(
+            lambda match: match[1] + match[2] if (match[1] + match[2]).lower() in vocabulary else f"{match[1]}-{match[2]}",
+            text)
+    text = SPACE_RUNS.sub(" ", text)
+    text = LINE_EDGE_SPACES.sub("\n", text)
+    return BLANK_LINE_RUNS.sub("\n\n", text)
+
+
+def _line_key(line):
+    """Lines that differ only in numbers (e.g. "Chapter 3 - page 12") count as the same line."""
+    return DIGIT_RUNS.sub("#", " ".join(line.lower().split()))
+
+
+def _page_number(line):
+    """(line key, number) of a line that looks like a page number, else None."""
+    line = line.strip()
+    if not PAGE_NUMBER.match(line):
+        return None
+    return _line_key(line), int(DIGIT_RUNS.search(line)[0])
+
+
+class PreprocessStats:
+    __slots__ = ("pages", "raw_tokens", "clean_tokens", "removed_lines")
+
+    def __init__(self):
+        self.pages = 0
+        self.raw_tokens = 0
+        self.clean_tokens = 0
+        self.removed_lines = 0
+
+    @property
+    def saved_fraction(self):
+        return 1 - self.clean_tokens / self.raw_tokens if self.raw_tokens else 0.0
+
+
+class PageCleaner:
+    """Removes repeated headers/footers and page numbers from a stream of pages and normalizes them."""
+
+    def __init__(self, edge_lines=3, min_share=0.5, warmup_pages=8, detect_boilerplate=True):
+        self.edge_lines = edge_lines
+        self.min_share = min_share
+        self.warmup_pages = warmup_pages
+        self.detect_boilerplate = detect_boilerplate
+        self.stats = PreprocessStats()
+        self._edge_counts = Counter()
+        self._sequence_counts = Counter()  # (line key, number - page index) of page-number-like edge lines
+        self._vocabulary = set()
+        self._pages_seen = 0
+
+    def _edge_indexes(self, lines):
+        """Indexes of the first and last few non-empty lines of a page."""
+        filled = [index for index, line in enumerate(lines) if line.strip()]
+        return set(filled[:self.edge_lines] + filled[-self.edge_lines:])
+
+    def _observe(self, lines, text):
+        """Adds a page to the statistics and returns its index."""
+        page_index = self._pages_seen
+        self._pages_seen += 1
+        edges = self._edge_indexes(lines)
+        self._edge_counts.update({_line_key(lines[index]) for index in edges})
+        numbers = (_page_number(lines[index]) for index in edges)
+        self._sequence_counts.update({(key, number - page_index) for key, number in filter(None, numbers)})
+        self._vocabulary.update(WORDS.findall(text.lower()))
+        return page_index
+
+    def _in_page_sequence(self, line, page_index):
+        """True for a page-number-like line whose number continues a sequence seen on another page."""
+        number = _page_number(line)
+        if number is None or page_index is None:
+            return False
+        key, value = number
+        return self._sequence_counts[key, value - page_index] >= 2
+
+    def _is_repeated(self, key):
+        return self._pages_seen >= 3 and self._edge_counts[key] >= max(2, self.min_share * self._pages_seen)
+
+    def _clean(self, text, lines, page_index=None):
+        self.stats.pages += 1
+        self.stats.raw_tokens += count_tokens(text)
+        if self.detect_boilerplate:
+            # Page-number-like lines go only as part of a sequence, never just for repeating
+            drop = {
+                index for index in self._edge_indexes(lines)
+                if self._in_page_sequence(lines[index], page_index)
+                or (not PAGE_NUMBER.match(lines[index].strip()) and self._is_repeated(_line_key(lines[index])))
+            }
+            if drop:
+                self.stats.removed_lines += len(drop)
+                text = "\n".join(line for index, line in enumerate(lines) if index not in drop)
+        vocabulary = self._vocabulary if self._pages_seen else set(WORDS.findall(text.lower()))
+        cleaned = normalize_text(text, vocabulary).strip("\n")
+        cleaned = cleaned + "\n" if cleaned else ""
+        self.stats.clean_tokens += count_tokens(cleaned)
+        return cleaned
+
+    def clean_pages(self, pages):
+        """Yields cleaned pages in order; the first warmup_pages are released together."""
+        held = []
+        for text in pages:
+            lines = text.split("\n")
+            page_index = self._observe(lines, text)
+            if self.detect_boilerplate and self._pages_seen <= self.warmup_pages:
+                held.append((text, lines, page_index))
+                continue
+            for held_page in held:
+                yield self._clean(*held_page)
+            held = []
+            yield self._clean(text, lines, page_index)
+        for held_page in held:
+            yield self._clean(*held_page)
+
+    def clean_text(self, text):
+        """Normalizes a text with no page structure (pasted text, DOCX, TXT)."""
+        return self._clean(text, text.split("\n"))
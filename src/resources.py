@@ -0,0 +1,138 @@
+"""Process-wide loaders for static resources.
+
+Files are read and encoded once per process and shared by every session.
+Each loader is keyed on the file's modification time and size, so editing
+a file on disk invalidates its cached entry on the next rerun.
+"""
+import base64
+import hashlib
+import io
+import os
+
+import google.generativeai as genai
+import streamlit as st
+from PIL import Image, features
+
+BACKGROUND_IMAGE_PATHS = [f"images/image{number}.jpg" for number in range(1, 7)]
+
+# Backgrounds are downscaled to this width and recompressed before encoding
+BACKGROUND_MAX_WIDTH = 1920
+BACKGROUND_JPEG_QUALITY = 80
+
+# Responsive variants served through Streamlit static file serving (see .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL_PREFIX = "app/static"
+BACKGROUND_VARIANT_DIR = "backgrounds"
+BACKGROUND_VARIANT_WIDTHS = (768, 1280, 1920)
+
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".gif": "image/gif"}
+
+
+def file_signature(path):
+    """Returns (mtime_ns, size) for a file; used as part of every cache key."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _encode_image(path, signature, max_width=BACKGROUND_MAX_WIDTH):
+    """Reads, optionally downscales, and base64-encodes an image as a data URI."""
+    mime_type = MIME_TYPES.get(os.path.splitext(path)[1].lower(), "image/jpeg")
+    with open(path, "rb") as img_file:
+        raw = img_file.read()
+    if mime_type == "image/jpeg" and max_width:
+        with Image.open(io.BytesIO(raw)) as image:
+            if image.width > max_width:
+                image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=BACKGROUND_JPEG_QUALITY, optimize=True, progressive=True)
+        # Keep the original if recompressing did not make it smaller
+        if buffer.tell() < len(raw):
+            raw = buffer.getvalue()
+    return f"data:{mime_type};base64,{base64.b64encode(raw).decode()}"
+
+
+def encoded_image(path):
+    """Returns the cached data URI for an image, re-encoding only if the file changed."""
+    return _encode_image(path, file_signature(path))
+
+
+def preload_backgrounds():
+    """Encodes every background image up front so the first rerun of each session is cheap."""
+    for path in BACKGROUND_IMAGE_PATHS:
+        if os.path.exists(path):
+            encoded_image(path)
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _build_background_variants(path, signature, widths=BACKGROUND_VARIANT_WIDTHS):
+    """Writes resized AVIF/WebP/JPEG copies of an image into the static folder.
+
+    Returns {width: {format: url}}. File names embed a digest of the image's
+    bytes and the encoder settings, so a changed image or setting always gets
+    new URLs and a browser never keeps showing an old variant. Streamlit's
+    static route only sends "Cache-Control: public" (no max-age), so browsers
+    still revalidate; the versioned names are what make it safe for a proxy
+    in front of the app to cache app/static/backgrounds/ for a long time.
+    """
+    formats = [("webp", "WEBP", {"quality": 78, "method": 4}), ("jpg", "JPEG", {"quality": BACKGROUND_JPEG_QUALITY, "optimize": True, "progressive": True})]
+    if features.check("avif"):
+        formats.insert(0, ("avif", "AVIF", {"quality": 60}))
+
+    with open(path, "rb") as f:
+        content_digest = hashlib.sha1(f.read())
+    content_digest.update(repr((formats, widths)).encode())
+    digest = content_digest.hexdigest()[:10]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    output_dir = os.path.join(STATIC_DIR, BACKGROUND_VARIANT_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+
+    variants = {}
+    with Image.open(path) as source:
+        source = source.convert("RGB")
+        for width in widths:
+            target_width = min(width, source.width)
+            resized = source if target_width == source.width else source.resize(
+                (target_width, round(source.height * target_width / source.width)), Image.LANCZOS
+            )
+            variants[width] = {}
+            for extension, pil_format, options in formats:
+                file_name = f"{stem}-{digest}-{width}.{extension}"
+                file_path = os.path.join(output_dir, file_name)
+                if not os.path.exists(file_path):
+                    # Write to a temporary name first so concurrent sessions never see a partial file
+                    temp_path = f"{file_path}.{os.getpid()}.tmp"
+                    resized.save(temp_path, format=pil_format, **options)
+                    os.replace(temp_path, file_path)
+                variants[width][extension] = f"{STATIC_URL_PREFIX}/{BACKGROUND_VARIANT_DIR}/{file_name}"
+    return variants
+
+
+def background_variants(path):
+    """Returns the static URLs of an image's responsive variants, generating them on first use."""
+    return _build_background_variants(path, file_signature(path))
+
+
+def preload_background_variants():
+    """Generates the responsive variants of every background at startup."""
+    for path in BACKGROUND_IMAGE_PATHS:
+        if os.path.exists(path):
+            background_variants(path)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _read_text(path, signature):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def read_text(path):
+    """Returns the cached contents of a text file, re-reading only if the file changed."""
+    return _read_text(path, file_signature(path))
+
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_model(api_key, model_name):
+    """Configures the Gemini SDK and builds the model client once per process."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
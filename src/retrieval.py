@@ -0,0 +1,141 @@
+"""Local retrieval over document chunks.
+
+The document is split into overlapping chunks once, when it is processed,
+and indexed with BM25 over a pure-Python inverted index. Each chat turn
+then only sends the few passages that best match the question.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    """a an and are as at be but by for from has have he her his i if in into is it its
+    of on or she so that the their them then there these they this to was we were what
+    when where which who why will with you your""".split()
+)
+
+
+def tokenize(text):
+    """Lowercases text and returns its word tokens without stopwords."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, chunk_size=1200, overlap=200):
+    """Splits text into chunks of roughly chunk_size characters, breaking on paragraphs or sentences where possible."""
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            # Prefer a paragraph break, then a sentence end, in the back half of the window
+            window_floor = start + chunk_size // 2
+            paragraph = text.rfind("\n\n", window_floor, end)
+            sentence = text.rfind(". ", window_floor, end)
+            if paragraph != -1:
+                end = paragraph + 2
+            elif sentence != -1:
+                end = sentence + 2
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+# --- Lexical index ---
+class BM25Index:
+    """Okapi BM25 over an inverted index of chunk term frequencies."""
+
+    def __init__(self, chunks=(), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []
+        self.chunk_lengths = []
+        self.postings = defaultdict(list)  # term -> [(chunk_id, term_frequency)]
+        self.total_length = 0
+        for chunk in chunks:
+            self.add(chunk)
+
+    def add(self, chunk):
+        """Indexes one more chunk and returns its id."""
+        chunk_id = len(self.chunks)
+        terms = Counter(tokenize(chunk))
+        self.chunks.append(chunk)
+        length = sum(terms.values())
+        self.chunk_lengths.append(length)
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings[term].append((chunk_id, frequency))
+        return chunk_id
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, query):
+        """Returns a {chunk_id: score} mapping for chunks sharing terms with the query."""
+        count = len(self.chunks)
+        if not count:
+            return {}
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_id] / average_length)
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+
+# --- Optional embedding index ---
+class EmbeddingIndex:
+    """Cosine-similarity search over chunk embeddings produced by embed_fn.
+
+    embed_fn takes a list of strings and returns a list of vectors. NumPy is
+    only imported when this index is used.
+    """
+
+    def __init__(self, chunks, embed_fn):
+        import numpy as np
+
+        self._np = np
+        self.embed_fn = embed_fn
+        self.chunks = list(chunks)
+        vectors = np.asarray(embed_fn(self.chunks), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.maximum(norms, 1e-12)
+
+    def add(self, chunks):
+        """Embeds and appends more chunks."""
+        np = self._np
+        vectors = np.asarray(self.embed_fn(list(chunks)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = np.vstack([self.vectors, vectors / np.maximum(norms, 1e-12)])
+        self.chunks.extend(chunks)
+
+    def search(self, query, top_k=5):
+        np = self._np
+        query_vector = np.asarray(self.embed_fn([query])[0], dtype=np.float32)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+        similarities = self.vectors @ query_vector
+        top_k = min(top_k, len(self.chunks))
+        best = np.argpartition(-similarities, top_k - 1)[:top_k] if top_k else []
+        return sorted(((int(i), float(similarities[i])) for i in best), key=lambda item: item[1], reverse=True)
+
+
+def reciprocal_rank_fusion(rankings, top_k=5, k=60):
+    """Merges rankings (lists of chunk ids, best first) into the top_k ids by reciprocal rank fusion."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] += 1.0 / (k + rank)
+    return [chunk_id for chunk_id, _ in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]]
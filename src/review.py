@@ -0,0 +1,154 @@
+"""Spaced-repetition review scheduling (SM-2).
+
+Every flashcard a learner has seen gets a CardState (a __slots__ object, so
+100k cards stay small in memory). Due times live in a min-heap; reviewing a
+card pushes its new due time and leaves the old entry behind, which is
+skipped when it reaches the top. Both reviews and fetching the next due
+card are therefore O(log n). Changed cards are tracked so only they are
+written back to the store.
+"""
+import hashlib
+import heapq
+import itertools
+import time
+
+DAY_SECONDS = 86400
+# A card answered "again" comes back within the same study session
+AGAIN_DELAY_SECONDS = 600
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+# Answer buttons and the SM-2 quality (0-5) they stand for
+QUALITY_AGAIN = 1
+QUALITY_HARD = 3
+QUALITY_GOOD = 4
+QUALITY_EASY = 5
+
+
+def card_id(card):
+    """Stable id of a flashcard, so the same card generated twice shares its review history."""
+    text = card["question"].strip().lower() + "\x1f" + card["answer"].strip().lower()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class CardState:
+    __slots__ = ("card_id", "question", "answer", "ease", "interval", "repetitions", "lapses", "due", "last_review")
+
+    def __init__(self, card_id, question, answer, ease=DEFAULT_EASE, interval=0.0, repetitions=0, lapses=0,
+                 due=0.0, last_review=None):
+        self.card_id = card_id
+        self.question = question
+        self.answer = answer
+        self.ease = ease
+        self.interval = interval
+        self.repetitions = repetitions
+        self.lapses = lapses
+        self.due = due
+        self.last_review = last_review
+
+    def as_row(self):
+        return (self.card_id, self.question, self.answer, self.ease, self.interval, self.repetitions, self.lapses,
+                self.due, self.last_review)
+
+
+def sm2_update(state, quality, now):
+    """Applies one SM-2 review with quality 0-5 to a card state."""
+    if quality < 3:
+        state.repetitions = 0
+        state.lapses += 1
+        state.interval = 1.0
+        state.due = now + AGAIN_DELAY_SECONDS
+    else:
+        if state.repetitions == 0:
+            state.interval = 1.0
+        elif state.repetitions == 1:
+            state.interval = 6.0
+        else:
+            state.interval = round(state.interval * state.ease, 1)
+        state.repetitions += 1
+        state.due = now + state.interval * DAY_SECONDS
+    state.ease = max(MIN_EASE, state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    state.last_review = now
+
+
+class ReviewScheduler:
+    """Card states of one learner with a lazily cleaned due-queue."""
+
+    def __init__(self, rows=()):
+        self._cards = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self.dirty = set()
+        for row in rows:
+            state = CardState(*row)
+            self._cards[state.card_id] = state
+            self._heap.append((state.due, next(self._sequence), state.card_id))
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._cards)
+
+    def get(self, card_id):
+        return self._cards.get(card_id)
+
+    def add_cards(self, cards, now=None):
+        """Adds new flashcards, due immediately; cards already known keep their history. Returns how many were new."""
+        now = time.time() if now is None else now
+        added = 0
+        for card in cards:
+            key = card_id(card)
+            if key in self._cards:
+                continue
+            state = CardState(key, card["question"], card["answer"], due=now)
+            self._cards[key] = state
+            heapq.heappush(self._heap, (state.due, next(self._sequence), key))
+            self.dirty.add(key)
+            added += 1
+        return added
+
+    def _clean_top(self):
+        """Drops heap entries superseded by a later review."""
+        heap = self._heap
+        while heap:
+            due, _, key = heap[0]
+            state = self._cards.get(key)
+            if state is not None and state.due == due:
+                return
+            heapq.heappop(heap)
+
+    def next_due(self, now=None):
+        """Returns the most overdue CardState, or None when nothing is due."""
+        now = time.time() if now is None else now
+        self._clean_top()
+        if self._heap and self._heap[0][0] <= now:
+            return self._cards[self._heap[0][2]]
+        return None
+
+    def next_due_time(self):
+        """When the next card becomes due, or None for an empty deck."""
+        self._clean_top()
+        return self._heap[0][0] if self._heap else None
+
+    def review(self, card_id, quality, now=None):
+        """Records an answer for a card and reschedules it."""
+        now = time.time() if now is None else now
+        state = self._cards[card_id]
+        sm2_update(state, quality, now)
+        heapq.heappush(self._heap, (state.due, next(self._sequence), card_id))
+        self.dirty.add(card_id)
+        # Rebuild once stale entries dominate, so the heap stays O(n)
+        if len(self._heap) > 2 * len(self._cards) + 64:
+            self._heap = [(state.due, next(self._sequence), key) for key, state in self._cards.items()]
+            heapq.heapify(self._heap)
+        return state
+
+    def due_count(self, now=None):
+        """Number of cards due now (a linear scan; for display, not for the review loop)."""
+        now = time.time() if now is None else now
+        return sum(1 for state in self._cards.values() if state.due <= now)
+
+    def take_dirty_rows(self):
+        """Returns the rows of cards changed since the last call, for saving."""
+        rows = [self._cards[key].as_row() for key in self.dirty if key in self._cards]
+        self.dirty = set()
+        return rows
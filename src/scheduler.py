@@ -0,0 +1,429 @@
+"""Process-wide scheduler for model requests.
+
+All sessions of one Streamlit server share a RequestScheduler, which:
+
+- caps the number of concurrent model calls,
+- enforces requests-per-minute and tokens-per-minute budgets with token buckets,
+- serves interactive chat before background work (flashcards, titles),
+- queues each session's requests separately and serves sessions round-robin
+  within a priority, so one user's big deck cannot starve everyone else,
+- turns requests away with SchedulerBusy once a session, or the server,
+  has too many waiting (admission control),
+- retries rate-limit and transient server errors with jittered exponential backoff,
+  putting the job back in its lane until then rather than holding a worker,
+- coalesces identical in-flight generate requests into a single call,
+- stops a stream as soon as its reader closes it or goes away, so an
+  abandoned answer does not keep a worker reading it.
+
+ScheduledBackend exposes the scheduler as an ordinary LLMBackend.
+"""
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future
+
+import tracing
+from llm import LLMBackend, count_tokens, prompt_text
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Chunks a stream may get ahead of its reader before the worker waits for it
+STREAM_BUFFER_CHUNKS = 64
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded"}
+
+
+def is_retryable(error):
+    """True for rate limiting and transient server errors."""
+    code = getattr(error, "code", None)
+    try:
+        if code is not None and int(code) in RETRYABLE_CODES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return type(error).__name__ in RETRYABLE_NAMES
+
+
+class SchedulerBusy(RuntimeError):
+    """Raised when a request would exceed the scheduler's queue limits."""
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per period.
+
+    It never blocks: delay() says how long until an amount is available and
+    take() removes it, so a caller can wait on something else in the meantime.
+    """
+
+    def __init__(self, capacity, period_seconds=60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount=1.0):
+        """Seconds until amount tokens are available; 0 when they are now."""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount=1.0):
+        """Takes amount tokens; call it once delay(amount) is 0."""
+        with self._lock:
+            self._refill()
+            self.tokens -= min(float(amount), self.capacity)
+
+
+class _Job:
+    __slots__ = ("backend", "kind", "prompt", "options", "future", "chunks", "key", "tenant", "priority", "queued",
+                 "prompt_tokens", "estimated_tokens", "attempt", "not_before", "cancelled")
+
+    def __init__(self, backend, kind, prompt, options, key=None, tenant=None, priority=PRIORITY_BACKGROUND):
+        self.backend = backend
+        self.kind = kind
+        self.prompt = prompt
+        self.options = options
+        self.future = Future()
+        self.chunks = queue.Queue(STREAM_BUFFER_CHUNKS) if kind == "stream" else None
+        self.key = key
+        self.tenant = tenant
+        self.priority = priority
+        self.queued = time.perf_counter()
+        self.prompt_tokens = count_tokens(prompt_text(prompt))
+        self.estimated_tokens = self.prompt_tokens + (options.get("max_output_tokens") or 0)
+        self.attempt = 0
+        self.not_before = 0.0  # time.monotonic() before which a job backing off after an error may not run
+        self.cancelled = False  # set when the reader of a stream closes it; the worker then stops reading
+
+
+_STREAM_END = object()
+
+
+class ScheduledStream:
+    """The chunks of a scheduled stream, in order. Closing it (or dropping it) cancels the job."""
+
+    def __init__(self, scheduler, job):
+        self._scheduler = scheduler
+        self._job = job
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        chunk = self._job.chunks.get()
+        if chunk is not _STREAM_END:
+            return chunk
+        self._finished = True
+        error = self._job.future.exception()
+        if error is not None:
+            raise error
+        raise StopIteration
+
+    def close(self):
+        """Stops the stream: a job still queued is dropped, a running one stops reading the model's response."""
+        if not self._finished:
+            self._finished = True
+            self._scheduler._cancel(self._job)
+
+    def __del__(self):
+        self.close()
+
+
+class RequestScheduler:
+    """Per-session queues of model calls drained by a fixed pool of worker threads.
+
+    Jobs wait in one lane per (priority, tenant), where the tenant is usually
+    a session id. Workers take the highest priority that has work and, within
+    it, one job from each tenant in turn. max_queued_per_tenant and
+    max_queued bound the jobs waiting (not yet running); None means no limit.
+
+    Workers never sleep: a job that hits a retryable error goes back to the
+    head of its lane with a not-before time, and when the rate limits are
+    spent workers wait on the queue's condition until the buckets refill, so
+    new work is still noticed and other lanes keep being served.
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=1_000_000, max_concurrency=8,
+                 max_retries=4, base_delay_seconds=1.0, max_delay_seconds=30.0,
+                 max_queued_per_tenant=None, max_queued=None):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_queued_per_tenant = max_queued_per_tenant
+        self.max_queued = max_queued
+        self.retries = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._lanes = {}  # priority -> OrderedDict of tenant -> deque of jobs, in round-robin order
+        self._waiting = defaultdict(int)
+        self._queued = 0
+        self._running = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._random = random.Random()
+        for index in range(max_concurrency):
+            threading.Thread(target=self._worker, name=f"llm-scheduler-{index}", daemon=True).start()
+
+    @staticmethod
+    def _coalesce_key(backend, prompt, options):
+        digest = hashlib.sha256(prompt_text(prompt).encode("utf-8"))
+        if not isinstance(prompt, str):
+            # Image parts (e.g. scanned pages) differ between prompts with the same text
+            for content in prompt:
+                for part in content.get("parts", []):
+                    if isinstance(part, dict) and "inline_data" in part:
+                        digest.update(hashlib.sha256(part["inline_data"]["data"]).digest())
+        digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+        return id(backend), digest.hexdigest()
+
+    def submit(self, backend, prompt, priority=PRIORITY_BACKGROUND, tenant=None, **options):
+        """Schedules backend.generate(prompt, **options) and returns a Future of the text.
+
+        Raises SchedulerBusy when the tenant or the server already has too many requests waiting.
+        """
+        key = self._coalesce_key(backend, prompt, options)
+        job = _Job(backend, "generate", prompt, options, key, tenant, priority)
+        with self._lock:
+            existing = self._in_flight.get(key)
+            if existing is not None:
+                self.coalesced += 1
+                return existing.future
+            self._enqueue(job)
+            self._in_flight[key] = job
+        return job.future
+
+    def stream(self, backend, prompt, priority=PRIORITY_INTERACTIVE, tenant=None, **options):
+        """Schedules backend.stream(prompt, **options) and returns a ScheduledStream of its chunks.
+
+        The job is queued straight away. Raises SchedulerBusy like submit.
+        """
+        job = _Job(backend, "stream", prompt, options, tenant=tenant, priority=priority)
+        with self._lock:
+            self._enqueue(job)
+        return ScheduledStream(self, job)
+
+    def _cancel(self, job):
+        """Marks a stream cancelled and drops it from its lane if no worker has taken it yet."""
+        with self._lock:
+            job.cancelled = True
+            jobs = self._lanes.get(job.priority, {}).get(job.tenant)
+            if jobs is None or job not in jobs:
+                return
+            jobs.remove(job)
+            if not jobs:
+                lanes = self._lanes[job.priority]
+                del lanes[job.tenant]
+                if not lanes:
+                    del self._lanes[job.priority]
+            self._waiting[job.tenant] -= 1
+            if not self._waiting[job.tenant]:
+                del self._waiting[job.tenant]
+            self._queued -= 1
+
+    def _enqueue(self, job):
+        """Admits a job into its tenant's lane; the caller holds the lock."""
+        if (self.max_queued is not None and self._queued >= self.max_queued) or \
+                (self.max_queued_per_tenant is not None and self._waiting.get(job.tenant, 0) >= self.max_queued_per_tenant):
+            self.rejected += 1
+            tracing.count("scheduler.rejected")
+            raise SchedulerBusy("Too many requests are waiting for the model; please try again in a moment.")
+        self._add(job, deque.append)
+
+    def _requeue(self, job, delay):
+        """Puts a job that will be retried back at the head of its lane; the caller holds the lock.
+
+        It was admitted already, so the queue limits do not apply.
+        """
+        job.not_before = time.monotonic() + delay
+        self._add(job, deque.appendleft)
+
+    def _add(self, job, insert):
+        lanes = self._lanes.setdefault(job.priority, OrderedDict())
+        insert(lanes.setdefault(job.tenant, deque()), job)
+        self._waiting[job.tenant] += 1
+        self._queued += 1
+        self._ready.notify()
+
+    def _ready_lane(self, now):
+        """Returns (lanes, tenant, 0) of the next job allowed to run now, or (None, None, seconds until one is)."""
+        wait = None
+        for priority in sorted(self._lanes):
+            lanes = self._lanes[priority]
+            for tenant, jobs in lanes.items():
+                # A tenant's jobs run in order, so a job backing off holds back the rest of its lane
+                if jobs[0].not_before <= now:
+                    return lanes, tenant, 0.0
+                wait = jobs[0].not_before - now if wait is None else min(wait, jobs[0].not_before - now)
+        return None, None, wait
+
+    def _next_job(self):
+        """Blocks until a job may run and takes the next one in priority, then round-robin, order.
+
+        Jobs backing off are skipped until their not-before time, and nothing
+        is taken while the rate limit buckets are empty.
+        """
+        with self._ready:
+            while True:
+                if not self._queued:
+                    self._ready.wait()
+                    continue
+                lanes, tenant, wait = self._ready_lane(time.monotonic())
+                if lanes is None:
+                    self._ready.wait(wait)
+                    continue
+                jobs = lanes[tenant]
+                wait = max(self.request_bucket.delay(1), self.token_bucket.delay(jobs[0].estimated_tokens))
+                if wait > 0:
+                    self._ready.wait(wait)
+                    continue
+                job = jobs.popleft()
+                self.request_bucket.take(1)
+                self.token_bucket.take(job.estimated_tokens)
+                break
+            if jobs:
+                lanes.move_to_end(tenant)
+            else:
+                del lanes[tenant]
+                if not lanes:
+                    del self._lanes[job.priority]
+            self._waiting[tenant] -= 1
+            if not self._waiting[tenant]:
+                del self._waiting[tenant]
+            self._queued -= 1
+            self._running += 1
+            return job
+
+    def stats(self):
+        """Current queue depth and lifetime counters, for the admin panel."""
+        with self._lock:
+            return {"queued": self._queued, "running": self._running, "waiting_sessions": len(self._waiting),
+                    "workers": self.max_concurrency, "rejected": self.rejected, "coalesced": self.coalesced,
+                    "retries": self.retries}
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        return self._random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempt))
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            retry_delay = None
+            try:
+                retry_delay = self._run(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if retry_delay is not None:
+                        self._requeue(job, retry_delay)
+                    elif job.key is not None:
+                        self._in_flight.pop(job.key, None)
+
+    @staticmethod
+    def _put_chunk(job, chunk):
+        """Hands a chunk to the stream's reader, waiting while its buffer is full; False once it is cancelled."""
+        while not job.cancelled:
+            try:
+                job.chunks.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, job):
+        """Makes one attempt at a job; returns the backoff delay when it should be retried, otherwise None."""
+        if job.cancelled:
+            return None  # closed by its reader after a worker took it
+        queue_seconds = time.perf_counter() - job.queued
+        started = time.perf_counter()
+        started_streaming = False
+        response_characters = 0
+        error = None
+        try:
+            if job.kind == "generate":
+                text = job.backend.generate(job.prompt, **job.options)
+                response_characters = len(text)
+                job.future.set_result(text)
+            else:
+                chunks = job.backend.stream(job.prompt, **job.options)
+                try:
+                    for chunk in chunks:
+                        started_streaming = True
+                        response_characters += len(chunk)
+                        if not self._put_chunk(job, chunk):
+                            error = "Cancelled"
+                            break
+                finally:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+                job.future.set_result(None)
+                self._put_chunk(job, _STREAM_END)
+        except Exception as e:
+            # A stream that already produced output cannot be replayed transparently
+            if job.attempt < self.max_retries and is_retryable(e) and not started_streaming and not job.cancelled:
+                with self._lock:
+                    self.retries += 1
+                delay = self._backoff(job.attempt)
+                job.attempt += 1
+                return delay
+            error = type(e).__name__
+            job.future.set_exception(e)
+            if job.chunks is not None:
+                self._put_chunk(job, _STREAM_END)
+        # Time of the final attempt; waiting for rate limits and backoff shows up in queue_seconds and attempts
+        attributes = {"error": error} if error else {}
+        tracing.record(f"llm.{job.kind}", time.perf_counter() - started, prompt_tokens=job.prompt_tokens,
+                       response_tokens=(response_characters + 3) // 4,
+                       queue_seconds=round(queue_seconds, 6), attempts=job.attempt + 1, **attributes)
+        return None
+
+
+class ScheduledBackend(LLMBackend):
+    """An LLMBackend whose calls go through a RequestScheduler at a fixed priority, on behalf of one tenant."""
+
+    def __init__(self, scheduler, backend, priority=PRIORITY_INTERACTIVE, tenant=None):
+        self.scheduler = scheduler
+        self.backend = backend
+        self.priority = priority
+        self.tenant = tenant
+        self.name = backend.name
+
+    def with_priority(self, priority):
+        return ScheduledBackend(self.scheduler, self.backend, priority, self.tenant)
+
+    def for_tenant(self, tenant):
+        """The same backend with requests queued (and admitted) as tenant's."""
+        return ScheduledBackend(self.scheduler, self.backend, self.priority, tenant)
+
+    def wrap(self, backend):
+        """Schedules another backend (e.g. one bound to a cached context) at this priority."""
+        return ScheduledBackend(self.scheduler, backend, self.priority, self.tenant)
+
+    def submit(self, prompt, **options):
+        """Schedules a generate call and returns its Future without waiting."""
+        return self.scheduler.submit(self.backend, prompt, self.priority, self.tenant, **options)
+
+    def generate(self, prompt, **options):
+        return self.submit(prompt, **options).result()
+
+    def stream(self, prompt, **options):
+        return self.scheduler.stream(self.backend, prompt, self.priority, self.tenant, **options)
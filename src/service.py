@@ -0,0 +1,158 @@
+"""Work shared by every session of one server process.
+
+Streamlit runs each session's script on a thread of its own. Left to
+themselves, sessions would each make blocking model calls, start their
+own pools and keep their own caches, so a busy server would do as many
+things at once as it had users, with nobody deciding who goes first.
+
+FlashMindService is created once per process (st.cache_resource) and
+owns the pools that do the actual work:
+
+- a RequestScheduler whose worker threads make every model call, with a
+  queue per session served round-robin and limits on waiting requests,
+- a process pool for CPU-bound extraction (PDF parsing, local OCR),
+- a thread pool that reads uploads page by page, so long extractions
+  never hold up the short jobs below,
+- a thread pool for background jobs that mostly wait on the model
+  (subject titles, history summaries),
+- the cache of extracted pages.
+
+Both thread pools keep a queue per session and serve sessions in turn,
+so one session's large upload cannot keep another's jobs waiting.
+
+A session gets a backend bound to its id with llm_for() and hands other
+background jobs to submit() (uploads to submit_extraction()); all return futures (or streams) that the
+script polls or waits on, and both turn work away with SchedulerBusy
+once the session has too much queued. Throughput is therefore set by the
+pool sizes rather than by the number of script threads.
+"""
+import os
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from extraction import PageCache
+from scheduler import PRIORITY_INTERACTIVE, RequestScheduler, ScheduledBackend, SchedulerBusy
+
+
+class FairThreadPool:
+    """A thread pool with a FIFO queue per key, taking one job from each key in turn."""
+
+    def __init__(self, max_workers, thread_name_prefix="flashmind"):
+        self._queues = OrderedDict()  # key -> deque of (future, fn, args, kwargs); next key to serve first
+        self._shutdown = False
+        self._ready = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{thread_name_prefix}-{index}", daemon=True)
+            for index in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) behind the other jobs of key and returns its Future."""
+        future = Future()
+        with self._ready:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new jobs after shutdown")
+            self._queues.setdefault(key, deque()).append((future, fn, args, kwargs))
+            self._ready.notify()
+        return future
+
+    def _next_job(self):
+        with self._ready:
+            self._ready.wait_for(lambda: self._queues or self._shutdown)
+            if not self._queues:
+                return None
+            key, jobs = self._queues.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                self._queues[key] = jobs  # back of the line until every other key has had a turn
+            return job
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self, wait=True):
+        """Runs the jobs already queued, then stops the workers."""
+        with self._ready:
+            self._shutdown = True
+            self._ready.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class FlashMindService:
+    """Process-wide pools, queues and caches that sessions submit their work to."""
+
+    def __init__(self, backend, llm_workers=8, extraction_workers=None, reader_workers=4, background_workers=8,
+                 requests_per_minute=60, tokens_per_minute=1_000_000, max_queued_per_session=16, max_queued=256):
+        self.backend = backend
+        self.scheduler = RequestScheduler(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                                          max_concurrency=llm_workers, max_queued_per_tenant=max_queued_per_session,
+                                          max_queued=max_queued)
+        self.extraction_pool = ProcessPoolExecutor(
+            max_workers=extraction_workers or max(1, (os.cpu_count() or 2) - 1))
+        self.reader_pool = FairThreadPool(reader_workers, thread_name_prefix="flashmind-reader")
+        self.background_pool = FairThreadPool(background_workers, thread_name_prefix="flashmind-bg")
+        self.page_cache = PageCache()
+        self.max_queued_per_session = max_queued_per_session
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def llm_for(self, session_id=None, priority=PRIORITY_INTERACTIVE):
+        """The model backend as seen by one session: its calls wait in that session's queue."""
+        return ScheduledBackend(self.scheduler, self.backend, priority, session_id)
+
+    def submit(self, session_id, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the background pool for a session and returns its Future.
+
+        Raises SchedulerBusy when the session already has max_queued_per_session jobs unfinished.
+        """
+        return self._submit(self.background_pool, session_id, fn, *args, **kwargs)
+
+    def submit_extraction(self, session_id, fn, *args, **kwargs):
+        """Like submit, but on the reader pool meant for jobs that read a whole upload."""
+        return self._submit(self.reader_pool, session_id, fn, *args, **kwargs)
+
+    def _submit(self, pool, session_id, fn, *args, **kwargs):
+        with self._lock:
+            if self.max_queued_per_session is not None and self._pending[session_id] >= self.max_queued_per_session:
+                raise SchedulerBusy("Too many background jobs are running for this session; please try again in a moment.")
+            self._pending[session_id] += 1
+        try:
+            future = pool.submit(session_id, fn, *args, **kwargs)
+        except BaseException:
+            self._finished(session_id)
+            raise
+        future.add_done_callback(lambda _: self._finished(session_id))
+        return future
+
+    def _finished(self, session_id):
+        with self._lock:
+            self._pending[session_id] -= 1
+            if not self._pending[session_id]:
+                del self._pending[session_id]
+
+    def stats(self):
+        """Scheduler queue depths and counters plus the number of unfinished background jobs."""
+        stats = self.scheduler.stats()
+        with self._lock:
+            stats["background_jobs"] = sum(self._pending.values())
+        return stats
+
+    def shutdown(self, wait=True):
+        self.background_pool.shutdown(wait=wait)
+        self.reader_pool.shutdown(wait=wait)
+        self.extraction_pool.shutdown(wait=wait)
@@ -0,0 +1,219 @@
+"""Persistent storage for documents, chunk indexes, titles, decks, sessions
+and spaced-repetition review state.
+
+Everything is keyed by content hash in one SQLite database (WAL mode, so
+readers never block the writer), with zlib-compressed blobs. Uploading a
+document someone already studied reuses its extracted text, chunks, title
+and flashcards. Documents are evicted least recently used first once the
+store exceeds its size quota, and sessions can be resumed by id.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+
+def text_hash(text):
+    """Content hash used as the key of pasted documents."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode("utf-8"), 6)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class DocumentStore:
+    """Thread-safe SQLite store shared by all sessions of the process."""
+
+    def __init__(self, path, max_bytes=500 * 1024 * 1024, max_sessions=5000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                hash TEXT PRIMARY KEY,
+                name TEXT,
+                text BLOB NOT NULL,
+                chunks BLOB,
+                title TEXT,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS decks (
+                key TEXT PRIMARY KEY,
+                doc_hash TEXT,
+                cards BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                doc_hash TEXT,
+                state BLOB NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS review_cards (
+                learner TEXT NOT NULL,
+                card_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                ease REAL NOT NULL,
+                interval REAL NOT NULL,
+                repetitions INTEGER NOT NULL,
+                lapses INTEGER NOT NULL,
+                due REAL NOT NULL,
+                last_review REAL,
+                PRIMARY KEY (learner, card_id)
+            );
+            CREATE INDEX IF NOT EXISTS decks_doc_hash ON decks (doc_hash);
+            CREATE INDEX IF NOT EXISTS documents_accessed ON documents (accessed);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+            """
+        )
+        self._conn.commit()
+
+    def _execute(self, sql, params=(), commit=False):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            if commit:
+                self._conn.commit()
+            return rows
+
+    # --- Documents ---
+    def get_document(self, doc_hash):
+        """Returns {"name", "text", "chunks", "title"} or None; marks the document as recently used."""
+        rows = self._execute("SELECT name, text, chunks, title FROM documents WHERE hash = ?", (doc_hash,))
+        if not rows:
+            return None
+        self._execute("UPDATE documents SET accessed = ? WHERE hash = ?", (time.time(), doc_hash), commit=True)
+        name, text, chunks, title = rows[0]
+        return {
+            "name": name,
+            "text": zlib.decompress(text).decode("utf-8"),
+            "chunks": _unpack(chunks) if chunks else None,
+            "title": title,
+        }
+
+    def put_document(self, doc_hash, text, name=None, chunks=None, title=None):
+        text_blob = zlib.compress(text.encode("utf-8"), 6)
+        chunks_blob = _pack(chunks) if chunks is not None else None
+        size = len(text_blob) + len(chunks_blob or b"")
+        self._execute(
+            """
+            INSERT INTO documents (hash, name, text, chunks, title, size, accessed) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET text = excluded.text, chunks = COALESCE(excluded.chunks, chunks),
+                title = COALESCE(excluded.title, title), size = excluded.size, accessed = excluded.accessed
+            """,
+            (doc_hash, name, text_blob, chunks_blob, title, size, time.time()),
+            commit=True,
+        )
+        self.enforce_quota()
+
+    def set_title(self, doc_hash, title):
+        self._execute("UPDATE documents SET title = ? WHERE hash = ?", (title, doc_hash), commit=True)
+
+    # --- Flashcard decks (usable as the disk tier of FlashcardCache) ---
+    def get(self, key):
+        rows = self._execute("SELECT cards FROM decks WHERE key = ?", (key,))
+        if not rows:
+            return None
+        self._execute("UPDATE decks SET accessed = ? WHERE key = ?", (time.time(), key), commit=True)
+        return _unpack(rows[0][0])
+
+    def set(self, key, cards, doc_hash=None):
+        blob = _pack(cards)
+        self._execute(
+            "INSERT OR REPLACE INTO decks (key, doc_hash, cards, size, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, doc_hash, blob, len(blob), time.time()),
+            commit=True,
+        )
+        self.enforce_quota()
+
+    # --- Sessions ---
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex[:16]
+
+    def save_session(self, session_id, doc_hash, state):
+        self._execute(
+            "INSERT OR REPLACE INTO sessions (id, doc_hash, state, updated) VALUES (?, ?, ?, ?)",
+            (session_id, doc_hash, _pack(state), time.time()),
+            commit=True,
+        )
+
+    def load_session(self, session_id):
+        """Returns (doc_hash, state) or None."""
+        rows = self._execute("SELECT doc_hash, state FROM sessions WHERE id = ?", (session_id,))
+        if not rows:
+            return None
+        return rows[0][0], _unpack(rows[0][1])
+
+    # --- Spaced-repetition state ---
+    def load_review_cards(self, learner):
+        """Returns the review rows of a learner, in CardState field order."""
+        return self._execute(
+            "SELECT card_id, question, answer, ease, interval, repetitions, lapses, due, last_review FROM review_cards WHERE learner = ?",
+            (learner,),
+        )
+
+    def save_review_cards(self, learner, rows):
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO review_cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(learner,) + tuple(row) for row in rows],
+            )
+            self._conn.commit()
+
+    # --- Quotas ---
+    def total_bytes(self):
+        rows = self._execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM documents) + (SELECT COALESCE(SUM(size), 0) FROM decks)"
+        )
+        return rows[0][0]
+
+    def enforce_quota(self):
+        """Evicts least recently used decks and documents until under max_bytes, and trims old sessions."""
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT (SELECT COALESCE(SUM(size), 0) FROM documents) + (SELECT COALESCE(SUM(size), 0) FROM decks)"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                candidates = self._conn.execute(
+                    """
+                    SELECT 'document', hash, size, accessed FROM documents
+                    UNION ALL SELECT 'deck', key, size, accessed FROM decks
+                    ORDER BY accessed ASC
+                    """
+                ).fetchall()
+                for kind, key, size, _ in candidates:
+                    if total <= self.max_bytes:
+                        break
+                    if kind == "document":
+                        self._conn.execute("DELETE FROM documents WHERE hash = ?", (key,))
+                    else:
+                        self._conn.execute("DELETE FROM decks WHERE key = ?", (key,))
+                    total -= size
+            self._conn.execute(
+                "DELETE FROM sessions WHERE id NOT IN (SELECT id FROM sessions ORDER BY updated DESC LIMIT ?)",
+                (self.max_sessions,),
+            )
+            self._conn.commit()
@@ -0,0 +1,46 @@
+"""Throttled rendering of streamed model output.
+
+Re-rendering the whole growing answer on every chunk sends O(n^2) bytes to
+the browser. StreamRenderer accumulates chunks in a buffer and only pushes
+the text to its placeholder a few times per second.
+"""
+import io
+import time
+
+
+class StreamRenderer:
+    """Accumulates streamed chunks and updates a Streamlit placeholder at a bounded rate."""
+
+    def __init__(self, placeholder, max_updates_per_second=10, cursor="▌"):
+        self.placeholder = placeholder
+        self.min_interval = 1.0 / max_updates_per_second
+        self.cursor = cursor
+        self.updates = 0
+        self._buffer = io.StringIO()
+        self._last_flush = 0.0
+
+    def write(self, chunk):
+        """Adds a chunk; renders only if the last update is older than the flush interval."""
+        if not chunk:
+            return
+        self._buffer.write(chunk)
+        now = time.monotonic()
+        if now - self._last_flush >= self.min_interval:
+            self._render(self._buffer.getvalue() + self.cursor)
+            self._last_flush = now
+
+    def _render(self, text):
+        self.placeholder.markdown(text)
+        self.updates += 1
+
+    def close(self):
+        """Renders the final text without the cursor and returns it."""
+        text = self._buffer.getvalue()
+        self._render(text)
+        return text
+
+    def consume(self, chunks):
+        """Renders a whole stream and returns the complete text."""
+        for chunk in chunks:
+            self.write(chunk)
+        return self.close()
@@ -0,0 +1,58 @@
+"""Subject title inference for uploaded or pasted documents.
+
+A keyword-based title is available instantly and is shown while the model
+infers a better one in the background.
+"""
+import re
+from collections import Counter
+
+import tracing
+from retrieval import tokenize
+
+# Only the opening of the document is needed to name its subject
+TITLE_SAMPLE_CHARS = 2000
+
+SUBJECT_PROMPT_TEMPLATE = """
+        Analyze the following document text and provide a concise, general subject title (e.g., "Photosynthesis", "World War II", "Python Programming Basics").
+        Document:
+        ---
+        {sample}
+        ---
+        Subject Title:
+        """
+
+CAPITALIZED_PHRASE = re.compile(r"\b([A-Z][a-z]{2,}(?:\s+[A-Z][a-z]{2,}){0,2})\b")
+
+
+def heuristic_title(text, fallback="your document"):
+    """Guesses a title from the most frequent capitalized phrases and keywords of the opening text."""
+    sample = text[:TITLE_SAMPLE_CHARS]
+    phrases = Counter()
+    for phrase in CAPITALIZED_PHRASE.findall(sample):
+        # Drop sentence-initial stopwords such as "The" or "In"
+        words = phrase.split()
+        while words and not tokenize(words[0]):
+            words.pop(0)
+        if words:
+            phrases[" ".join(words)] += 1
+    # Multi-word phrases repeated in the text are the strongest signal
+    for phrase, count in phrases.most_common():
+        if count > 1 and len(phrase.split()) > 1:
+            return phrase
+    keywords = Counter(token for token in tokenize(sample) if len(token) > 3 and not token.isdigit())
+    if not keywords:
+        return fallback
+    return " ".join(word.capitalize() for word, _ in keywords.most_common(2))
+
+
+def clean_title(response):
+    """Strips quotes, markdown and a leading "Subject Title:" from a model response."""
+    title = response.strip().splitlines()[0] if response.strip() else ""
+    title = re.sub(r"^subject title\s*:\s*", "", title.strip(" *#\"'`"), flags=re.IGNORECASE)
+    return title.strip(" *#\"'`")
+
+
+def infer_subject_title(llm, text):
+    """Asks the model for a subject title based on the opening of the text."""
+    with tracing.span("title"):
+        return clean_title(llm.generate(SUBJECT_PROMPT_TEMPLATE.format(sample=text[:TITLE_SAMPLE_CHARS])))
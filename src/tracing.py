@@ -0,0 +1,302 @@
+"""Lightweight per-stage tracing: wall time, tokens, cache hits and counters.
+
+Code marks a stage with a context manager,
+
+    with tracing.span("title", prompt_tokens=120) as span:
+        ...
+        span.set(response_tokens=8)
+
+and the process-wide Tracer keeps the recent durations of every stage for
+percentiles, running totals, and event counters (reruns, cache hits).
+While tracing is disabled span() returns a shared no-op object, so an
+instrumented call costs one attribute check.
+
+Spans can be appended to a JSONL file and the aggregates exported in the
+Prometheus text format, written to a file and/or served on /metrics, by a
+background exporter thread.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRIC_PREFIX = "flashmind"
+QUANTILES = (0.5, 0.95, 0.99)
+TOKEN_ATTRIBUTES = ("prompt_tokens", "response_tokens")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "stage", "attributes", "started")
+
+    def __init__(self, tracer, stage, attributes):
+        self.tracer = tracer
+        self.stage = stage
+        self.attributes = attributes
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.record(self.stage, time.perf_counter() - self.started, **self.attributes)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _StageStats:
+    __slots__ = ("durations", "count", "total_seconds", "errors", "tokens")
+
+    def __init__(self, window):
+        self.durations = deque(maxlen=window)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.errors = 0
+        self.tokens = dict.fromkeys(TOKEN_ATTRIBUTES, 0)
+
+
+class Tracer:
+    """Thread-safe collector of spans and counters, shared by every session of the process."""
+
+    def __init__(self, enabled=False, window=1000, recent=2000, jsonl_path=None):
+        self.enabled = enabled
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self._stages = {}
+        self._counters = defaultdict(int)
+        self._recent = deque(maxlen=recent)
+        self._unwritten = []
+        self._lock = threading.Lock()
+
+    def span(self, stage, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, stage, attributes)
+
+    def record(self, stage, seconds, **attributes):
+        """Records a finished stage (for timings measured without a span, e.g. time to first chunk)."""
+        if not self.enabled:
+            return
+        entry = {"ts": round(time.time(), 3), "stage": stage, "seconds": round(seconds, 6)}
+        entry.update(attributes)
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _StageStats(self.window)
+            stats.durations.append(seconds)
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.errors += "error" in attributes
+            for name in TOKEN_ATTRIBUTES:
+                stats.tokens[name] += attributes.get(name) or 0
+            self._recent.append(entry)
+            if self.jsonl_path:
+                self._unwritten.append(entry)
+
+    def count(self, event, amount=1):
+        """Increments an event counter such as a rerun or a cache hit."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[event] += amount
+
+    def stream(self, stage, chunks, **attributes):
+        """Passes a stream of text chunks through, recording time to first chunk, total time and response tokens."""
+        if not self.enabled:
+            yield from chunks
+            return
+        started = time.perf_counter()
+        first_chunk = None
+        characters = 0
+        error = None
+        try:
+            for chunk in chunks:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                    self.record(f"{stage}.first_chunk", first_chunk)
+                characters += len(chunk)
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            attributes["response_tokens"] = (characters + 3) // 4
+            if first_chunk is not None:
+                attributes["first_chunk_seconds"] = round(first_chunk, 6)
+            if error:
+                attributes["error"] = error
+            self.record(stage, time.perf_counter() - started, **attributes)
+
+    # --- Reading ---
+    def summary(self):
+        """One row per stage: count, recent percentiles in milliseconds, and token totals."""
+        with self._lock:
+            stages = {stage: (list(stats.durations), stats.count, stats.errors, dict(stats.tokens))
+                      for stage, stats in self._stages.items()}
+        rows = []
+        for stage in sorted(stages):
+            durations, count, errors, tokens = stages[stage]
+            row = {"stage": stage, "count": count, "errors": errors}
+            for quantile in QUANTILES:
+                row[f"p{int(quantile * 100)}_ms"] = round(percentile(durations, quantile) * 1000, 1)
+            row.update(tokens)
+            rows.append(row)
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def recent_jsonl(self):
+        with self._lock:
+            return "".join(json.dumps(entry) + "\n" for entry in self._recent)
+
+    # --- Export ---
+    def flush(self):
+        """Appends the spans recorded since the last flush to the JSONL file."""
+        with self._lock:
+            entries, self._unwritten = self._unwritten, []
+        if not entries or not self.jsonl_path:
+            return
+        directory = os.path.dirname(self.jsonl_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    def prometheus_text(self):
+        with self._lock:
+            stages = {stage: (list(stats.durations), stats.count, stats.total_seconds, stats.errors, dict(stats.tokens))
+                      for stage, stats in self._stages.items()}
+            counters = dict(self._counters)
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Wall time per stage (quantiles over the recent window).", f"# TYPE {name} summary"]
+        for stage in sorted(stages):
+            durations, count, total_seconds, _, _ = stages[stage]
+            for quantile in QUANTILES:
+                lines.append(f'{name}{{stage="{_label(stage)}",quantile="{quantile}"}} {percentile(durations, quantile):.6f}')
+            lines.append(f'{name}_sum{{stage="{_label(stage)}"}} {total_seconds:.6f}')
+            lines.append(f'{name}_count{{stage="{_label(stage)}"}} {count}')
+        for metric, help_text, values in (
+            ("stage_errors_total", "Stages that ended with an exception.", {stage: item[3] for stage, item in stages.items()}),
+            ("stage_prompt_tokens_total", "Prompt tokens per stage.", {stage: item[4]["prompt_tokens"] for stage, item in stages.items()}),
+            ("stage_response_tokens_total", "Response tokens per stage.", {stage: item[4]["response_tokens"] for stage, item in stages.items()}),
+        ):
+            lines += [f"# HELP {METRIC_PREFIX}_{metric} {help_text}", f"# TYPE {METRIC_PREFIX}_{metric} counter"]
+            lines += [f'{METRIC_PREFIX}_{metric}{{stage="{_label(stage)}"}} {value}' for stage, value in sorted(values.items())]
+        name = f"{METRIC_PREFIX}_events_total"
+        lines += [f"# HELP {name} Event counters (reruns, cache hits and misses).", f"# TYPE {name} counter"]
+        lines += [f'{name}{{event="{_label(event)}"}} {value}' for event, value in sorted(counters.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically replaces path with the current metrics (for node_exporter's textfile collector)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """Serves the metrics at http://host:port/metrics on a daemon thread and returns the server."""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+    def start_exporter(self, interval_seconds=10.0, metrics_path=None):
+        """Flushes JSONL and rewrites the Prometheus file every interval_seconds on a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.flush()
+                    if metrics_path:
+                        self.write_prometheus(metrics_path)
+                except OSError:
+                    pass  # a full disk or a missing mount must not take the app down
+
+        threading.Thread(target=run, name="metrics-exporter", daemon=True).start()
+
+
+# --- Process-wide tracer ---
+_tracer = Tracer()
+
+
+def configure(tracer):
+    """Installs the process-wide tracer used by span(), record(), count() and stream()."""
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(stage, **attributes):
+    return _tracer.span(stage, **attributes)
+
+
+def record(stage, seconds, **attributes):
+    _tracer.record(stage, seconds, **attributes)
+
+
+def count(event, amount=1):
+    _tracer.count(event, amount)
+
+
+def stream(stage, chunks, **attributes):
+    return _tracer.stream(stage, chunks, **attributes)
@@ -0,0 +1,136 @@
+"""Multi-document workspaces.
+
+A workspace holds every document a learner is studying together, with one
+combined chunk index over all of them. Each chunk records the document it
+came from, so chat and flashcards can target one document, a subset or
+the whole workspace. The index only ever grows: adding a document, or
+pages of a document that finish extracting later, chunks and indexes just
+that text and never touches what is already indexed.
+"""
+from retrieval import BM25Index, EmbeddingIndex, chunk_text, reciprocal_rank_fusion
+
+
+class WorkspaceDocument:
+    __slots__ = ("doc_id", "name", "text", "title", "chunk_ids")
+
+    def __init__(self, doc_id, name, text="", title=None):
+        self.doc_id = doc_id
+        self.name = name
+        self.text = text
+        self.title = title
+        self.chunk_ids = []
+
+
+class WorkspaceIndex:
+    """BM25 (plus optional embeddings) over the chunks of every document, with each chunk's source."""
+
+    def __init__(self, embed_fn=None):
+        self.embed_fn = embed_fn
+        self.chunks = []
+        self.sources = []
+        self.lexical = BM25Index()
+        self.embeddings = None
+
+    def add(self, doc_id, chunks):
+        """Indexes chunks of one document and returns their ids."""
+        chunk_ids = []
+        for chunk in chunks:
+            chunk_ids.append(self.lexical.add(chunk))
+            self.chunks.append(chunk)
+            self.sources.append(doc_id)
+        if self.embed_fn and chunks:
+            if self.embeddings is None:
+                self.embeddings = EmbeddingIndex(chunks, self.embed_fn)
+            else:
+                self.embeddings.add(chunks)
+        return chunk_ids
+
+    def search(self, query, top_k=5, doc_ids=None):
+        """Returns up to top_k chunk ids for the query, only from doc_ids when given."""
+        allowed = set(doc_ids) if doc_ids else None
+        lexical = [
+            (chunk_id, score) for chunk_id, score in self.lexical.scores(query).items()
+            if allowed is None or self.sources[chunk_id] in allowed
+        ]
+        ranked = [chunk_id for chunk_id, _ in sorted(lexical, key=lambda item: item[1], reverse=True)[:top_k]]
+        if self.embeddings is not None:
+            # Over-fetch so filtering by document still leaves top_k candidates
+            wanted = top_k if allowed is None else top_k * 4
+            semantic = [
+                chunk_id for chunk_id, _ in self.embeddings.search(query, wanted)
+                if allowed is None or self.sources[chunk_id] in allowed
+            ][:top_k]
+            ranked = reciprocal_rank_fusion((ranked, semantic), top_k)
+        return ranked
+
+
+class Workspace:
+    """The documents of one study session and their combined index."""
+
+    def __init__(self, chunk_size=1200, overlap=200, embed_fn=None):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.documents = {}
+        self.index = WorkspaceIndex(embed_fn)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def names(self):
+        return {doc_id: document.name for doc_id, document in self.documents.items()}
+
+    def add_document(self, doc_id, name, text, chunks=None, title=None):
+        """Adds and indexes a document; stored chunks are indexed as they are. A document already here is kept."""
+        if doc_id in self.documents:
+            return self.documents[doc_id]
+        document = self.documents[doc_id] = WorkspaceDocument(doc_id, name, text, title)
+        if chunks is None:
+            chunks = chunk_text(text, self.chunk_size, self.overlap)
+        document.chunk_ids = self.index.add(doc_id, chunks)
+        return document
+
+    def extend_document(self, doc_id, text):
+        """Appends text to a document (e.g. pages that finished extracting) and indexes only that text."""
+        document = self.documents[doc_id]
+        document.text += text
+        document.chunk_ids += self.index.add(doc_id, chunk_text(text, self.chunk_size, self.overlap))
+
+    def document_chunks(self, doc_id):
+        return [self.index.chunks[chunk_id] for chunk_id in self.documents[doc_id].chunk_ids]
+
+    def selection(self, doc_ids=None):
+        """The ids of the targeted documents in workspace order; nothing selected means all of them."""
+        chosen = set(doc_ids or ())
+        return [doc_id for doc_id in self.documents if not chosen or doc_id in chosen]
+
+    def text(self, doc_ids=None):
+        """Full text of the targeted documents, each under its name when there is more than one."""
+        selected = self.selection(doc_ids)
+        if len(selected) == 1:
+            return self.documents[selected[0]].text
+        return "\n\n".join(f"## {self.documents[doc_id].name}\n\n{self.documents[doc_id].text}" for doc_id in selected)
+
+    def title_sample(self, max_chars):
+        """The opening of every document, sharing max_chars between them."""
+        share = max(1, max_chars // max(1, len(self.documents)))
+        return "\n\n".join(document.text[:share] for document in self.documents.values())
+
+    def retrieve(self, query, top_k=5, doc_ids=None):
+        """Passages relevant to the query from the targeted documents, labelled with their source when there are several."""
+        selected = self.selection(doc_ids)
+        if not selected:
+            return []
+        chunk_ids = self.index.search(query, top_k, None if len(selected) == len(self.documents) else selected)
+        if not chunk_ids:
+            # Nothing matched lexically (e.g. "summarize this"); fall back to the opening of each document
+            openings = [self.documents[doc_id].chunk_ids for doc_id in selected]
+            chunk_ids = [ids[position] for position in range(top_k) for ids in openings if position < len(ids)][:top_k]
+        order = {doc_id: position for position, doc_id in enumerate(self.documents)}
+        chunk_ids.sort(key=lambda chunk_id: (order[self.index.sources[chunk_id]], chunk_id))
+        if len(selected) == 1:
+            return [self.index.chunks[chunk_id] for chunk_id in chunk_ids]
+        return [f"[From {self.documents[self.index.sources[chunk_id]].name}]\n{self.index.chunks[chunk_id]}"
+                for chunk_id in chunk_ids]